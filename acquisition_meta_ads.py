@@ -1,35 +1,49 @@
 # acquisition_meta_ads.py
 # ROBO GLOBAL AI — BLOCO B (ACQUISITION ENGINE — META ADS)
-# Versão: 1.1 (fix import-safe)
+# Versão: 2.1 (estado persistido por campanha)
 # Data: 25/12/2025
 # EXECUÇÃO REAL — GASTO REAL — REGISTRO REAL
+#
+# Um único monitor acompanha várias campanhas/conjuntos de anúncios: insights,
+# ativação e pausa vão em requisições batch da Graph API sobre uma sessão
+# httpx com pool, e o intervalo entre verificações se adapta aos headers de
+# uso (X-App-Usage, X-Business-Use-Case-Usage, X-Ad-Account-Usage).
+# O estado de cada campanha vive em estado_aquisicao.py (memória + Postgres).
+# Só uma instância monitora por vez (lease "aquisicao_meta_ads").
 
+import asyncio
+import json
 import os
-import time
-import requests
-from datetime import datetime, timezone
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+import httpx
+
+import estado_aquisicao as estado
+import lease
+from log_estruturado import log
 
 # ================================
 # ORÇAMENTO
 # ================================
 
-DAILY_BUDGET = 10.00
-MAX_TEST_SPEND = 10.00
+DAILY_BUDGET = float(os.getenv("META_DAILY_BUDGET", "10.00"))
+MAX_TEST_SPEND = float(os.getenv("META_MAX_TEST_SPEND", "10.00"))  # teto padrão por campanha
 
 # ================================
-# ESTADO INTERNO (REAL)
+# MONITOR
 # ================================
 
-STATE: Dict[str, Any] = {
-    "status": "IDLE",
-    "campaign_id": None,
-    "adset_id": None,
-    "started_at": None,
-    "last_spend": 0.0,
-    "total_spend": 0.0,
-    "last_error": None,
-}
+META_GRAPH_URL = os.getenv("META_GRAPH_URL", "https://graph.facebook.com")
+META_MONITOR_INTERVALO_SECONDS = float(os.getenv("META_MONITOR_INTERVALO_SECONDS", "30"))
+META_MONITOR_INTERVALO_MAX_SECONDS = float(os.getenv("META_MONITOR_INTERVALO_MAX_SECONDS", "900"))
+META_POOL_CONEXOES = int(os.getenv("META_POOL_CONEXOES", "4"))
+
+LEASE_MONITOR = "aquisicao_meta_ads"
+
+BATCH_MAX = 50  # limite da Graph API por requisição batch
+ERROS_RATE_LIMIT = {4, 17, 32, 613, 80000, 80003, 80004, 80014}
+
+_uso: Dict[str, Any] = {"pct": 0.0, "bloqueado_ate": 0.0, "backoff": 0}
 
 # ================================
 # FUNÇÕES AUXILIARES
@@ -47,80 +61,274 @@ def _load_env():
 
     return token, account, version
 
-def _headers(token):
-    return {"Authorization": f"Bearer {token}"}
 
-def _post(url: str, data: dict, token: str):
-    response = requests.post(url, data=data, headers=_headers(token), timeout=30)
-    if not response.ok:
-        raise RuntimeError(response.text)
-    return response.json()
+def cliente_graph(token: str, version: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=f"{META_GRAPH_URL.rstrip('/')}/{version}",
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=30,
+        limits=httpx.Limits(max_connections=META_POOL_CONEXOES, max_keepalive_connections=META_POOL_CONEXOES),
+    )
+
+
+def _numero(valor: Any) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _registrar_uso(headers) -> None:
+    """Guarda o maior percentual de uso informado e o tempo para recuperar acesso."""
+    pct = 0.0
+    espera_min = 0.0
+
+    try:
+        for nome in ("x-app-usage", "x-ad-account-usage"):
+            dados = json.loads(headers.get(nome) or "{}")
+            for chave in ("call_count", "total_time", "total_cputime", "acc_id_util_pct"):
+                pct = max(pct, _numero(dados.get(chave)))
 
-def _get(url: str, params: dict, token: str):
-    response = requests.get(url, params=params, headers=_headers(token), timeout=30)
-    if not response.ok:
+        for entradas in json.loads(headers.get("x-business-use-case-usage") or "{}").values():
+            for e in entradas:
+                for chave in ("call_count", "total_time", "total_cputime"):
+                    pct = max(pct, _numero(e.get(chave)))
+                espera_min = max(espera_min, _numero(e.get("estimated_time_to_regain_access")))
+    except (ValueError, AttributeError):
+        pass
+
+    _uso["pct"] = pct
+    if espera_min:
+        _uso["bloqueado_ate"] = max(_uso["bloqueado_ate"], asyncio.get_running_loop().time() + espera_min * 60)
+
+
+def proximo_intervalo() -> float:
+    """Intervalo adaptativo: cresce com o uso informado pela Graph e com erros de limite."""
+    intervalo = META_MONITOR_INTERVALO_SECONDS
+    if _uso["pct"] >= 90:
+        intervalo *= 8
+    elif _uso["pct"] >= 75:
+        intervalo *= 4
+    elif _uso["pct"] >= 50:
+        intervalo *= 2
+    intervalo *= 2 ** _uso["backoff"]
+
+    # bloqueio informado pela Graph (estimated_time_to_regain_access) prevalece sobre o teto
+    restante = _uso["bloqueado_ate"] - asyncio.get_running_loop().time()
+    return max(min(intervalo, META_MONITOR_INTERVALO_MAX_SECONDS), restante)
+
+
+async def _post(cliente: httpx.AsyncClient, caminho: str, data: dict) -> Dict[str, Any]:
+    response = await cliente.post(caminho, data=data)
+    _registrar_uso(response.headers)
+    if response.is_error:
         raise RuntimeError(response.text)
     return response.json()
 
+
+async def batch(cliente: httpx.AsyncClient, operacoes: List[Dict[str, Any]]) -> List[Tuple[int, Any]]:
+    """
+    Executa operações {"method", "relative_url"[, "body"]} em requisições
+    batch de até 50 itens. Retorna (código, corpo) na ordem das operações.
+    """
+    resultados: List[Tuple[int, Any]] = []
+    for inicio in range(0, len(operacoes), BATCH_MAX):
+        parte = operacoes[inicio:inicio + BATCH_MAX]
+        response = await cliente.post("/", data={"batch": json.dumps(parte), "include_headers": "false"})
+        _registrar_uso(response.headers)
+        if response.is_error:
+            raise RuntimeError(response.text)
+        for item in response.json():
+            if item is None:  # operação que excedeu o tempo do batch
+                resultados.append((504, None))
+                continue
+            corpo = item.get("body")
+            try:
+                corpo = json.loads(corpo) if isinstance(corpo, str) else corpo
+            except ValueError:
+                pass
+            resultados.append((item.get("code", 500), corpo))
+    return resultados
+
+
+def _rate_limitado(codigo: int, corpo: Any) -> bool:
+    erro = corpo.get("error") if isinstance(corpo, dict) else None
+    return codigo == 429 or bool(erro and erro.get("code") in ERROS_RATE_LIMIT)
+
+
+# ================================
+# CAMPANHAS
+# ================================
+
+def acompanhar(campaign_id: str, adset_ids: List[str], limite_gasto: float = MAX_TEST_SPEND):
+    """
+    Registra uma campanha já ativa para o monitor e grava na hora: a campanha
+    está gastando e precisa estar no Postgres antes da primeira verificação.
+    """
+    estado.registrar(campaign_id, adset_ids, limite_gasto)
+    try:
+        estado.descarregar()
+    except Exception as e:
+        # continua marcada como alterada; o monitor grava na próxima rodada
+        log("META-ADS", "ERROR", "Falha ao gravar estado de aquisição", extra={"erro": str(e)})
+
+
+async def criar_campanha(cliente: httpx.AsyncClient, account_id: str, nome: str = "RoboGlobalAI-Test",
+                         orcamento_diario: float = DAILY_BUDGET,
+                         limite_gasto: float = MAX_TEST_SPEND) -> str:
+    """Cria campanha + conjunto pausados, ativa os dois num batch e passa a monitorar."""
+    campaign = await _post(cliente, f"/act_{account_id}/campaigns", {
+        "name": nome,
+        "objective": "OUTCOME_TRAFFIC",
+        "status": "PAUSED",
+        "special_ad_categories": "[]",
+    })
+
+    adset = await _post(cliente, f"/act_{account_id}/adsets", {
+        "name": f"{nome}-AdSet",
+        "campaign_id": campaign["id"],
+        "daily_budget": int(orcamento_diario * 100),
+        "billing_event": "IMPRESSIONS",
+        "optimization_goal": "LINK_CLICKS",
+        "bid_strategy": "LOWEST_COST_WITHOUT_CAP",
+        "targeting": '{"geo_locations":{"countries":["BR"]}}',
+        "status": "PAUSED",
+    })
+
+    ativacao = await batch(cliente, [
+        {"method": "POST", "relative_url": campaign["id"], "body": "status=ACTIVE"},
+        {"method": "POST", "relative_url": adset["id"], "body": "status=ACTIVE"},
+    ])
+    falhas = [corpo for codigo, corpo in ativacao if codigo >= 400]
+    if falhas:
+        raise RuntimeError(f"Falha ao ativar campanha {campaign['id']}: {falhas}")
+
+    await asyncio.to_thread(acompanhar, campaign["id"], [adset["id"]], limite_gasto)
+    log("META-ADS", "INFO", "Campanha ativada", extra={"campaign_id": campaign["id"], "adset_id": adset["id"]})
+    return campaign["id"]
+
+
+async def verificar(cliente: httpx.AsyncClient) -> Dict[str, float]:
+    """
+    Uma rodada do monitor: insights de todas as campanhas em execução num
+    batch, pausa (também em batch) as que atingiram o teto de gasto.
+    """
+    ativas = estado.snapshot("RUNNING")
+    if not ativas:
+        return {}
+
+    # gasto de toda a vida da campanha: total_spend é acumulado e comparado ao
+    # teto; com date_preset=today ele zeraria à meia-noite numa campanha retomada
+    respostas = await batch(cliente, [
+        {"method": "GET", "relative_url": f"{c['campaign_id']}/insights?fields=spend&date_preset=maximum"}
+        for c in ativas
+    ])
+
+    gastos: Dict[str, float] = {}
+    estourou = False
+    no_teto = []
+    for campanha, (codigo, corpo) in zip(ativas, respostas):
+        if codigo >= 400 or corpo is None:
+            estourou = estourou or _rate_limitado(codigo, corpo)
+            estado.marcar(campanha["campaign_id"], erro=corpo)
+            continue
+        dados = corpo.get("data") or []
+        try:
+            # sem entrega a Graph omite spend (ou a linha inteira)
+            gasto = float(dados[0].get("spend") or 0) if dados else 0.0
+        except (AttributeError, TypeError, ValueError):
+            estado.marcar(campanha["campaign_id"], erro=corpo)
+            continue
+        atual = estado.atualizar_gasto(campanha["campaign_id"], gasto)
+        gastos[campanha["campaign_id"]] = gasto
+        if atual is not None and atual["total_spend"] >= atual["limite_gasto"]:
+            no_teto.append(atual)
+
+    _uso["backoff"] = min(_uso["backoff"] + 1, 5) if estourou else 0
+
+    if no_teto:
+        await pausar(cliente, no_teto)
+    return gastos
+
+
+async def pausar(cliente: httpx.AsyncClient, campanhas: List[Dict[str, Any]]):
+    operacoes, donos = [], []
+    for campanha in campanhas:
+        for objeto in [campanha["campaign_id"], *campanha["adset_ids"]]:
+            operacoes.append({"method": "POST", "relative_url": objeto, "body": "status=PAUSED"})
+            donos.append(campanha)
+
+    respostas = await batch(cliente, operacoes)
+    falhou = {dono["campaign_id"] for dono, (codigo, _) in zip(donos, respostas) if codigo >= 400}
+    for campanha in campanhas:
+        if campanha["campaign_id"] in falhou:
+            # continua RUNNING: a próxima rodada tenta pausar de novo
+            estado.marcar(campanha["campaign_id"], erro="falha ao pausar")
+            continue
+        estado.marcar(campanha["campaign_id"], "CAPPED")
+        log("META-ADS", "WARN", "Teto de gasto atingido — campanha pausada", extra={
+            "campaign_id": campanha["campaign_id"],
+            "total_spend": campanha["total_spend"],
+            "limite_gasto": campanha["limite_gasto"],
+        })
+
+
+async def monitorar(cliente: httpx.AsyncClient, parar: Optional[asyncio.Event] = None,
+                    ate_sem_campanhas: bool = False):
+    parar = parar or asyncio.Event()
+    while not parar.is_set():
+        try:
+            await verificar(cliente)
+        except Exception as e:
+            _uso["backoff"] = min(_uso["backoff"] + 1, 5)
+            log("META-ADS", "ERROR", "Falha na verificação de gasto", extra={"erro": str(e)})
+
+        try:
+            await asyncio.to_thread(estado.descarregar)
+        except Exception as e:
+            log("META-ADS", "ERROR", "Falha ao gravar estado de aquisição", extra={"erro": str(e)})
+
+        if ate_sem_campanhas and not estado.snapshot("RUNNING"):
+            return
+        try:
+            await asyncio.wait_for(parar.wait(), timeout=proximo_intervalo())
+        except asyncio.TimeoutError:
+            pass
+
+
 # ================================
 # EXECUÇÃO REAL CONTROLADA
 # ================================
 
-def run_real_test():
-    global MAX_TEST_SPEND
+async def _run_real_test():
+    token, account_id, api_version = _load_env()
+    async with lease.manter(LEASE_MONITOR) as posse:
+        if not posse:
+            # outra instância já carregou e monitora as campanhas
+            log("META-ADS", "INFO", "Monitor de aquisição ativo em outra instância")
+            return
+
+        # campanhas em andamento gravadas antes do restart: retoma sem redescobrir na Graph
+        retomadas = await asyncio.to_thread(estado.carregar)
+        async with cliente_graph(token, api_version) as cliente:
+            if retomadas:
+                log("META-ADS", "INFO", "Monitoramento retomado", extra={
+                    "campanhas": [c["campaign_id"] for c in retomadas]
+                })
+            else:
+                await criar_campanha(cliente, account_id)
+            # lease perdido: para de monitorar (outra instância assume)
+            await monitorar(cliente, parar=posse.perdida, ate_sem_campanhas=True)
+        log("META-ADS", "INFO", "Monitoramento encerrado", extra=estado.estatisticas())
+
 
+def run_real_test():
     try:
-        token, account_id, api_version = _load_env()
-        base_url = f"https://graph.facebook.com/{api_version}"
-
-        # CREATE CAMPAIGN
-        campaign = _post(
-            f"{base_url}/act_{account_id}/campaigns",
-            {
-                "name": "RoboGlobalAI-Test",
-                "objective": "OUTCOME_TRAFFIC",
-                "status": "PAUSED",
-                "special_ad_categories": []
-            },
-            token
-        )
-        STATE["campaign_id"] = campaign["id"]
-
-        # CREATE ADSET
-        adset = _post(
-            f"{base_url}/act_{account_id}/adsets",
-            {
-                "name": "RoboGlobalAI-AdSet",
-                "campaign_id": STATE["campaign_id"],
-                "daily_budget": int(DAILY_BUDGET * 100),
-                "billing_event": "IMPRESSIONS",
-                "optimization_goal": "LINK_CLICKS",
-                "bid_strategy": "LOWEST_COST_WITHOUT_CAP",
-                "targeting": '{"geo_locations":{"countries":["BR"]}}',
-                "status": "PAUSED"
-            },
-            token
-        )
-        STATE["adset_id"] = adset["id"]
-
-        # ACTIVATE
-        _post(f"{base_url}/{STATE['campaign_id']}", {"status": "ACTIVE"}, token)
-        _post(f"{base_url}/{STATE['adset_id']}", {"status": "ACTIVE"}, token)
-
-        STATE["status"] = "RUNNING"
-        STATE["started_at"] = datetime.now(timezone.utc)
-
-        # MONITOR
-        while True:
-            time.sleep(30)
-            insights = _get(
-                f"{base_url}/act_{account_id}/insights",
-                {"fields": "spend", "date_preset": "today"},
-                token
-            )
-
-            spend = float(insights["data"][0]["spend"]) if insights["data"] else 0.0
-            STATE["total_spend"] = spend
-
-            if spend >= MAX_TEST_SPEND:
-                _post(f"{base_
+        asyncio.run(_run_real_test())
+    except Exception as e:
+        log("META-ADS", "ERROR", "Falha no teste real", extra={"erro": str(e)})
+        raise
+
+
+if __name__ == "__main__":
+    run_real_test()
@@ -1,170 +1,299 @@
 # affiliate/clickbank.py
-# Integração REAL ClickBank — Postback (GET) + Modelo Pull Opcional
-# Arquivo AUTÔNOMO — não altera main.py
+# Integração ClickBank — Modelo Pull (sincronização incremental)
+# O postback (GET) é declarado em affiliate/conectores.py. O pull busca o
+# relatório de pedidos por dia, converte cada pedido para o formato do
+# postback e enfileira na mesma fila de ingestão: normalização, dedup
+# (origem, transacao_id, evento) e persistência são as mesmas do postback.
+# O cursor (último dia completo) avança na fila local junto com os pedidos e
+# é publicado no Postgres (lease.gravar_cursor) quando esses pedidos já
+# foram gravados: vale para todas as instâncias e sobrevive a deploys.
 
-import json
+import argparse
+import asyncio
 import os
-from datetime import datetime, timezone
-from typing import Dict, Any, Optional
+import random
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import urlencode
 
-from fastapi import APIRouter, Request, HTTPException, status
+import httpx
+
+import lease
+from affiliate import conectores, ingestao  # conectores registra o processador CLICKBANK
+from log_estruturado import log
+
+CLICKBANK_ORIGIN = "CLICKBANK"
 
 # ===============================
 # CONFIGURAÇÕES
 # ===============================
 
-CLICKBANK_SECRET_KEY = os.getenv("CLICKBANK_SECRET_KEY")  # recomendado usar a Secret Key do postback
-CLICKBANK_ORIGIN = "CLICKBANK"
+CLICKBANK_API_URL = os.getenv("CLICKBANK_API_URL", "https://api.clickbank.com/rest/1.3")
+CLICKBANK_API_KEY = os.getenv("CLICKBANK_API_KEY")
+CLICKBANK_PULL_CONCORRENCIA = int(os.getenv("CLICKBANK_PULL_CONCORRENCIA", "4"))
+CLICKBANK_PULL_TENTATIVAS = int(os.getenv("CLICKBANK_PULL_TENTATIVAS", "4"))
+CLICKBANK_PULL_BACKOFF_SECONDS = float(os.getenv("CLICKBANK_PULL_BACKOFF_SECONDS", "0.5"))
+# teto para o Retry-After da API: a sincronização roda dentro do /ciclo (LOOP_TIMEOUT_CICLO)
+CLICKBANK_PULL_RETRY_AFTER_MAX_SECONDS = float(os.getenv("CLICKBANK_PULL_RETRY_AFTER_MAX_SECONDS", "30"))
+CLICKBANK_PULL_DIAS_INICIAIS = int(os.getenv("CLICKBANK_PULL_DIAS_INICIAIS", "7"))
+CLICKBANK_PULL_TIMEOUT_SECONDS = float(os.getenv("CLICKBANK_PULL_TIMEOUT_SECONDS", "30"))
+CLICKBANK_PULL_INTERVALO_SECONDS = float(os.getenv("CLICKBANK_PULL_INTERVALO_SECONDS", "0"))  # 0 = sem loop
+# teto de dias por sincronização (cota da API); retomando do cursor, o
+# restante fica para as próximas rodadas
+CLICKBANK_PULL_MAX_DIAS = int(os.getenv("CLICKBANK_PULL_MAX_DIAS", "31"))
+
+CURSOR = "clickbank_pull"
+
+_stats: Dict[str, Any] = {
+    "sincronizacoes": 0,
+    "dias": 0,
+    "paginas": 0,
+    "pedidos": 0,
+    "retentativas": 0,
+    "falhas": 0,
+    "ultima": None,
+}
 
-if not CLICKBANK_SECRET_KEY:
-    raise RuntimeError("CLICKBANK_SECRET_KEY não definido no ambiente")
 
-router = APIRouter(
-    prefix="/postback/clickbank",
-    tags=["ClickBank"]
-)
+class ErroPull(Exception):
+    pass
+
+
+class IntervaloInvalido(ValueError):
+    pass
+
 
 # ===============================
-# LOG ESTRUTURADO
+# PEDIDO -> FORMATO DO POSTBACK
 # ===============================
 
-def log(origem: str, nivel: str, mensagem: str, extra: Dict[str, Any] | None = None):
-    payload = {
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "origem": origem,
-        "nivel": nivel,
-        "mensagem": mensagem,
+def _para_postback(pedido: Dict[str, Any]) -> Dict[str, str]:
+    itens = pedido.get("lineItemData") or {}
+    item = itens[0] if isinstance(itens, list) and itens else itens if isinstance(itens, dict) else {}
+    campos = {
+        "receipt": pedido.get("receipt"),
+        "transactionType": pedido.get("transactionType"),
+        "amount": pedido.get("totalOrderAmount", item.get("accountAmount")),
+        "currency": pedido.get("currency"),
+        "itemNo": item.get("itemNo"),
+        "itemTitle": item.get("productTitle"),
+        "affiliate": pedido.get("affiliate"),
+        "customerEmail": pedido.get("email"),
+        "time": pedido.get("transactionTime"),
     }
-    if extra:
-        payload["extra"] = extra
-    print(json.dumps(payload, ensure_ascii=False))
+    return {k: str(v) for k, v in campos.items() if v is not None}
+
+
+def corpo_do_pedido(pedido: Dict[str, Any]) -> bytes:
+    """Mesmo corpo que o postback enfileiraria (query string sem a secret)."""
+    return urlencode(_para_postback(pedido)).encode("utf-8")
 
 
 # ===============================
-# VALIDAÇÃO DE POSTBACK
+# HTTP (PAGINAÇÃO + RETRY)
 # ===============================
 
-def validar_postback(query: Dict[str, str]) -> bool:
-    """
-    ClickBank permite validar via Secret Key enviada como parâmetro customizado.
-    Exemplo comum: ?secretKey=XXXX
-    """
-    secret_recebida = query.get("secretKey") or query.get("secret_key")
-    return secret_recebida == CLICKBANK_SECRET_KEY
+async def _get(cliente: httpx.AsyncClient, params: Dict[str, str], pagina: int) -> httpx.Response:
+    for tentativa in range(CLICKBANK_PULL_TENTATIVAS):
+        espera = CLICKBANK_PULL_BACKOFF_SECONDS * (2 ** tentativa) * (1 + random.random())
+        try:
+            resposta = await cliente.get("/orders2/list", params=params, headers={"Page": str(pagina)})
+        except httpx.TransportError as e:
+            erro = str(e) or type(e).__name__
+        else:
+            if resposta.status_code in (200, 206):
+                return resposta
+            if resposta.status_code != 429 and resposta.status_code < 500:
+                raise ErroPull(f"HTTP {resposta.status_code}: {resposta.text[:200]}")
+            erro = f"HTTP {resposta.status_code}"
+            retry_after = resposta.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                espera = min(float(retry_after), CLICKBANK_PULL_RETRY_AFTER_MAX_SECONDS)
+
+        if tentativa + 1 < CLICKBANK_PULL_TENTATIVAS:
+            _stats["retentativas"] += 1
+            await asyncio.sleep(espera)
+
+    raise ErroPull(f"Página {pagina} falhou após {CLICKBANK_PULL_TENTATIVAS} tentativas: {erro}")
+
+
+async def buscar_dia(cliente: httpx.AsyncClient, dia: date) -> List[Dict[str, Any]]:
+    """Todas as páginas do relatório de um dia (206 = há mais páginas)."""
+    params = {"startDate": dia.isoformat(), "endDate": dia.isoformat()}
+    pedidos: List[Dict[str, Any]] = []
+    pagina = 1
+    while True:
+        resposta = await _get(cliente, params, pagina)
+        _stats["paginas"] += 1
+        dados = resposta.json() if resposta.content else {}
+        lote = dados.get("orderData") or []
+        pedidos.extend(lote if isinstance(lote, list) else [lote])
+        if resposta.status_code != 206 or not lote:
+            return pedidos
+        pagina += 1
 
 
 # ===============================
-# NORMALIZAÇÃO UNIVERSAL
+# SINCRONIZAÇÃO
 # ===============================
 
-def normalizar_evento_clickbank(query: Dict[str, str]) -> Dict[str, Any]:
+def _cliente() -> httpx.AsyncClient:
+    headers = {"Accept": "application/json"}
+    if CLICKBANK_API_KEY:
+        headers["Authorization"] = CLICKBANK_API_KEY
+    return httpx.AsyncClient(
+        base_url=CLICKBANK_API_URL,
+        headers=headers,
+        timeout=CLICKBANK_PULL_TIMEOUT_SECONDS,
+        limits=httpx.Limits(max_connections=CLICKBANK_PULL_CONCORRENCIA),
+    )
+
+
+def _dias(desde: date, ate: date) -> List[date]:
+    return [desde + timedelta(days=i) for i in range((ate - desde).days + 1)]
+
+
+async def sincronizar(desde: Optional[date] = None, ate: Optional[date] = None,
+                      cliente: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
     """
-    Converte parâmetros GET do ClickBank para o modelo universal do Robô
-    Campos comuns:
-    - receipt
-    - itemNo
-    - itemTitle
-    - amount
-    - currency
-    - affiliate
-    - customerEmail
-    - transactionType (SALE, BILL, RFND, CGBK)
+    Busca os dias [desde, ate] em paralelo (limitado) e enfileira os pedidos
+    de cada dia assim que ele e os anteriores terminam. Sem `desde`, retoma
+    do cursor (o último dia completo é rebuscado; duplicados são descartados
+    pelo dedup). O cursor só avança sobre dias já encerrados e sem falha
+    anterior. Com várias instâncias, só a dona do lease "clickbank_pull"
+    sincroniza.
     """
+    async with lease.manter(CURSOR) as posse:
+        if not posse:
+            return {"status": "em_outra_instancia", "enfileirados": 0, "falhas": {}}
+        return await _sincronizar(desde, ate, cliente, posse)
 
-    valor = float(query.get("amount", "0") or 0)
-    moeda = query.get("currency", "USD")
-
-    evento_normalizado = {
-        "origem": CLICKBANK_ORIGIN,
-        "evento": query.get("transactionType"),
-        "status": query.get("transactionType"),
-        "transacao_id": query.get("receipt"),
-        "produto": {
-            "id": query.get("itemNo"),
-            "nome": query.get("itemTitle"),
-        },
-        "afiliado": {
-            "id": query.get("affiliate"),
-            "nome": query.get("affiliate"),
-        },
-        "comprador": {
-            "email": query.get("customerEmail"),
-            "nome": None,
-        },
-        "financeiro": {
-            "valor": valor,
-            "moeda": moeda,
-        },
-        "timestamp_evento": query.get("time") or datetime.now(timezone.utc).isoformat(),
-        "timestamp_ingestao": datetime.now(timezone.utc).isoformat(),
-        "raw": dict(query),
-    }
 
-    return evento_normalizado
+async def _sincronizar(desde: Optional[date], ate: Optional[date],
+                       cliente: Optional[httpx.AsyncClient], posse=True) -> Dict[str, Any]:
+    hoje = datetime.now(timezone.utc).date()
+    ate = ate or hoje
+    await asyncio.to_thread(publicar_cursor)
+    # o local pode estar à frente do compartilhado (pedidos ainda na fila desta instância)
+    cursores = [
+        await asyncio.to_thread(lease.ler_cursor, CURSOR),
+        await asyncio.to_thread(ingestao.ler_cursor, CURSOR),
+    ]
+    cursor = max((c for c in cursores if c), default=None)
+    if desde is None:
+        desde = date.fromisoformat(cursor) if cursor else hoje - timedelta(days=CLICKBANK_PULL_DIAS_INICIAIS)
+        ate = min(ate, desde + timedelta(days=CLICKBANK_PULL_MAX_DIAS - 1))
+    elif (ate - desde).days + 1 > CLICKBANK_PULL_MAX_DIAS:
+        raise IntervaloInvalido(f"Intervalo maior que {CLICKBANK_PULL_MAX_DIAS} dias")
+    if desde > ate:
+        raise IntervaloInvalido("desde deve ser anterior ou igual a ate")
 
+    dias = _dias(desde, ate)
+    proprio = cliente is None
+    cliente = cliente or _cliente()
 
-# ===============================
-# PERSISTÊNCIA (ABSTRAÍDA)
-# ===============================
+    async def um_dia(dia: date) -> Tuple[date, Optional[List[Dict[str, Any]]], Optional[str]]:
+        try:
+            return dia, await buscar_dia(cliente, dia), None
+        except (ErroPull, httpx.HTTPError, ValueError) as e:
+            return dia, None, str(e)
 
-def persistir_evento(evento_normalizado: Dict[str, Any]):
-    log(
-        origem=CLICKBANK_ORIGIN,
-        nivel="INFO",
-        mensagem="Evento persistido (camada de persistência abstrata)",
-        extra={
-            "transacao_id": evento_normalizado.get("transacao_id"),
-            "evento": evento_normalizado.get("evento"),
-            "valor": evento_normalizado.get("financeiro", {}).get("valor"),
-        }
-    )
+    # janela deslizante de dias em voo, consumida em ordem: no máximo
+    # CLICKBANK_PULL_CONCORRENCIA dias buscados e ainda não enfileirados em memória
+    proximos = iter(dias)
+    em_voo: deque = deque()
 
+    def buscar_proximo():
+        dia = next(proximos, None)
+        if dia is not None:
+            em_voo.append(asyncio.create_task(um_dia(dia)))
 
-# ===============================
-# ENDPOINT POSTBACK (GET)
-# ===============================
+    enfileirados = 0
+    falhas = {}
+    contiguo = True
+    try:
+        for _ in range(CLICKBANK_PULL_CONCORRENCIA):
+            buscar_proximo()
+        while em_voo:
+            if not posse:
+                # lease perdido: a outra instância segue do cursor compartilhado
+                falhas["lease"] = "lease perdido durante o pull"
+                break
+            dia, pedidos, erro = await em_voo.popleft()
+            buscar_proximo()
+            if erro is not None:
+                contiguo = False
+                falhas[dia.isoformat()] = erro
+                log(CLICKBANK_ORIGIN, "ERROR", "Falha no pull do dia", extra={"dia": dia.isoformat(), "erro": erro})
+                continue
+            # backfill de um período antigo não faz o cursor voltar
+            avanca = contiguo and dia < hoje and (cursor is None or dia.isoformat() > cursor)
+            corpos = [corpo_do_pedido(p) for p in pedidos if p.get("receipt")]
+            enfileirados += await ingestao.enfileirar_lote(
+                CLICKBANK_ORIGIN, corpos, {"fonte": "pull", "dia": dia.isoformat()},
+                cursor=(CURSOR, dia.isoformat()) if avanca else None
+            )
+    finally:
+        for tarefa in em_voo:
+            tarefa.cancel()
+        if proprio:
+            await cliente.aclose()
 
-@router.get("")
-async def postback_clickbank(request: Request):
-    query_params = dict(request.query_params)
-
-    if not validar_postback(query_params):
-        log(CLICKBANK_ORIGIN, "ERROR", "Postback inválido — secret incorreta")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Postback inválido"
-        )
-
-    log(
-        origem=CLICKBANK_ORIGIN,
-        nivel="INFO",
-        mensagem="Postback recebido",
-        extra={
-            "receipt": query_params.get("receipt"),
-            "transactionType": query_params.get("transactionType"),
-        }
-    )
+    resumo = {
+        "status": "ok" if not falhas else "parcial",
+        "desde": desde.isoformat(),
+        "ate": ate.isoformat(),
+        "dias": len(dias),
+        "enfileirados": enfileirados,
+        "falhas": falhas,
+        "cursor": await asyncio.to_thread(ingestao.ler_cursor, CURSOR),
+        "cursor_compartilhado": await asyncio.to_thread(lease.ler_cursor, CURSOR),
+    }
+    _stats["sincronizacoes"] += 1
+    _stats["dias"] += len(dias)
+    _stats["pedidos"] += enfileirados
+    _stats["falhas"] += len(falhas)
+    _stats["ultima"] = resumo
+    log(CLICKBANK_ORIGIN, "INFO", "Pull ClickBank concluído", extra={k: v for k, v in resumo.items() if k != "falhas"})
+    return resumo
 
-    evento_normalizado = normalizar_evento_clickbank(query_params)
-    persistir_evento(evento_normalizado)
 
-    # ClickBank espera HTTP 200 simples
-    return {"status": "ok"}
+def publicar_cursor() -> Optional[str]:
+    """Leva ao Postgres o cursor local cujos pedidos já saíram da fila (gravados)."""
+    valor = ingestao.cursor_confirmado(CURSOR)
+    if valor:
+        lease.gravar_cursor(CURSOR, valor)
+    return valor
 
 
-# ===============================
-# MODELO PULL (OPCIONAL / DESATIVADO)
-# ===============================
+async def loop_sincronizacao():
+    """Pull periódico (CLICKBANK_PULL_INTERVALO_SECONDS > 0)."""
+    while True:
+        try:
+            await sincronizar()
+        except Exception as e:
+            log(CLICKBANK_ORIGIN, "ERROR", "Falha no loop de pull", extra={"erro": str(e)})
+        await asyncio.sleep(CLICKBANK_PULL_INTERVALO_SECONDS)
 
-def pull_clickbank_events(since: Optional[str] = None):
-    """
-    MODELO de pull para relatórios da ClickBank.
-    Não executa automaticamente.
-    Mantido apenas para compatibilidade futura.
-    """
-    log(
-        origem=CLICKBANK_ORIGIN,
-        nivel="INFO",
-        mensagem="Pull ClickBank chamado (modelo, não executado)",
-        extra={"since": since}
-    )
+
+def estatisticas() -> Dict[str, Any]:
+    return dict(_stats)
+
+
+def pull_clickbank_events(since: Optional[str] = None) -> Dict[str, Any]:
+    """Compatibilidade: sincronização síncrona a partir de `since` (YYYY-MM-DD)."""
+    return asyncio.run(sincronizar(date.fromisoformat(since) if since else None))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sincroniza pedidos da ClickBank (pull)")
+    parser.add_argument("--desde", type=date.fromisoformat, default=None)
+    parser.add_argument("--ate", type=date.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    print(asyncio.run(sincronizar(args.desde, args.ate)), flush=True)
+    # a fila é drenada pelos workers da API; aqui processa o que foi enfileirado
+    while ingestao.processar_lote():
+        pass
+    publicar_cursor()
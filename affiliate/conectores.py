@@ -0,0 +1,308 @@
+# affiliate/conectores.py
+# Registro unificado dos conectores de afiliados
+# Cada plataforma é uma entrada de tabela: autenticação, mapa de campos e rota.
+# Validação, normalização, fila de ingestão e persistência são compartilhadas.
+
+import os
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Callable
+from urllib.parse import parse_qsl, urlencode
+
+from fastapi import APIRouter, FastAPI, Request
+
+import json_rapido
+import log_estruturado
+from affiliate import ingestao, mapeamento, persistencia, verificacao
+from log_estruturado import log
+
+# "dict" (padrão) reembute o payload parseado em raw; "bytes" guarda o corpo
+NORMALIZACAO_RAW = os.getenv("NORMALIZACAO_RAW", "dict")
+
+# ===============================
+# REGISTRO DE CONECTORES
+# ===============================
+#
+# auth.tipo (verificação em affiliate/verificacao.py; auth.env aceita várias
+# secrets separadas por vírgula para rotação):
+#   hmac_sha256   -> HMAC SHA256 do corpo bruto no header auth.header
+#   token_header  -> token em um dos auth.headers (aceita "Bearer <token>")
+#   query_secret  -> secret em um dos auth.params da query string
+#
+# campos: caminho no payload ("a.b.c"); alternativas separadas por "|"
+# valem como `or` (a primeira não vazia vence).
+
+CONECTORES: Dict[str, Dict[str, Any]] = {
+    "HOTMART": {
+        "rota": "/webhook/hotmart",
+        "metodo": "POST",
+        "tag": "Hotmart",
+        "formato": "json",
+        "auth": {"tipo": "hmac_sha256", "env": "HOTMART_WEBHOOK_SECRET", "header": "X-Hotmart-Hmac-SHA256"},
+        "campos": {
+            "evento": "event",
+            "status": "data.status",
+            "transacao_id": "data.transaction.id",
+            "produto.id": "data.product.id",
+            "produto.nome": "data.product.name",
+            "afiliado.id": "data.affiliate.affiliate_id",
+            "afiliado.nome": "data.affiliate.name",
+            "comprador.email": "data.buyer.email",
+            "comprador.nome": "data.buyer.name",
+            "financeiro.valor": "data.purchase.price",
+            "financeiro.moeda": "data.purchase.currency",
+            "timestamp_evento": "data.purchase.approved_date",
+        },
+        "padroes": {"financeiro.moeda": "BRL"},
+    },
+    "EDUZZ": {
+        "rota": "/webhook/eduzz",
+        "metodo": "POST",
+        "tag": "Eduzz",
+        "formato": "json",
+        "auth": {
+            "tipo": "token_header",
+            "env": "EDUZZ_WEBHOOK_TOKEN",
+            "headers": ["Authorization", "X-Eduzz-Token"],
+        },
+        "campos": {
+            "evento": "event|type",
+            "status": "data.status",
+            "transacao_id": "data.transaction_id|data.id",
+            "produto.id": "data.product_id",
+            "produto.nome": "data.product_name",
+            "afiliado.id": "data.affiliate_id",
+            "afiliado.nome": "data.affiliate_name",
+            "comprador.email": "data.customer_email",
+            "comprador.nome": "data.customer_name",
+            "financeiro.valor": "data.value",
+            "financeiro.moeda": "data.currency",
+            "timestamp_evento": "data.created_at",
+        },
+        "padroes": {"financeiro.moeda": "BRL"},
+    },
+    "MONETIZZE": {
+        "rota": "/webhook/monetizze",
+        "metodo": "POST",
+        "tag": "Monetizze",
+        "formato": "json",
+        "auth": {
+            "tipo": "token_header",
+            "env": "MONETIZZE_WEBHOOK_TOKEN",
+            "headers": ["X-Monetizze-Token", "Authorization"],
+        },
+        "campos": {
+            "evento": "event|type",
+            "status": "data.status",
+            "transacao_id": "data.sale_id|data.id",
+            "produto.id": "data.product_id",
+            "produto.nome": "data.product_name",
+            "afiliado.id": "data.affiliate_id",
+            "afiliado.nome": "data.affiliate_name",
+            "comprador.email": "data.buyer_email",
+            "comprador.nome": "data.buyer_name",
+            "financeiro.valor": "data.sale_value",
+            "financeiro.moeda": "data.currency",
+            "timestamp_evento": "data.created_at",
+        },
+        "padroes": {"financeiro.moeda": "BRL"},
+    },
+    "CLICKBANK": {
+        "rota": "/postback/clickbank",
+        "metodo": "GET",
+        "tag": "ClickBank",
+        "formato": "query",
+        "auth": {"tipo": "query_secret", "env": "CLICKBANK_SECRET_KEY", "params": ["secretKey", "secret_key"]},
+        "campos": {
+            "evento": "transactionType",
+            "status": "transactionType",
+            "transacao_id": "receipt",
+            "produto.id": "itemNo",
+            "produto.nome": "itemTitle",
+            "afiliado.id": "affiliate",
+            "afiliado.nome": "affiliate",
+            "comprador.email": "customerEmail",
+            "financeiro.valor": "amount",
+            "financeiro.moeda": "currency",
+            "timestamp_evento": "time",
+        },
+        "padroes": {"financeiro.moeda": "USD", "timestamp_evento": lambda: datetime.now(timezone.utc).isoformat()},
+    },
+}
+
+# ===============================
+# NORMALIZAÇÃO UNIVERSAL
+# ===============================
+
+def _ler(payload: Dict[str, Any], spec: str) -> Any:
+    alternativas = spec.split("|")
+    for i, alternativa in enumerate(alternativas):
+        valor: Any = payload
+        for parte in alternativa.split("."):
+            valor = valor.get(parte) if isinstance(valor, dict) else None
+        if valor or i == len(alternativas) - 1:
+            return valor
+    return None
+
+
+def normalizar_evento_referencia(origem: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Interpretação direta do mapa de campos. Mantida como referência de
+    paridade para os normalizadores compilados (ver benchmarks/).
+    """
+    conector = CONECTORES[origem]
+    campos = conector["campos"]
+    padroes = conector.get("padroes", {})
+
+    def campo(nome: str) -> Any:
+        valor = _ler(payload, campos[nome]) if nome in campos else None
+        if valor is None and nome in padroes:
+            padrao = padroes[nome]
+            return padrao() if callable(padrao) else padrao
+        return valor
+
+    return {
+        "origem": origem,
+        "evento": campo("evento"),
+        "status": campo("status"),
+        "transacao_id": campo("transacao_id"),
+        "produto": {
+            "id": campo("produto.id"),
+            "nome": campo("produto.nome"),
+        },
+        "afiliado": {
+            "id": campo("afiliado.id"),
+            "nome": campo("afiliado.nome"),
+        },
+        "comprador": {
+            "email": campo("comprador.email"),
+            "nome": campo("comprador.nome"),
+        },
+        "financeiro": {
+            "valor": float(campo("financeiro.valor") or 0),
+            "moeda": campo("financeiro.moeda"),
+        },
+        "timestamp_evento": campo("timestamp_evento"),
+        "timestamp_ingestao": datetime.now(timezone.utc).isoformat(),
+        "raw": payload,  # preservação integral
+    }
+
+
+# compilados uma vez, no import
+_NORMALIZADORES = {
+    origem: mapeamento.compilar(origem, conector["campos"], conector.get("padroes", {}))
+    for origem, conector in CONECTORES.items()
+}
+
+
+def normalizar_evento(origem: str, payload: Dict[str, Any], corpo: Optional[bytes] = None) -> Dict[str, Any]:
+    """
+    Converte o payload de qualquer plataforma para o modelo universal do Robô.
+    Com NORMALIZACAO_RAW=bytes e o corpo original disponível, "raw" guarda os
+    bytes recebidos em vez do dict já parseado.
+    """
+    raw = corpo if NORMALIZACAO_RAW == "bytes" and corpo is not None else payload
+    return _NORMALIZADORES[origem](payload, raw)
+
+
+def decodificar(origem: str, corpo: bytes) -> Dict[str, Any]:
+    if CONECTORES[origem]["formato"] == "query":
+        return dict(parse_qsl(corpo.decode("utf-8"), keep_blank_values=True))
+    return json_rapido.loads(corpo)
+
+
+# ===============================
+# PERSISTÊNCIA
+# ===============================
+
+def persistir_evento(evento_normalizado: Dict[str, Any], item: Optional[int] = None):
+    """
+    Envia o evento ao buffer de persistência (affiliate/persistencia.py),
+    que grava em lote no backend configurado. `item` é o id na fila de ingestão.
+    """
+    persistencia.adicionar(evento_normalizado, item)
+
+    # ranking e cache do produto são atualizados quando a consolidação grava
+    # as métricas (affiliate/consolidacao.py), não a cada webhook
+
+    log(
+        origem=evento_normalizado.get("origem"),
+        nivel="INFO",
+        mensagem="Evento enviado para persistência",
+        extra={
+            "transacao_id": evento_normalizado.get("transacao_id"),
+            "evento": evento_normalizado.get("evento"),
+            "valor": evento_normalizado.get("financeiro", {}).get("valor"),
+        }
+    )
+
+
+def _processador(origem: str) -> Callable[[bytes, Dict[str, Any]], Dict[str, Any]]:
+    def processar(corpo: bytes, meta: Dict[str, Any]) -> Dict[str, Any]:
+        evento = normalizar_evento(origem, decodificar(origem, corpo), corpo)
+        log(
+            origem=origem,
+            nivel="INFO",
+            mensagem="Webhook recebido",
+            extra={"evento": evento["evento"], "transacao_id": evento["transacao_id"]}
+        )
+        return evento
+    return processar
+
+
+# a fila pode conter itens de conectores desativados depois: todos processam
+for _origem in CONECTORES:
+    ingestao.registrar(_origem, _processador(_origem), persistir_evento)
+
+
+# ===============================
+# ROTAS (CARREGAMENTO PREGUIÇOSO)
+# ===============================
+
+def _corpo(origem: str, request: Request, raw_body: bytes) -> bytes:
+    conector = CONECTORES[origem]
+    if conector["formato"] != "query":
+        return raw_body
+    # a secret não vai para a fila nem para o raw do evento
+    ocultos = set(conector["auth"].get("params", []))
+    return urlencode([
+        (k, v) for k, v in request.query_params.multi_items() if k not in ocultos
+    ]).encode("utf-8")
+
+
+def criar_router(origem: str, segredos: List[str]) -> APIRouter:
+    conector = CONECTORES[origem]
+    router = APIRouter(prefix=conector["rota"], tags=[conector["tag"]])
+    verificar = verificacao.criar(origem, conector, segredos)
+
+    async def receber(request: Request):
+        raw_body = await verificacao.ler_corpo(origem, request)
+        verificar(request, raw_body)
+
+        item_id = await ingestao.enfileirar(
+            origem,
+            _corpo(origem, request, raw_body),
+            {"request_id": log_estruturado.id_requisicao.get()}
+        )
+        log(origem, "INFO", "Webhook enfileirado", extra={"fila_id": item_id})
+
+        return {"status": "ok"}
+
+    router.add_api_route("", receber, methods=[conector["metodo"]], name=f"webhook_{origem.lower()}")
+    return router
+
+
+def registrar_rotas(app: FastAPI) -> Dict[str, bool]:
+    """
+    Monta as rotas dos conectores com segredo configurado. Um segredo
+    ausente desativa apenas a rota daquela plataforma.
+    """
+    ativos = {}
+    for origem, conector in CONECTORES.items():
+        segredos = verificacao.segredos(conector["auth"]["env"])
+        if not segredos:
+            log(origem, "WARN", f"{conector['auth']['env']} não definido — conector desativado")
+            ativos[origem] = False
+            continue
+        app.include_router(criar_router(origem, segredos))
+        ativos[origem] = True
+    return ativos
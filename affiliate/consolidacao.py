@@ -0,0 +1,189 @@
+# affiliate/consolidacao.py
+# Consolidação dos eventos de afiliados em produto_metrica_historico
+# Recebe de affiliate/persistencia.py só as linhas que o armazenamento de fato
+# inseriu (reentregas ignoradas pelo índice único não contam), acumula em
+# memória por (produto, dia) e grava periodicamente os deltas em lote (RPC
+# acumular_metrica_historico, sql/consolidacao_metricas.sql).
+# Reembolsos e chargebacks (ClickBank RFND/CGBK etc.) entram como deltas negativos.
+#
+# A consolidação é dona das métricas VENDAS_AFILIADOS e RECEITA_AFILIADOS:
+# /atualizar grava VENDAS com upsert (sobrescreve) e os deltas aqui somam,
+# então os dois nunca escrevem na mesma linha. VENDAS_AFILIADOS tem peso em
+# pontuacao.PESOS; só os produtos com delta gravado vão para o ranking.
+
+import asyncio
+import os
+import threading
+from datetime import date, datetime, timezone
+from typing import Dict, Any, Iterable, Tuple, List
+
+import cache_respostas
+import catalogo_metricas
+import ranking
+from log_estruturado import log
+from supabase_client import get_supabase, executar
+
+# ===============================
+# CONFIGURAÇÕES
+# ===============================
+
+CONSOLIDACAO_FLUSH_SECONDS = float(os.getenv("CONSOLIDACAO_FLUSH_SECONDS", "10"))
+CONSOLIDACAO_LOTE = int(os.getenv("CONSOLIDACAO_LOTE", "500"))
+
+# origem -> (coluna da linha, valores que contam uma venda, valores que estornam).
+# Um único marco de venda por plataforma: a Hotmart envia PURCHASE_APPROVED e,
+# depois da garantia, PURCHASE_COMPLETE para a mesma compra (a Monetizze,
+# Finalizada e depois Completa); contar os dois dobraria as vendas.
+REGRAS = {
+    "HOTMART": ("evento", {"PURCHASE_APPROVED"}, {"PURCHASE_REFUNDED", "PURCHASE_CHARGEBACK"}),
+    "CLICKBANK": ("evento", {"SALE", "BILL"}, {"RFND", "CGBK", "INSF"}),
+    "EDUZZ": ("status", {"PAID"}, {"REFUNDED", "CHARGEBACK"}),
+    "MONETIZZE": ("status", {"FINALIZADA"}, {"DEVOLVIDA", "REEMBOLSADA", "ESTORNADA", "CHARGEBACK"}),
+}
+
+# métricas -> delta por evento: quantidade de vendas e valor líquido.
+# Códigos ausentes do catálogo metricas_tipo são ignorados na gravação.
+VENDAS = "VENDAS_AFILIADOS"
+RECEITA = "RECEITA_AFILIADOS"
+METRICAS = (VENDAS, RECEITA)
+
+_lock = threading.Lock()
+_acumulado: Dict[Tuple[str, str], Dict[str, float]] = {}
+_origens: Dict[str, str] = {}  # produto -> origem do último evento, para o ranking
+
+_stats: Dict[str, Any] = {
+    "eventos": 0,
+    "vendas": 0,
+    "estornos": 0,
+    "ignorados": 0,
+    "linhas_gravadas": 0,
+    "descargas": 0,
+    "falhas": 0,
+    "metricas_sem_catalogo": [],
+}
+
+
+def sinal(linha: Dict[str, Any]) -> int:
+    """+1 venda, -1 reembolso/chargeback, 0 para o que não mexe em vendas."""
+    regra = REGRAS.get(str(linha.get("origem") or "").upper())
+    if regra is None:
+        return 0
+    coluna, vendas, estornos = regra
+    valor = str(linha.get(coluna) or "").upper()
+    if valor in estornos:
+        return -1
+    if valor in vendas:
+        return 1
+    return 0
+
+
+def dia_do_evento(linha: Dict[str, Any]) -> str:
+    for campo in ("timestamp_evento", "timestamp_ingestao"):
+        valor = linha.get(campo)
+        if valor:
+            try:
+                return date.fromisoformat(str(valor)[:10]).isoformat()
+            except ValueError:
+                continue
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def adicionar(linha: Dict[str, Any]):
+    """Uma linha de eventos_afiliados (persistencia.linha_evento) recém-inserida."""
+    _stats["eventos"] += 1
+    id_produto = linha.get("produto_id")
+    s = sinal(linha)
+    if id_produto is None or s == 0:
+        _stats["ignorados"] += 1
+        return
+
+    valor = abs(float(linha.get("valor") or 0))
+    chave = (str(id_produto), dia_do_evento(linha))
+    with _lock:
+        deltas = _acumulado.setdefault(chave, {codigo: 0.0 for codigo in METRICAS})
+        deltas[VENDAS] += s
+        deltas[RECEITA] += s * valor
+        if linha.get("origem"):
+            _origens[chave[0]] = str(linha["origem"]).upper()
+    _stats["vendas" if s > 0 else "estornos"] += 1
+
+
+def adicionar_linhas(linhas: Iterable[Dict[str, Any]]):
+    for linha in linhas:
+        adicionar(linha)
+
+
+def pendentes() -> int:
+    return len(_acumulado)
+
+
+def _devolver(lote: Dict[Tuple[str, str], Dict[str, float]]):
+    # falha na gravação: os deltas voltam a ser somados ao acumulado
+    with _lock:
+        for chave, deltas in lote.items():
+            atual = _acumulado.setdefault(chave, {codigo: 0.0 for codigo in METRICAS})
+            for codigo, delta in deltas.items():
+                atual[codigo] += delta
+
+
+async def descarregar(supabase=None) -> int:
+    global _acumulado, _origens
+    with _lock:
+        lote, _acumulado = _acumulado, {}
+        origens, _origens = _origens, {}
+    if not lote:
+        return 0
+
+    supabase = supabase or get_supabase()
+    try:
+        mapa_metricas = await catalogo_metricas.obter_mapa(supabase)
+        _stats["metricas_sem_catalogo"] = [c for c in METRICAS if c not in mapa_metricas]
+
+        itens: List[Tuple[Tuple[str, str], str]] = [
+            (chave, codigo)
+            for chave, deltas in lote.items()
+            for codigo, delta in deltas.items()
+            if codigo in mapa_metricas and delta
+        ]
+        for inicio in range(0, len(itens), CONSOLIDACAO_LOTE):
+            parte = itens[inicio:inicio + CONSOLIDACAO_LOTE]
+            await executar(supabase.rpc("acumular_metrica_historico", {"p_linhas": [
+                {
+                    "id_produto": id_produto,
+                    "id_metrica": mapa_metricas[codigo],
+                    "valor": lote[(id_produto, dia)][codigo],
+                    "referencia_data": dia,
+                }
+                for (id_produto, dia), codigo in parte
+            ]}))
+            # já gravado: não volta ao acumulado se um lote seguinte falhar
+            for chave, codigo in parte:
+                lote[chave][codigo] = 0.0
+    except Exception:
+        _stats["falhas"] += 1
+        _devolver({k: d for k, d in lote.items() if any(d.values())})
+        with _lock:
+            for id_produto, origem in origens.items():
+                _origens.setdefault(id_produto, origem)
+        raise
+
+    # só o que foi gravado pode mudar a pontuação
+    for id_produto in {id_produto for (id_produto, _), _ in itens}:
+        ranking.marcar(id_produto, origens.get(id_produto))
+        cache_respostas.invalidar_produto(id_produto)
+    _stats["linhas_gravadas"] += len(itens)
+    _stats["descargas"] += 1
+    return len(itens)
+
+
+async def loop_consolidacao():
+    while True:
+        await asyncio.sleep(CONSOLIDACAO_FLUSH_SECONDS)
+        try:
+            await descarregar()
+        except Exception as e:
+            log("CONSOLIDACAO", "ERROR", "Falha ao gravar métricas consolidadas", extra={"erro": str(e)})
+
+
+def estatisticas() -> Dict[str, Any]:
+    return {**_stats, "pendentes": len(_acumulado), "flush_seconds": CONSOLIDACAO_FLUSH_SECONDS}
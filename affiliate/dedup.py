@@ -0,0 +1,70 @@
+# affiliate/dedup.py
+# Deduplicação idempotente de eventos — chave (origem, transacao_id, evento)
+# Frente em memória (LRU limitado) + índice único no armazenamento
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+# ===============================
+# CONFIGURAÇÕES
+# ===============================
+
+DEDUP_LRU_MAX = int(os.getenv("DEDUP_LRU_MAX", "100000"))
+
+ON_CONFLICT_EVENTOS = "origem,transacao_id,evento"
+
+_lock = threading.Lock()
+_vistos: "OrderedDict[Tuple[str, str, str], None]" = OrderedDict()
+
+_stats: Dict[str, int] = {
+    "verificados": 0,
+    "duplicados": 0,
+}
+
+
+def chave(evento: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    """Sem transacao_id não há como deduplicar: retorna None."""
+    if not evento.get("transacao_id"):
+        return None
+    return (
+        str(evento.get("origem")),
+        str(evento.get("transacao_id")),
+        str(evento.get("evento")),
+    )
+
+
+def duplicado(evento: Dict[str, Any]) -> bool:
+    k = chave(evento)
+    _stats["verificados"] += 1
+    if k is None:
+        return False
+
+    with _lock:
+        if k in _vistos:
+            _vistos.move_to_end(k)
+            _stats["duplicados"] += 1
+            return True
+    return False
+
+
+def registrar(chaves: Iterable[Optional[Tuple[str, str, str]]]):
+    """Marca como vistas as chaves já gravadas com sucesso."""
+    with _lock:
+        for k in chaves:
+            if k is None:
+                continue
+            _vistos[k] = None
+            _vistos.move_to_end(k)
+        while len(_vistos) > DEDUP_LRU_MAX:
+            _vistos.popitem(last=False)
+
+
+def estatisticas() -> Dict[str, Any]:
+    verificados = _stats["verificados"]
+    return {
+        **_stats,
+        "taxa_duplicados": round(_stats["duplicados"] / verificados, 4) if verificados else 0.0,
+        "chaves_em_memoria": len(_vistos),
+    }
@@ -0,0 +1,384 @@
+# affiliate/ingestao.py
+# Fila durável de ingestão dos webhooks — ACK primeiro, processamento depois
+# Compartilhada por Hotmart, Eduzz, Monetizze e ClickBank
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+import log_estruturado
+from affiliate import dedup, persistencia
+from log_estruturado import log
+
+# ===============================
+# CONFIGURAÇÕES
+# ===============================
+
+FILA_INGESTAO_PATH = os.getenv("FILA_INGESTAO_PATH", "fila_ingestao.db")
+FILA_WORKERS = int(os.getenv("FILA_WORKERS", "2"))
+FILA_LOTE = int(os.getenv("FILA_LOTE", "100"))
+FILA_MAX_TENTATIVAS = int(os.getenv("FILA_MAX_TENTATIVAS", "5"))
+FILA_POLL_SECONDS = float(os.getenv("FILA_POLL_SECONDS", "0.5"))
+# espera antes de tentar de novo um item: base * 2^n, até o máximo
+FILA_BACKOFF_SECONDS = float(os.getenv("FILA_BACKOFF_SECONDS", "2"))
+FILA_BACKOFF_MAX_SECONDS = float(os.getenv("FILA_BACKOFF_MAX_SECONDS", "300"))
+
+# ===============================
+# ARMAZENAMENTO (SQLITE / WAL)
+# ===============================
+
+_lock = threading.Lock()
+_conn: Optional[sqlite3.Connection] = None
+_processadores: Dict[str, Dict[str, Callable]] = {}
+_tarefas: List[asyncio.Task] = []
+_novos = None  # asyncio.Event criado no loop do lifespan
+
+_stats: Dict[str, Any] = {
+    "enfileirados": 0,
+    "processados": 0,
+    "falhas": 0,
+    "descartados": 0,
+    "adiados": 0,
+    "duplicados": 0,
+}
+
+# colunas acrescentadas depois da criação da tabela (filas já existentes)
+_COLUNAS_NOVAS = {
+    "proxima_tentativa_em": "real not null default 0",
+    "adiamentos": "integer not null default 0",
+}
+
+
+def _conexao() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                conn = sqlite3.connect(FILA_INGESTAO_PATH, check_same_thread=False, isolation_level=None)
+                conn.execute("pragma journal_mode=wal")
+                conn.execute("pragma synchronous=full")
+                conn.execute("""
+                    create table if not exists fila (
+                        id integer primary key autoincrement,
+                        origem text not null,
+                        corpo blob not null,
+                        meta text,
+                        recebido_em text not null,
+                        tentativas integer not null default 0,
+                        em_processamento integer not null default 0,
+                        ultimo_erro text,
+                        descartado integer not null default 0,
+                        proxima_tentativa_em real not null default 0,
+                        adiamentos integer not null default 0
+                    )
+                """)
+                existentes = {linha[1] for linha in conn.execute("pragma table_info(fila)")}
+                for coluna, definicao in _COLUNAS_NOVAS.items():
+                    if coluna not in existentes:
+                        conn.execute(f"alter table fila add column {coluna} {definicao}")
+                conn.execute("create index if not exists fila_pendentes on fila (descartado, em_processamento, id)")
+                # marcas d'água das sincronizações pull (ex.: ClickBank); ate_item é o
+                # último item da fila que precisa sair antes de o valor ser publicado
+                conn.execute("create table if not exists cursores (nome text primary key, valor text not null)")
+                if "ate_item" not in {linha[1] for linha in conn.execute("pragma table_info(cursores)")}:
+                    conn.execute("alter table cursores add column ate_item integer not null default 0")
+                # itens presos por uma queda anterior voltam para a fila
+                conn.execute("update fila set em_processamento = 0 where em_processamento = 1")
+                _conn = conn
+    return _conn
+
+
+def _inserir(origem: str, corpo: bytes, meta: Optional[Dict[str, Any]]) -> int:
+    conn = _conexao()
+    with _lock:
+        cur = conn.execute(
+            "insert into fila (origem, corpo, meta, recebido_em) values (?, ?, ?, ?)",
+            (origem, corpo, json.dumps(meta or {}), datetime.now(timezone.utc).isoformat())
+        )
+    _stats["enfileirados"] += 1
+    return cur.lastrowid
+
+
+def _inserir_lote(origem: str, corpos: List[bytes], meta: Optional[Dict[str, Any]],
+                  cursor: Optional[Tuple[str, str]]) -> int:
+    conn = _conexao()
+    recebido_em = datetime.now(timezone.utc).isoformat()
+    meta_json = json.dumps(meta or {})
+    with _lock:
+        # eventos e cursor na mesma transação: o cursor só avança com os eventos já duráveis
+        conn.execute("begin")
+        try:
+            conn.executemany(
+                "insert into fila (origem, corpo, meta, recebido_em) values (?, ?, ?, ?)",
+                [(origem, corpo, meta_json, recebido_em) for corpo in corpos]
+            )
+            if cursor is not None:
+                conn.execute(
+                    """
+                    insert into cursores (nome, valor, ate_item)
+                    select ?, ?, coalesce(max(id), 0) from fila where true
+                    on conflict (nome) do update set valor = excluded.valor, ate_item = excluded.ate_item
+                    """,
+                    cursor
+                )
+            conn.execute("commit")
+        except Exception:
+            conn.execute("rollback")
+            raise
+    _stats["enfileirados"] += len(corpos)
+    return len(corpos)
+
+
+def _reservar(limite: int) -> List[sqlite3.Row]:
+    conn = _conexao()
+    with _lock:
+        return conn.execute(
+            """
+            update fila set em_processamento = 1
+             where id in (select id from fila
+                           where descartado = 0 and em_processamento = 0
+                             and proxima_tentativa_em <= ?
+                           order by id limit ?)
+            returning id, origem, corpo, meta, tentativas, adiamentos
+            """,
+            (time.time(), limite)
+        ).fetchall()
+
+
+def _concluir(ids: List[int]):
+    if not ids:
+        return
+    conn = _conexao()
+    with _lock:
+        conn.executemany("delete from fila where id = ?", [(i,) for i in ids])
+
+
+def _espera(n: int) -> float:
+    return min(FILA_BACKOFF_SECONDS * (2 ** min(n, 20)), FILA_BACKOFF_MAX_SECONDS)
+
+
+def _falhar(item_id: int, tentativas: int, erro: str, definitivo: bool = False) -> int:
+    """
+    Falha do próprio item (normalização/processador): conta para o descarte.
+    Retorna 1 se o item foi descartado.
+    """
+    conn = _conexao()
+    descartar = 1 if definitivo or tentativas + 1 >= FILA_MAX_TENTATIVAS else 0
+    with _lock:
+        conn.execute(
+            """
+            update fila set em_processamento = 0, tentativas = tentativas + 1, ultimo_erro = ?,
+                            descartado = ?, proxima_tentativa_em = ?
+             where id = ?
+            """,
+            (erro, descartar, time.time() + _espera(tentativas), item_id)
+        )
+    _stats["falhas"] += 1
+    _stats["descartados"] += descartar
+    return descartar
+
+
+def _adiar(itens: List[Tuple[int, int]], erro: str):
+    """
+    Falha do armazenamento (ex.: Supabase fora do ar): o item volta para a
+    fila com backoff exponencial, sem contar para o descarte.
+    itens = [(id, adiamentos)].
+    """
+    if not itens:
+        return
+    conn = _conexao()
+    agora = time.time()
+    with _lock:
+        conn.executemany(
+            """
+            update fila set em_processamento = 0, adiamentos = adiamentos + 1, ultimo_erro = ?,
+                            proxima_tentativa_em = ?
+             where id = ?
+            """,
+            [(erro, agora + _espera(adiamentos), item_id) for item_id, adiamentos in itens]
+        )
+    _stats["adiados"] += len(itens)
+
+
+# ===============================
+# API PÚBLICA
+# ===============================
+
+def registrar(origem: str, normalizar: Callable[[bytes, Dict[str, Any]], Dict[str, Any]],
+              persistir: Callable[[Dict[str, Any]], None]):
+    """
+    normalizar(corpo, meta) -> evento no modelo universal
+    persistir(evento, item_id) -> grava o evento normalizado (item_id é o
+    item da fila de origem, para o buffer não duplicar a linha numa nova tentativa)
+    """
+    _processadores[origem] = {"normalizar": normalizar, "persistir": persistir}
+
+
+async def enfileirar(origem: str, corpo: bytes, meta: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Grava o corpo bruto na fila local (um fsync) e retorna; o webhook pode
+    responder 200 imediatamente.
+    """
+    item_id = await asyncio.to_thread(_inserir, origem, corpo, meta)
+    if _novos is not None:
+        _novos.set()
+    return item_id
+
+
+async def enfileirar_lote(origem: str, corpos: List[bytes], meta: Optional[Dict[str, Any]] = None,
+                          cursor: Optional[Tuple[str, str]] = None) -> int:
+    """
+    Enfileira vários corpos numa única transação; cursor=(nome, valor)
+    é gravado junto, de forma atômica.
+    """
+    total = await asyncio.to_thread(_inserir_lote, origem, corpos, meta, cursor)
+    if _novos is not None and total:
+        _novos.set()
+    return total
+
+
+def ler_cursor(nome: str) -> Optional[str]:
+    conn = _conexao()
+    with _lock:
+        linha = conn.execute("select valor from cursores where nome = ?", (nome,)).fetchone()
+    return linha[0] if linha else None
+
+
+def cursor_confirmado(nome: str) -> Optional[str]:
+    """O cursor local, se todos os itens enfileirados até ele já saíram da fila."""
+    conn = _conexao()
+    with _lock:
+        linha = conn.execute(
+            """
+            select valor from cursores c
+             where nome = ?
+               and not exists (select 1 from fila where id <= c.ate_item and descartado = 0)
+            """,
+            (nome,)
+        ).fetchone()
+    return linha[0] if linha else None
+
+
+def processar_lote(limite: int = FILA_LOTE) -> int:
+    """
+    Processa um lote da fila. Retorna o progresso: quantos itens saíram da
+    fila (concluídos ou descartados). Itens adiados ou devolvidos para nova
+    tentativa não contam, então drenar com `while processar_lote()` para no
+    primeiro lote sem progresso em vez de gastar as tentativas numa queda.
+    """
+    itens = _reservar(limite)
+    descartados = 0
+    duplicados = []
+    gravando: List[Tuple[int, int]] = []  # (id, adiamentos) dos itens enviados ao buffer
+    sem_espaco: List[Tuple[int, int]] = []  # buffer de persistência cheio: adiados
+    chaves = set()
+
+    for item in itens:
+        item_id, origem, corpo, meta, tentativas, adiamentos = item
+        if sem_espaco:
+            # o buffer não esvaziou para um item; os seguintes não esperam de novo
+            sem_espaco.append((item_id, adiamentos))
+            continue
+        processador = _processadores.get(origem)
+        try:
+            if processador is None:
+                raise RuntimeError(f"Sem processador registrado para {origem}")
+            meta = json.loads(meta or "{}")
+            log_estruturado.id_requisicao.set(meta.get("request_id"))
+            evento = processador["normalizar"](corpo, meta)
+            chave = dedup.chave(evento)
+
+            # a linha já foi gravada por uma descarga posterior ao adiamento
+            if persistencia.gravado(item_id):
+                chaves.add(chave)
+                gravando.append((item_id, adiamentos))
+                continue
+
+            # reentrega da plataforma: confirma sem reprocessar
+            if dedup.duplicado(evento) or (chave is not None and chave in chaves):
+                _stats["duplicados"] += 1
+                duplicados.append(item_id)
+                continue
+
+            processador["persistir"](evento, item_id)
+            chaves.add(chave)
+            gravando.append((item_id, adiamentos))
+        except persistencia.BufferCheio:
+            # armazenamento fora: não é falha do item
+            sem_espaco.append((item_id, adiamentos))
+        except ValueError as e:
+            # payload malformado: repetir não resolve
+            descartados += _falhar(item_id, tentativas, str(e), definitivo=True)
+        except Exception as e:
+            descartados += _falhar(item_id, tentativas, str(e))
+
+    # reentregas não dependem do armazenamento
+    _concluir(duplicados)
+    _adiar(sem_espaco, "buffer de persistência cheio")
+
+    # só remove da fila o que já chegou ao banco; as linhas continuam no
+    # buffer e a próxima tentativa do item não as adiciona de novo
+    try:
+        persistencia.descarregar()
+    except Exception as e:
+        _adiar(gravando, str(e))
+        return len(duplicados) + descartados
+
+    # as métricas são consolidadas pela persistência, a partir das linhas inseridas
+    dedup.registrar(chaves)
+    ids = [item_id for item_id, _ in gravando]
+    _concluir(ids)
+    persistencia.esquecer(ids)
+    _stats["processados"] += len(ids) + len(duplicados)
+    return len(ids) + len(duplicados) + descartados
+
+
+async def _worker():
+    while True:
+        try:
+            progresso = await asyncio.to_thread(processar_lote)
+        except Exception as e:
+            log("INGESTAO", "ERROR", "Falha no worker da fila", extra={"erro": str(e)})
+            progresso = 0
+
+        # lote vazio ou sem progresso (ex.: armazenamento fora): espera o poll
+        if not progresso:
+            _novos.clear()
+            try:
+                await asyncio.wait_for(_novos.wait(), timeout=FILA_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+
+def iniciar():
+    global _novos
+    _conexao()
+    _novos = asyncio.Event()
+    for _ in range(FILA_WORKERS):
+        _tarefas.append(asyncio.create_task(_worker()))
+
+
+async def encerrar():
+    for tarefa in _tarefas:
+        tarefa.cancel()
+    await asyncio.gather(*_tarefas, return_exceptions=True)
+    _tarefas.clear()
+
+    # drena o que já foi reservado/recebido antes de sair; para no primeiro
+    # lote sem progresso (o restante fica na fila para a próxima subida)
+    while await asyncio.to_thread(processar_lote):
+        pass
+
+
+def estatisticas() -> Dict[str, Any]:
+    conn = _conexao()
+    with _lock:
+        pendentes, descartados = conn.execute(
+            "select coalesce(sum(descartado = 0), 0), coalesce(sum(descartado = 1), 0) from fila"
+        ).fetchone()
+    return {**_stats, "pendentes": pendentes, "descartados_na_fila": descartados, "workers": len(_tarefas)}
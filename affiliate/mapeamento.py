@@ -0,0 +1,89 @@
+# affiliate/mapeamento.py
+# Compilador do mapa de campos declarativo dos conectores
+# Cada mapa vira UMA função Python gerada: prefixos comuns ("data",
+# "data.purchase", ...) são lidos uma única vez e o evento universal é
+# montado num único literal, sem dicts intermediários.
+
+from datetime import datetime, timezone
+from typing import Dict, Any, Callable, List
+
+# Formato do caminho: "a.b.c"; alternativas separadas por "|" valem como
+# `or` (a primeira não vazia vence, a última é retornada como está).
+
+CAMPOS_UNIVERSAIS = [
+    "evento", "status", "transacao_id",
+    "produto.id", "produto.nome",
+    "afiliado.id", "afiliado.nome",
+    "comprador.email", "comprador.nome",
+    "financeiro.valor", "financeiro.moeda",
+    "timestamp_evento",
+]
+
+
+def _agora() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def compilar(origem: str, campos: Dict[str, str], padroes: Dict[str, Any]) -> Callable[..., Dict[str, Any]]:
+    """
+    Retorna normalizar(payload, raw) -> evento universal.
+    raw é o que vai para o campo "raw" do evento (dict ou bytes).
+    """
+    linhas: List[str] = []
+    prefixos: Dict[str, str] = {"": "p"}
+    constantes: Dict[str, Any] = {"_agora": _agora}
+
+    def variavel(caminho: str) -> str:
+        if caminho in prefixos:
+            return prefixos[caminho]
+        pai, _, chave = caminho.rpartition(".")
+        v_pai = variavel(pai)
+        nome = f"v{len(prefixos)}"
+        prefixos[caminho] = nome
+        linhas.append(f"    {nome} = {v_pai}.get({chave!r}) if type({v_pai}) is dict else None")
+        return nome
+
+    expressoes: Dict[str, str] = {}
+    for campo in CAMPOS_UNIVERSAIS:
+        alternativas = campos[campo].split("|") if campo in campos else []
+        if not alternativas:
+            expr = "None"
+        elif len(alternativas) == 1:
+            expr = variavel(alternativas[0])
+        else:
+            expr = "(" + " or ".join(variavel(alt) for alt in alternativas) + ")"
+
+        if campo in padroes:
+            padrao = padroes[campo]
+            nome = f"d{len(constantes)}"
+            constantes[nome] = padrao
+            valor_padrao = f"{nome}()" if callable(padrao) else nome
+            local = "c_" + campo.replace(".", "_")
+            linhas.append(f"    {local} = {expr}")
+            expr = f"({local} if {local} is not None else {valor_padrao})"
+
+        expressoes[campo] = expr
+
+    fonte = "\n".join([
+        "def normalizar(p, raw):",
+        *linhas,
+        "    return {",
+        f"        'origem': {origem!r},",
+        f"        'evento': {expressoes['evento']},",
+        f"        'status': {expressoes['status']},",
+        f"        'transacao_id': {expressoes['transacao_id']},",
+        f"        'produto': {{'id': {expressoes['produto.id']}, 'nome': {expressoes['produto.nome']}}},",
+        f"        'afiliado': {{'id': {expressoes['afiliado.id']}, 'nome': {expressoes['afiliado.nome']}}},",
+        f"        'comprador': {{'email': {expressoes['comprador.email']}, 'nome': {expressoes['comprador.nome']}}},",
+        f"        'financeiro': {{'valor': float({expressoes['financeiro.valor']} or 0), 'moeda': {expressoes['financeiro.moeda']}}},",
+        f"        'timestamp_evento': {expressoes['timestamp_evento']},",
+        "        'timestamp_ingestao': _agora(),",
+        "        'raw': raw,",
+        "    }",
+    ])
+
+    escopo: Dict[str, Any] = dict(constantes)
+    exec(compile(fonte, f"<normalizador {origem}>", "exec"), escopo)
+    normalizar = escopo["normalizar"]
+    normalizar.fonte = fonte
+    return normalizar
@@ -0,0 +1,272 @@
+# affiliate/persistencia.py
+# Persistência dos eventos normalizados — buffer + inserts multi-linha
+# Backends: Supabase/Postgres (produção) e SQLite local (testes)
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import json_rapido
+from affiliate import consolidacao
+from affiliate.dedup import ON_CONFLICT_EVENTOS
+from log_estruturado import log
+
+# ===============================
+# CONFIGURAÇÕES
+# ===============================
+
+PERSISTENCIA_BACKEND = os.getenv("PERSISTENCIA_BACKEND", "supabase")
+PERSISTENCIA_SQLITE_PATH = os.getenv("PERSISTENCIA_SQLITE_PATH", "eventos_afiliados.db")
+PERSISTENCIA_LOTE = int(os.getenv("PERSISTENCIA_LOTE", "200"))
+PERSISTENCIA_MAX_IDADE_SECONDS = float(os.getenv("PERSISTENCIA_MAX_IDADE_SECONDS", "2"))
+PERSISTENCIA_MAX_PENDENTES = int(os.getenv("PERSISTENCIA_MAX_PENDENTES", "5000"))
+# espera máxima por espaço no buffer cheio antes de desistir (BufferCheio)
+PERSISTENCIA_BACKPRESSURE_SECONDS = float(os.getenv("PERSISTENCIA_BACKPRESSURE_SECONDS", "1"))
+
+TABELA_EVENTOS = "eventos_afiliados"
+
+
+class BufferCheio(RuntimeError):
+    """O buffer não esvaziou dentro de PERSISTENCIA_BACKPRESSURE_SECONDS (armazenamento fora)."""
+
+
+def linha_evento(evento: Dict[str, Any]) -> Dict[str, Any]:
+    produto = evento.get("produto") or {}
+    afiliado = evento.get("afiliado") or {}
+    comprador = evento.get("comprador") or {}
+    financeiro = evento.get("financeiro") or {}
+    raw = evento.get("raw")
+    raw_bytes = isinstance(raw, (bytes, bytearray))
+
+    return {
+        "origem": evento.get("origem"),
+        "evento": evento.get("evento"),
+        "status": evento.get("status"),
+        "transacao_id": evento.get("transacao_id"),
+        "produto_id": None if produto.get("id") is None else str(produto.get("id")),
+        "produto_nome": produto.get("nome"),
+        "afiliado_id": None if afiliado.get("id") is None else str(afiliado.get("id")),
+        "comprador_email": comprador.get("email"),
+        "valor": financeiro.get("valor"),
+        "moeda": financeiro.get("moeda"),
+        "timestamp_evento": evento.get("timestamp_evento"),
+        "timestamp_ingestao": evento.get("timestamp_ingestao"),
+        "raw": None if raw_bytes else raw,
+        "raw_texto": raw.decode("utf-8", errors="replace") if raw_bytes else None,
+    }
+
+
+# ===============================
+# BACKENDS
+# ===============================
+
+# gravar(linhas) retorna só as linhas efetivamente inseridas: as ignoradas
+# pelo índice único não chegam à consolidação das métricas.
+
+class SupabaseBackend:
+    nome = "supabase"
+
+    def gravar(self, linhas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        from postgrest.types import ReturnMethod
+        from supabase_client import get_supabase
+
+        # índice único (origem, transacao_id, evento): reentregas são ignoradas;
+        # com ignore_duplicates o PostgREST devolve apenas as linhas inseridas
+        resultado = get_supabase().table(TABELA_EVENTOS).upsert(
+            linhas, on_conflict=ON_CONFLICT_EVENTOS, ignore_duplicates=True,
+            returning=ReturnMethod.representation
+        ).execute()
+        return resultado.data or []
+
+
+class SQLiteBackend:
+    nome = "sqlite"
+
+    def __init__(self, path: str = PERSISTENCIA_SQLITE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute(f"""
+            create table if not exists {TABELA_EVENTOS} (
+                id integer primary key autoincrement,
+                origem text, evento text, status text, transacao_id text,
+                produto_id text, produto_nome text, afiliado_id text,
+                comprador_email text, valor real, moeda text,
+                timestamp_evento text, timestamp_ingestao text, raw text,
+                raw_texto text
+            )
+        """)
+        self.conn.execute(f"""
+            create unique index if not exists {TABELA_EVENTOS}_dedup
+                on {TABELA_EVENTOS} ({ON_CONFLICT_EVENTOS})
+        """)
+
+    def gravar(self, linhas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        colunas = list(linhas[0])
+        sql = f"insert or ignore into {TABELA_EVENTOS} ({', '.join(colunas)}) values ({', '.join('?' * len(colunas))})"
+        inseridas = []
+        with self.lock, self.conn:
+            # uma execução por linha: rowcount (changes()) diz se ela entrou
+            for l in linhas:
+                cur = self.conn.execute(sql, tuple(
+                    json_rapido.dumps_str(l[c]) if c == "raw" and l[c] is not None else l[c]
+                    for c in colunas
+                ))
+                if cur.rowcount:
+                    inseridas.append(l)
+        return inseridas
+
+
+_BACKENDS = {"supabase": SupabaseBackend, "sqlite": SQLiteBackend}
+
+# ===============================
+# BUFFER
+# ===============================
+
+_cond = threading.Condition()
+# (item da fila de ingestão ou None, linha)
+_buffer: List[Tuple[Optional[int], Dict[str, Any]]] = []
+# itens da fila com linha no buffer / já gravada e ainda não concluída na fila:
+# numa nova tentativa do item, a linha não é adicionada outra vez
+_no_buffer: set = set()
+_gravados: set = set()
+_primeiro_em: Optional[float] = None
+_backend = None
+_gravando = threading.Lock()
+_parar = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+_stats: Dict[str, Any] = {
+    "adicionados": 0,
+    "gravados": 0,
+    "inseridos": 0,
+    "lotes": 0,
+    "falhas": 0,
+    "esperas_backpressure": 0,
+    "recusados_buffer_cheio": 0,
+}
+
+
+def configurar(backend=None):
+    """Troca o backend (ex.: SQLiteBackend(':memory:') em testes)."""
+    global _backend
+    _backend = backend or _BACKENDS[PERSISTENCIA_BACKEND]()
+
+
+def backend():
+    if _backend is None:
+        configurar()
+    return _backend
+
+
+def adicionar(evento: Dict[str, Any], item: Optional[int] = None):
+    """
+    Enfileira o evento no buffer. Se o buffer estiver cheio, espera até
+    PERSISTENCIA_BACKPRESSURE_SECONDS por uma descarga e então levanta
+    BufferCheio (a fila de ingestão adia o item). `item` é o id na fila de
+    ingestão: se a linha dele já está no buffer (descarga anterior falhou) ou
+    já foi gravada, não é adicionada de novo. Itens da fila não descarregam
+    aqui: processar_lote descarrega depois do lote e trata a falha do
+    armazenamento como adiamento, não como falha do item.
+    """
+    global _primeiro_em
+
+    with _cond:
+        if item is not None and (item in _no_buffer or item in _gravados):
+            return
+        if len(_buffer) >= PERSISTENCIA_MAX_PENDENTES:
+            _stats["esperas_backpressure"] += 1
+            if not _cond.wait_for(lambda: len(_buffer) < PERSISTENCIA_MAX_PENDENTES,
+                                  timeout=PERSISTENCIA_BACKPRESSURE_SECONDS):
+                _stats["recusados_buffer_cheio"] += 1
+                raise BufferCheio(f"Buffer de persistência cheio ({len(_buffer)} linhas)")
+        if not _buffer:
+            _primeiro_em = time.monotonic()
+        _buffer.append((item, linha_evento(evento)))
+        if item is not None:
+            _no_buffer.add(item)
+        _stats["adicionados"] += 1
+        cheio = item is None and len(_buffer) >= PERSISTENCIA_LOTE
+
+    if cheio:
+        descarregar()
+
+
+def descarregar() -> int:
+    """Grava tudo que está no buffer, em lotes de PERSISTENCIA_LOTE linhas."""
+    global _primeiro_em
+
+    total = 0
+    with _gravando:
+        while True:
+            with _cond:
+                lote = _buffer[:PERSISTENCIA_LOTE]
+            if not lote:
+                return total
+
+            try:
+                inseridas = backend().gravar([linha for _, linha in lote])
+            except Exception:
+                _stats["falhas"] += 1
+                raise
+
+            # métricas só contam o que o armazenamento de fato inseriu
+            consolidacao.adicionar_linhas(inseridas)
+
+            with _cond:
+                del _buffer[:len(lote)]
+                for item, _ in lote:
+                    if item is not None:
+                        _no_buffer.discard(item)
+                        _gravados.add(item)
+                _primeiro_em = time.monotonic() if _buffer else None
+                _cond.notify_all()
+
+            total += len(lote)
+            _stats["gravados"] += len(lote)
+            _stats["inseridos"] += len(inseridas)
+            _stats["lotes"] += 1
+
+
+def gravado(item: int) -> bool:
+    """A linha do item já foi gravada (e a fila ainda não o concluiu)."""
+    with _cond:
+        return item in _gravados
+
+
+def esquecer(itens: Iterable[int]):
+    """Chamado pela fila depois de concluir os itens."""
+    with _cond:
+        _gravados.difference_update(itens)
+
+
+def _loop_idade():
+    while not _parar.wait(PERSISTENCIA_MAX_IDADE_SECONDS / 2):
+        if _primeiro_em is not None and time.monotonic() - _primeiro_em >= PERSISTENCIA_MAX_IDADE_SECONDS:
+            try:
+                descarregar()
+            except Exception as e:
+                log("PERSISTENCIA", "ERROR", "Falha ao descarregar buffer", extra={"erro": str(e)})
+
+
+def iniciar():
+    global _thread
+    _parar.clear()
+    _thread = threading.Thread(target=_loop_idade, name="persistencia", daemon=True)
+    _thread.start()
+
+
+def encerrar():
+    _parar.set()
+    if _thread is not None:
+        _thread.join()
+    descarregar()
+
+
+def estatisticas() -> Dict[str, Any]:
+    return {
+        **_stats,
+        "backend": backend().nome,
+        "pendentes": len(_buffer),
+    }
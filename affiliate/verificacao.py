@@ -0,0 +1,196 @@
+# affiliate/verificacao.py
+# Verificação de webhooks compartilhada pelos conectores.
+# As chaves HMAC são pré-computadas uma vez por secret, toda comparação é em
+# tempo constante e cada plataforma aceita várias secrets ativas (rotação sem
+# downtime: "nova,antiga" no env). Corpos grandes ou malformados são
+# rejeitados antes de qualquer HMAC ou parse.
+
+import hmac
+import hashlib
+import os
+import time
+from typing import Dict, Any, List, Optional, Callable
+
+from fastapi import Request, HTTPException, status
+
+from log_estruturado import log
+
+WEBHOOK_MAX_BYTES = int(os.getenv("WEBHOOK_MAX_BYTES", str(256 * 1024)))
+
+# motivo -> (status HTTP, nível do log, mensagem do log, detail da resposta)
+MOTIVOS = {
+    "corpo_grande": (413, "WARN", "Corpo excede o limite", "Corpo excede o limite"),
+    "corpo_malformado": (status.HTTP_400_BAD_REQUEST, "WARN", "Corpo malformado", "Corpo malformado"),
+    "assinatura_ausente": (status.HTTP_401_UNAUTHORIZED, "WARN", "Assinatura ausente", "Assinatura ausente"),
+    "assinatura_invalida": (status.HTTP_401_UNAUTHORIZED, "ERROR", "Assinatura inválida", "Assinatura inválida"),
+    "token_invalido": (status.HTTP_401_UNAUTHORIZED, "ERROR", "Token inválido ou ausente", "Token inválido"),
+    "secret_invalida": (status.HTTP_401_UNAUTHORIZED, "ERROR", "Postback inválido — secret incorreta", "Postback inválido"),
+}
+
+_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def _novas_stats() -> Dict[str, Any]:
+    return {"verificacoes": 0, "aceitas": 0, "falhas": {}, "tempo_total_us": 0.0, "secrets_ativas": 0}
+
+
+def segredos(env: str) -> List[str]:
+    """Secrets ativas da plataforma, separadas por vírgula (a primeira é a atual)."""
+    return [s.strip() for s in (os.getenv(env) or "").split(",") if s.strip()]
+
+
+def _rejeitar(origem: str, motivo: str):
+    codigo, nivel, mensagem, detalhe = MOTIVOS[motivo]
+    falhas = _stats[origem]["falhas"]
+    falhas[motivo] = falhas.get(motivo, 0) + 1
+    log(origem, nivel, mensagem)
+    raise HTTPException(status_code=codigo, detail=detalhe)
+
+
+def _algum_igual(recebido: bytes, esperados: List[bytes]) -> bool:
+    # sem curto-circuito: o tempo não revela qual secret (ou se alguma) bateu
+    valido = False
+    for esperado in esperados:
+        valido |= hmac.compare_digest(recebido, esperado)
+    return valido
+
+
+def _token_do_header(request: Request, headers) -> Optional[str]:
+    for nome in headers:
+        token = request.headers.get(nome)
+        if token:
+            if token.lower().startswith("bearer "):
+                token = token.split(" ", 1)[1].strip()
+            return token
+    return None
+
+
+def _hmac_sha256(auth: Dict[str, Any], chaves: List[str]) -> Callable[[Request, bytes], Optional[str]]:
+    header = auth["header"]
+    # hmac.new(chave) já faz o padding da chave; por requisição só copy() + update()
+    base = [hmac.new(c.encode("utf-8"), digestmod=hashlib.sha256) for c in chaves]
+
+    def verificar(request: Request, corpo: bytes) -> Optional[str]:
+        assinatura = request.headers.get(header)
+        if not assinatura:
+            return "assinatura_ausente"
+        if len(assinatura) != 64:
+            return "assinatura_invalida"
+        try:
+            recebida = bytes.fromhex(assinatura)
+        except ValueError:
+            return "assinatura_invalida"
+
+        esperadas = []
+        for h in base:
+            h = h.copy()
+            h.update(corpo)
+            esperadas.append(h.digest())
+        return None if _algum_igual(recebida, esperadas) else "assinatura_invalida"
+
+    return verificar
+
+
+def _token_header(auth: Dict[str, Any], chaves: List[str]) -> Callable[[Request, bytes], Optional[str]]:
+    headers = auth["headers"]
+    esperados = [c.encode("utf-8") for c in chaves]
+
+    def verificar(request: Request, corpo: bytes) -> Optional[str]:
+        token = _token_do_header(request, headers)
+        if not token or not _algum_igual(token.encode("utf-8"), esperados):
+            return "token_invalido"
+        return None
+
+    return verificar
+
+
+def _query_secret(auth: Dict[str, Any], chaves: List[str]) -> Callable[[Request, bytes], Optional[str]]:
+    params = auth["params"]
+    esperados = [c.encode("utf-8") for c in chaves]
+
+    def verificar(request: Request, corpo: bytes) -> Optional[str]:
+        recebida = next((request.query_params.get(p) for p in params if request.query_params.get(p)), None)
+        if not recebida or not _algum_igual(recebida.encode("utf-8"), esperados):
+            return "secret_invalida"
+        return None
+
+    return verificar
+
+
+_TIPOS = {
+    "hmac_sha256": _hmac_sha256,
+    "token_header": _token_header,
+    "query_secret": _query_secret,
+}
+
+
+def _formato_plausivel(formato: str, corpo: bytes) -> bool:
+    # checagem barata, sem parse: JSON de webhook é sempre um objeto
+    if formato == "json":
+        return corpo.lstrip()[:1] == b"{"
+    return True
+
+
+async def ler_corpo(origem: str, request: Request) -> bytes:
+    """Lê o corpo respeitando WEBHOOK_MAX_BYTES (Content-Length e streaming)."""
+    _stats.setdefault(origem, _novas_stats())
+
+    tamanho = request.headers.get("content-length")
+    if tamanho is not None:
+        if not tamanho.isdigit():
+            _rejeitar(origem, "corpo_malformado")
+        if int(tamanho) > WEBHOOK_MAX_BYTES:
+            _rejeitar(origem, "corpo_grande")
+    if len(request.scope.get("query_string", b"")) > WEBHOOK_MAX_BYTES:
+        _rejeitar(origem, "corpo_grande")
+
+    partes = []
+    total = 0
+    async for chunk in request.stream():
+        total += len(chunk)
+        if total > WEBHOOK_MAX_BYTES:
+            _rejeitar(origem, "corpo_grande")
+        partes.append(chunk)
+    return b"".join(partes)
+
+
+def criar(origem: str, conector: Dict[str, Any], chaves: List[str]) -> Callable[[Request, bytes], None]:
+    """
+    Monta o verificador da plataforma com as secrets já processadas.
+    O verificador levanta HTTPException quando a requisição é rejeitada.
+    """
+    auth = conector["auth"]
+    if auth["tipo"] not in _TIPOS:
+        raise RuntimeError(f"Tipo de autenticação desconhecido: {auth['tipo']}")
+    if not chaves:
+        raise RuntimeError(f"Nenhuma secret ativa para {origem}")
+
+    formato = conector["formato"]
+    checar = _TIPOS[auth["tipo"]](auth, chaves)
+    stats = _stats.setdefault(origem, _novas_stats())
+    stats["secrets_ativas"] = len(chaves)
+
+    def verificar(request: Request, corpo: bytes):
+        inicio = time.perf_counter()
+        motivo = None if _formato_plausivel(formato, corpo) else "corpo_malformado"
+        if motivo is None:
+            motivo = checar(request, corpo)
+        stats["verificacoes"] += 1
+        stats["tempo_total_us"] += (time.perf_counter() - inicio) * 1e6
+        if motivo is not None:
+            _rejeitar(origem, motivo)
+        stats["aceitas"] += 1
+
+    return verificar
+
+
+def estatisticas() -> Dict[str, Any]:
+    return {
+        origem: {
+            **s,
+            "falhas": dict(s["falhas"]),
+            "tempo_total_us": round(s["tempo_total_us"], 1),
+            "tempo_medio_us": round(s["tempo_total_us"] / s["verificacoes"], 2) if s["verificacoes"] else 0.0,
+        }
+        for origem, s in _stats.items()
+    }
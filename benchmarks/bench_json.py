@@ -0,0 +1,80 @@
+# benchmarks/bench_json.py
+# Compara os backends JSON (stdlib x orjson) nos caminhos quentes:
+# parse do webhook Hotmart, linha de log estruturado e resposta de /produtos.
+#
+# Uso: python benchmarks/bench_json.py [--n 20000] [--produtos 1000]
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIR_AMOSTRAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "amostras")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _produtos(n: int):
+    return [
+        {
+            "id_produto": f"p{i:06d}",
+            "nome": f"Produto de afiliado número {i}",
+            "origem": ("HOTMART", "EDUZZ", "MONETIZZE", "CLICKBANK")[i % 4],
+            "preco": 97.0 + i % 300,
+            "ativo": i % 7 != 0,
+            "criado_em": "2025-12-25T10:00:00+00:00",
+        }
+        for i in range(n)
+    ]
+
+
+def main(n: int, quantidade_produtos: int):
+    with open(os.path.join(DIR_AMOSTRAS, "hotmart.json"), "rb") as f:
+        corpo_hotmart = f.read()
+    log = {
+        "timestamp": "2025-12-25T10:00:00+00:00",
+        "origem": "HOTMART",
+        "nivel": "INFO",
+        "mensagem": "Webhook recebido",
+        "extra": {"evento": "PURCHASE_APPROVED", "transacao_id": "HP16015479281022"},
+    }
+    produtos = _produtos(quantidade_produtos)
+
+    casos = {
+        "webhook hotmart (loads)": {
+            "json": lambda: json.loads(corpo_hotmart.decode("utf-8")),
+            "orjson": lambda: orjson.loads(corpo_hotmart),
+        },
+        "linha de log (dumps)": {
+            "json": lambda: json.dumps(log, ensure_ascii=False),
+            "orjson": lambda: orjson.dumps(log).decode("utf-8"),
+        },
+        f"/produtos x{quantidade_produtos} (dumps)": {
+            "json": lambda: json.dumps(produtos, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            "orjson": lambda: orjson.dumps(produtos),
+        },
+    }
+
+    print(f"{'caso':<28} {'backend':<8} {'us/op':>10}")
+    for caso, backends in casos.items():
+        repeticoes = max(1, n // quantidade_produtos) if caso.startswith("/produtos") else n
+        for backend, fn in backends.items():
+            if backend == "orjson" and orjson is None:
+                print(f"{caso:<28} {backend:<8} {'n/d':>10}")
+                continue
+            segundos = min(timeit.repeat(fn, number=repeticoes, repeat=3))
+            print(f"{caso:<28} {backend:<8} {segundos / repeticoes * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=20000)
+    parser.add_argument("--produtos", type=int, default=1000)
+    args = parser.parse_args()
+    main(args.n, args.produtos)
@@ -0,0 +1,76 @@
+# benchmarks/bench_normalizacao.py
+# Micro-benchmark dos normalizadores de afiliados sobre payloads gravados
+# (benchmarks/amostras/). Compara a interpretação do mapa de campos com o
+# normalizador compilado e os modos de raw (dict x bytes).
+#
+# Uso: python benchmarks/bench_normalizacao.py [--n 100000]
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from affiliate import conectores, persistencia  # noqa: E402
+
+AMOSTRAS = {
+    "HOTMART": "hotmart.json",
+    "EDUZZ": "eduzz.json",
+    "MONETIZZE": "monetizze.json",
+    "CLICKBANK": "clickbank.txt",
+}
+
+DIR_AMOSTRAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "amostras")
+
+
+def _carregar(origem: str):
+    with open(os.path.join(DIR_AMOSTRAS, AMOSTRAS[origem]), "rb") as f:
+        corpo = f.read()
+    return corpo, conectores.decodificar(origem, corpo)
+
+
+def _sem_timestamps(evento):
+    return {k: v for k, v in evento.items() if k not in ("timestamp_ingestao", "timestamp_evento")}
+
+
+def _alocacoes(fn, n: int = 1000) -> float:
+    tracemalloc.start()
+    antes = tracemalloc.take_snapshot()
+    guardados = [fn() for _ in range(n)]
+    depois = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocos = sum(s.count_diff for s in depois.compare_to(antes, "filename"))
+    del guardados
+    return blocos / n
+
+
+def main(n: int):
+    compilados = conectores._NORMALIZADORES
+    print(f"{'origem':<10} {'modo':<22} {'us/evento':>10} {'blocos retidos':>14}")
+
+    for origem in AMOSTRAS:
+        corpo, payload = _carregar(origem)
+
+        referencia = conectores.normalizar_evento_referencia(origem, payload)
+        compilado = compilados[origem](payload, payload)
+        assert _sem_timestamps(referencia) == _sem_timestamps(compilado), f"paridade {origem}"
+
+        casos = {
+            "referencia": lambda: conectores.normalizar_evento_referencia(origem, payload),
+            "compilado": lambda: compilados[origem](payload, payload),
+            # até o corpo que vai para o banco: linha + serialização
+            "raw=dict +envio": lambda: json.dumps(persistencia.linha_evento(compilados[origem](payload, payload))),
+            "raw=bytes +envio": lambda: json.dumps(persistencia.linha_evento(compilados[origem](payload, corpo))),
+        }
+        for modo, fn in casos.items():
+            segundos = min(timeit.repeat(fn, number=n, repeat=3))
+            print(f"{origem:<10} {modo:<22} {segundos / n * 1e6:>10.2f} {_alocacoes(fn):>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=100000)
+    main(parser.parse_args().n)
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Any, Optional, Iterable, Callable, Awaitable, Set
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+import json_rapido
+
+# Cache LRU em processo para endpoints de leitura, com ETag / Last-Modified.
+# Entradas são chaveadas por endpoint + parâmetros, expiram por TTL, respeitam
+# um orçamento de memória (bytes do corpo serializado) e carregam tags para
+# invalidação quando /atualizar ou a consolidação dos webhooks toca o produto.
+# Cada tag tem um contador de geração: uma resposta produzida enquanto uma
+# das suas tags foi invalidada não é guardada (serviria dado velho até o TTL).
+# Contadores só existem para tags com resposta em produção, e um índice
+# tag -> chaves faz a invalidação custar as entradas da tag, não o cache todo.
+
+RESPOSTAS_CACHE_TTL_SECONDS = float(os.getenv("RESPOSTAS_CACHE_TTL_SECONDS", "30"))
+RESPOSTAS_CACHE_MAX_BYTES = int(os.getenv("RESPOSTAS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+_lock = threading.Lock()
+_entradas: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_bytes = 0
+_por_tag: Dict[str, Set[str]] = {}
+_geracoes: Dict[str, int] = {}
+_em_producao: Dict[str, int] = {}  # tag -> respostas sendo produzidas
+
+_stats: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "nao_modificados": 0,
+    "invalidacoes": 0,
+    "despejos": 0,
+    "descartadas_por_invalidacao": 0,
+}
+
+
+def _remover(chave: str):
+    global _bytes
+    entrada = _entradas.pop(chave, None)
+    if entrada is None:
+        return
+    _bytes -= len(entrada["corpo"])
+    for tag in entrada["tags"]:
+        chaves = _por_tag.get(tag)
+        if chaves is not None:
+            chaves.discard(chave)
+            if not chaves:
+                del _por_tag[tag]
+
+
+def _obter(chave: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        entrada = _entradas.get(chave)
+        if entrada is None:
+            return None
+        if time.time() > entrada["expira_em"]:
+            _remover(chave)
+            return None
+        _entradas.move_to_end(chave)
+        return entrada
+
+
+def _geracao(tags: Iterable[str]) -> tuple:
+    """Marca as tags como em produção e devolve as gerações atuais."""
+    with _lock:
+        for t in tags:
+            _em_producao[t] = _em_producao.get(t, 0) + 1
+        return tuple(_geracoes.get(t, 0) for t in tags)
+
+
+def _liberar(tags: Iterable[str]):
+    # sem produção pendente, o contador da tag não protege mais nada
+    with _lock:
+        for t in tags:
+            restantes = _em_producao.get(t, 0) - 1
+            if restantes > 0:
+                _em_producao[t] = restantes
+            else:
+                _em_producao.pop(t, None)
+                _geracoes.pop(t, None)
+
+
+def _guardar(chave: str, entrada: Dict[str, Any], geracao: tuple):
+    global _bytes
+    tamanho = len(entrada["corpo"])
+    if tamanho > RESPOSTAS_CACHE_MAX_BYTES:
+        return
+
+    with _lock:
+        if tuple(_geracoes.get(t, 0) for t in entrada["tags"]) != geracao:
+            # invalidada enquanto produzir() rodava
+            _stats["descartadas_por_invalidacao"] += 1
+            return
+        _remover(chave)
+        _entradas[chave] = entrada
+        _bytes += tamanho
+        for tag in entrada["tags"]:
+            _por_tag.setdefault(tag, set()).add(chave)
+        while _bytes > RESPOSTAS_CACHE_MAX_BYTES:
+            antiga, _ = next(iter(_entradas.items()))
+            _remover(antiga)
+            _stats["despejos"] += 1
+
+
+def _nao_modificado(request: Request, entrada: Dict[str, Any]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return entrada["etag"] in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(entrada["criado_em"]) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _responder(request: Request, entrada: Dict[str, Any]) -> Response:
+    headers = {
+        "ETag": entrada["etag"],
+        "Last-Modified": formatdate(entrada["criado_em"], usegmt=True),
+        **entrada["headers"],
+    }
+    if _nao_modificado(request, entrada):
+        _stats["nao_modificados"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=entrada["corpo"], media_type="application/json", headers=headers)
+
+
+def chave(request: Request) -> str:
+    return f"{request.url.path}?{'&'.join(sorted(f'{k}={v}' for k, v in request.query_params.multi_items()))}"
+
+
+async def responder(request: Request, tags: Iterable[str],
+                    produzir: Callable[[], Awaitable[Any]],
+                    headers: Optional[Callable[[Any], Dict[str, str]]] = None) -> Response:
+    """
+    Serve do cache quando possível (304 se o cliente já tem a versão);
+    caso contrário chama produzir(), serializa, guarda e responde.
+    """
+    k = chave(request)
+    entrada = _obter(k)
+    if entrada is not None:
+        _stats["hits"] += 1
+        return _responder(request, entrada)
+
+    _stats["misses"] += 1
+    tags = list(tags)
+    geracao = _geracao(tags)
+    try:
+        dados = await produzir()
+        corpo = json_rapido.dumps(jsonable_encoder(dados))
+
+        agora = time.time()
+        entrada = {
+            "corpo": corpo,
+            "etag": '"' + hashlib.blake2b(corpo, digest_size=16).hexdigest() + '"',
+            "criado_em": agora,
+            "expira_em": agora + RESPOSTAS_CACHE_TTL_SECONDS,
+            "tags": tags,
+            "headers": headers(dados) if headers else {},
+        }
+        _guardar(k, entrada, geracao)
+    finally:
+        _liberar(tags)
+    return _responder(request, entrada)
+
+
+def invalidar(*tags: str):
+    with _lock:
+        for tag in set(tags):
+            if tag in _em_producao:
+                _geracoes[tag] = _geracoes.get(tag, 0) + 1
+            for k in list(_por_tag.get(tag, ())):
+                _remover(k)
+                _stats["invalidacoes"] += 1
+
+
+def invalidar_produto(id_produto: Any):
+    # só as respostas derivadas das métricas do produto; /produtos lê a
+    # tabela produtos, que as gravações de métricas não alteram
+    if id_produto is not None:
+        invalidar(f"produto:{id_produto}")
+
+
+def estatisticas() -> Dict[str, Any]:
+    return {
+        **_stats,
+        "entradas": len(_entradas),
+        "tags": len(_por_tag),
+        "bytes": _bytes,
+        "max_bytes": RESPOSTAS_CACHE_MAX_BYTES,
+        "ttl_seconds": RESPOSTAS_CACHE_TTL_SECONDS,
+    }
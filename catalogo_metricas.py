@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from supabase_client import executar
+
+# Cache em processo do catálogo metricas_tipo (codigo -> id).
+# O catálogo quase nunca muda: recarrega por TTL, por invalidação explícita
+# ou quando chega um código desconhecido (um único refresh antes do 400).
+
+CATALOGO_TTL_SECONDS = float(os.getenv("CATALOGO_TTL_SECONDS", "300"))
+
+_lock = threading.Lock()
+_mapa: Dict[str, Any] = {}
+_carregado_em: Optional[float] = None
+
+_stats: Dict[str, Any] = {
+    "versao": 0,
+    "hits": 0,
+    "misses": 0,
+    "refreshes": 0,
+}
+
+
+def _expirado() -> bool:
+    return _carregado_em is None or time.time() - _carregado_em > CATALOGO_TTL_SECONDS
+
+
+async def recarregar(supabase) -> Dict[str, Any]:
+    global _mapa, _carregado_em
+
+    catalogo = await executar(supabase.table("metricas_tipo").select("codigo, id"))
+    novo = {m["codigo"]: m["id"] for m in catalogo.data}
+
+    with _lock:
+        if novo != _mapa:
+            _stats["versao"] += 1
+        _mapa = novo
+        _carregado_em = time.time()
+        _stats["refreshes"] += 1
+        return _mapa
+
+
+async def obter_mapa(supabase, forcar: bool = False) -> Dict[str, Any]:
+    if forcar or _expirado():
+        _stats["misses"] += 1
+        return await recarregar(supabase)
+
+    _stats["hits"] += 1
+    return _mapa
+
+
+def invalidar():
+    global _carregado_em
+    with _lock:
+        _carregado_em = None
+
+
+def estatisticas() -> Dict[str, Any]:
+    return {
+        **_stats,
+        "codigos": len(_mapa),
+        "ttl_seconds": CATALOGO_TTL_SECONDS,
+        "idade_seconds": None if _carregado_em is None else round(time.time() - _carregado_em, 3),
+    }
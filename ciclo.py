@@ -0,0 +1,251 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Awaitable
+
+import catalogo_metricas
+import db
+import lease
+import ranking
+from affiliate import clickbank, consolidacao, ingestao, persistencia
+from log_estruturado import log
+from supabase_client import get_supabase, executar
+
+# Ciclo operacional executado dentro da API (POST /ciclo).
+# Etapas em sequência; dentro de uma etapa, tarefas independentes rodam em
+# paralelo. Cada etapa reporta sua duração e uma falha não impede as
+# seguintes de tentar (o status do ciclo vira "parcial").
+#
+#   eventos      -> pull ClickBank + drenagem da fila  |  catálogo de métricas
+#   consolidacao -> deltas por (produto, dia) em produto_metrica_historico
+#   ranking      -> recalcula e grava só os produtos marcados
+#                   (ranking.atualizar_pendentes, a mesma do laço em background)
+#
+# A flag de operação ativa fica no Postgres (tabela operacao, sql/leases.sql)
+# para valer em todas as instâncias; a leitura é cacheada por
+# OPERACAO_CACHE_SECONDS. Sem DATABASE_URL fica só em memória.
+
+OPERACAO_ATIVA = os.getenv("OPERACAO_ATIVA", "true").lower() in ("1", "true", "sim")  # sem linha na tabela
+OPERACAO_CACHE_SECONDS = float(os.getenv("OPERACAO_CACHE_SECONDS", "5"))
+CICLO_RESULTADO_LOTE = int(os.getenv("CICLO_RESULTADO_LOTE", "50"))
+CICLO_RESULTADO_FLUSH_SECONDS = float(os.getenv("CICLO_RESULTADO_FLUSH_SECONDS", "30"))
+# com várias instâncias, o lease do ciclo fica retido por este tempo após a
+# conclusão: os loops das outras instâncias não repetem o mesmo ciclo
+CICLO_LEASE_RETER_SECONDS = float(os.getenv("CICLO_LEASE_RETER_SECONDS", "540"))
+
+TABELA_RESULTADOS = "ciclos_resultado"
+
+_ativa = OPERACAO_ATIVA
+_ativa_lida_em: Optional[float] = None
+_em_execucao: Optional[asyncio.Lock] = None
+
+_lock_resultados = threading.Lock()
+_resultados: List[Dict[str, Any]] = []
+
+_stats: Dict[str, Any] = {
+    "ciclos": 0,
+    "parciais": 0,
+    "recusados_em_andamento": 0,
+    "recusados_outra_instancia": 0,
+    "interrompidos_lease_perdido": 0,
+    "resultados_recebidos": 0,
+    "resultados_gravados": 0,
+    "ultimo": None,
+}
+
+
+# ===============================
+# OPERAÇÃO ATIVA (FLAG COMPARTILHADA)
+# ===============================
+
+def operacao_ativa() -> bool:
+    """Bloqueante (lê o Postgres quando o cache venceu): chamar via to_thread."""
+    global _ativa, _ativa_lida_em
+    if not lease.ativo():
+        return _ativa
+    if _ativa_lida_em is not None and time.monotonic() - _ativa_lida_em < OPERACAO_CACHE_SECONDS:
+        return _ativa
+    try:
+        with db.get_conn() as conn, conn.cursor() as cur:
+            cur.execute("select ativa from operacao where id = 1")
+            linha = cur.fetchone()
+    except Exception as e:
+        # mantém o último valor conhecido; a próxima chamada tenta de novo
+        log("CICLO", "ERROR", "Falha ao ler operação ativa", extra={"erro": str(e)})
+        return _ativa
+    _ativa = linha["ativa"] if linha else OPERACAO_ATIVA
+    _ativa_lida_em = time.monotonic()
+    return _ativa
+
+
+def definir_operacao_ativa(ativa: bool):
+    global _ativa, _ativa_lida_em
+    if lease.ativo():
+        with db.get_conn() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                insert into operacao (id, ativa) values (1, %s)
+                on conflict (id) do update set ativa = excluded.ativa, atualizado_em = now()
+                """,
+                (ativa,),
+            )
+    _ativa = ativa
+    _ativa_lida_em = time.monotonic()
+    log("CICLO", "INFO", "Operação ativa alterada", extra={"operacao_ativa": ativa})
+
+
+# ===============================
+# ETAPAS
+# ===============================
+
+async def _pull_e_fila() -> Dict[str, Any]:
+    resultado: Dict[str, Any] = {}
+    if clickbank.CLICKBANK_API_KEY:
+        resumo = await clickbank.sincronizar()
+        resultado["clickbank"] = {"status": resumo["status"], "enfileirados": resumo["enfileirados"],
+                                  "falhas": len(resumo["falhas"])}
+
+    # para no primeiro lote sem progresso: numa queda do armazenamento os
+    # itens ficam adiados na fila em vez de consumir as tentativas aqui
+    processados = 0
+    while True:
+        n = await asyncio.to_thread(ingestao.processar_lote)
+        processados += n
+        if not n:
+            break
+    await asyncio.to_thread(persistencia.descarregar)
+    resultado["fila_processados"] = processados
+    if clickbank.CLICKBANK_API_KEY:
+        # pedidos do pull já gravados: o cursor passa a valer para as outras instâncias
+        await asyncio.to_thread(clickbank.publicar_cursor)
+    return resultado
+
+
+async def _catalogo(supabase) -> Dict[str, Any]:
+    return {"metricas": len(await catalogo_metricas.obter_mapa(supabase))}
+
+
+async def _etapa(nome: str, etapas: Dict[str, Any], *tarefas: Awaitable[Any]) -> bool:
+    inicio = time.perf_counter()
+    resultados = await asyncio.gather(*tarefas, return_exceptions=True)
+    erros = [str(r) for r in resultados if isinstance(r, Exception)]
+    etapas[nome] = {
+        "status": "erro" if erros else "ok",
+        "duracao_ms": round((time.perf_counter() - inicio) * 1000, 1),
+        "resultado": {k: v for r in resultados if isinstance(r, dict) for k, v in r.items()},
+    }
+    if erros:
+        etapas[nome]["erros"] = erros
+        log("CICLO", "ERROR", f"Falha na etapa {nome}", extra={"erros": erros})
+    return not erros
+
+
+async def executar_ciclo(supabase=None) -> Dict[str, Any]:
+    global _em_execucao
+    if _em_execucao is None:
+        _em_execucao = asyncio.Lock()
+    if _em_execucao.locked():
+        _stats["recusados_em_andamento"] += 1
+        return {"status": "em_andamento"}
+
+    async with _em_execucao, lease.manter("ciclo_operacional", reter_por=CICLO_LEASE_RETER_SECONDS) as posse:
+        if not posse:
+            _stats["recusados_outra_instancia"] += 1
+            return {"status": "em_outra_instancia"}
+
+        supabase = supabase or get_supabase()
+        iniciado_em = datetime.now(timezone.utc).isoformat()
+        inicio = time.perf_counter()
+        etapas: Dict[str, Any] = {}
+
+        ok = await _etapa("eventos", etapas, _pull_e_fila(), _catalogo(supabase))
+
+        async def consolidar():
+            return {"linhas": await consolidacao.descarregar(supabase)}
+        if posse:
+            ok &= await _etapa("consolidacao", etapas, consolidar())
+
+        if not posse:
+            # lease perdido no meio do ciclo: outra instância pode já estar
+            # rodando o mesmo ciclo; as etapas seguintes ficam para ela
+            _stats["interrompidos_lease_perdido"] += 1
+            return {
+                "status": "lease_perdido",
+                "inicio": iniciado_em,
+                "duracao_ms": round((time.perf_counter() - inicio) * 1000, 1),
+                "etapas": etapas,
+            }
+
+        # os marcados pertencem a ranking.atualizar_pendentes; se o laço em
+        # background estiver gravando, a etapa espera e grava o que sobrou
+        async def atualizar_ranking():
+            return {"gravados": await ranking.atualizar_pendentes(supabase)}
+        gravou = await _etapa("ranking", etapas, atualizar_ranking())
+
+        resultado = {
+            "status": "ok" if ok and gravou else "parcial",
+            "inicio": iniciado_em,
+            "duracao_ms": round((time.perf_counter() - inicio) * 1000, 1),
+            "etapas": etapas,
+        }
+
+    _stats["ciclos"] += 1
+    _stats["parciais"] += resultado["status"] != "ok"
+    _stats["ultimo"] = {k: resultado[k] for k in ("status", "inicio", "duracao_ms")}
+    return resultado
+
+
+# ===============================
+# REGISTRO DOS RESULTADOS (EM LOTE)
+# ===============================
+
+def registrar_resultado(registro: Dict[str, Any]) -> bool:
+    """Bufferiza o registro; retorna True quando o lote já pode ser gravado."""
+    with _lock_resultados:
+        _resultados.append({
+            "registrado_em": registro.get("timestamp") or datetime.now(timezone.utc).isoformat(),
+            "status": (registro.get("resultado") or {}).get("status"),
+            "duracao_ms": (registro.get("resultado") or {}).get("duracao_ms"),
+            "resultado": registro.get("resultado"),
+        })
+        cheio = len(_resultados) >= CICLO_RESULTADO_LOTE
+    _stats["resultados_recebidos"] += 1
+    return cheio
+
+
+async def descarregar_resultados(supabase=None) -> int:
+    global _resultados
+    with _lock_resultados:
+        lote, _resultados = _resultados, []
+    if not lote:
+        return 0
+
+    supabase = supabase or get_supabase()
+    try:
+        for inicio in range(0, len(lote), CICLO_RESULTADO_LOTE):
+            await executar(supabase.table(TABELA_RESULTADOS).insert(lote[inicio:inicio + CICLO_RESULTADO_LOTE]))
+    except Exception:
+        with _lock_resultados:
+            _resultados[:0] = lote
+        raise
+    _stats["resultados_gravados"] += len(lote)
+    return len(lote)
+
+
+async def descarregar_resultados_em_segundo_plano():
+    try:
+        await descarregar_resultados()
+    except Exception as e:
+        log("CICLO", "ERROR", "Falha ao gravar resultados de ciclo", extra={"erro": str(e)})
+
+
+async def loop_resultados():
+    while True:
+        await asyncio.sleep(CICLO_RESULTADO_FLUSH_SECONDS)
+        await descarregar_resultados_em_segundo_plano()
+
+
+def estatisticas() -> Dict[str, Any]:
+    return {**_stats, "operacao_ativa": _ativa, "resultados_pendentes": len(_resultados)}
@@ -1,6 +1,86 @@
 import os
-import psycopg2
+import threading
+import time
+from contextlib import contextmanager
+
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+# pool esgotado: quanto uma thread espera por uma conexão antes de desistir
+DB_POOL_ESPERA_SECONDS = float(os.getenv("DB_POOL_ESPERA_SECONDS", "30"))
+
+_lock = threading.Lock()
+# ThreadedConnectionPool.getconn falha (em vez de esperar) com o pool esgotado
+_vagas = threading.BoundedSemaphore(DB_POOL_MAX)
+_pool = None
+_ultimo_uso = {}
+
 
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    os.getenv("DATABASE_URL"),
+                    cursor_factory=RealDictCursor,
+                )
+    return _pool
+
+
+@contextmanager
 def get_conn():
-    return psycopg2.connect(os.getenv("DATABASE_URL"), cursor_factory=RealDictCursor)
+    """
+    Empresta uma conexão do pool. Commit ao sair sem erro, rollback caso
+    contrário; conexões ociosas além de DB_POOL_IDLE_TIMEOUT são recicladas.
+    Com o pool esgotado espera até DB_POOL_ESPERA_SECONDS por uma conexão.
+    """
+    pool = _get_pool()
+    if not _vagas.acquire(timeout=DB_POOL_ESPERA_SECONDS):
+        raise PoolError(f"Nenhuma conexão livre em {DB_POOL_ESPERA_SECONDS}s")
+
+    try:
+        conn = pool.getconn()
+
+        ultimo = _ultimo_uso.get(id(conn))
+        if conn.closed or (ultimo and time.time() - ultimo > DB_POOL_IDLE_TIMEOUT):
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _ultimo_uso[id(conn)] = time.time()
+            pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        _vagas.release()
+
+
+def fechar_pool():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+        _ultimo_uso.clear()
+
+
+def saude_pool():
+    if _pool is None:
+        return {"ativo": False}
+    return {
+        "ativo": True,
+        "min": DB_POOL_MIN,
+        "max": DB_POOL_MAX,
+        "em_uso": len(_pool._used),
+        "livres": len(_pool._pool),
+    }
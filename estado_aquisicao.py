@@ -0,0 +1,183 @@
+import copy
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from psycopg2.extras import Json, execute_values
+
+import db
+
+# Estado das campanhas de aquisição (acquisition_meta_ads.py).
+# Um registro por campanha em memória, protegido por lock: leituras são
+# snapshots da memória e atualizações de gasto são atômicas. Registros
+# alterados são gravados em lote em aquisicao_campanhas (sql/aquisicao_campanhas.sql);
+# no restart carregar() devolve as campanhas em andamento sem chamar a Graph API.
+# Quem grava é o monitor: descarregar() depois de cada rodada e logo após
+# registrar uma campanha nova. Sem DATABASE_URL o estado fica só em memória.
+
+TABELA = "aquisicao_campanhas"
+CAMPOS = (
+    "campaign_id", "adset_ids", "status", "limite_gasto", "started_at",
+    "last_spend", "total_spend", "last_error", "atualizado_em",
+)
+
+_lock = threading.Lock()
+_campanhas: Dict[str, Dict[str, Any]] = {}
+_alteradas: set = set()
+
+_stats: Dict[str, int] = {
+    "atualizacoes_gasto": 0,
+    "gravacoes": 0,
+    "registros_gravados": 0,
+    "carregados": 0,
+}
+
+
+def persistente() -> bool:
+    return bool(os.getenv("DATABASE_URL"))
+
+
+def _agora() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# ===============================
+# ESCRITA (ATÔMICA, EM MEMÓRIA)
+# ===============================
+
+def registrar(campaign_id: str, adset_ids: List[str], limite_gasto: float) -> Dict[str, Any]:
+    registro = {
+        "campaign_id": campaign_id,
+        "adset_ids": list(adset_ids),
+        "status": "RUNNING",
+        "limite_gasto": limite_gasto,
+        "started_at": _agora(),
+        "last_spend": 0.0,
+        "total_spend": 0.0,
+        "last_error": None,
+        "atualizado_em": _agora(),
+    }
+    with _lock:
+        _campanhas[campaign_id] = registro
+        _alteradas.add(campaign_id)
+        return copy.deepcopy(registro)
+
+
+def atualizar_gasto(campaign_id: str, total_spend: float) -> Optional[Dict[str, Any]]:
+    """
+    Grava o gasto acumulado informado pela Graph e o delta desde a última
+    leitura numa única seção crítica. Retorna o registro atualizado.
+    """
+    with _lock:
+        registro = _campanhas.get(campaign_id)
+        if registro is None:
+            return None
+        registro["last_spend"] = total_spend - registro["total_spend"]
+        registro["total_spend"] = total_spend
+        registro["last_error"] = None
+        registro["atualizado_em"] = _agora()
+        _alteradas.add(campaign_id)
+        _stats["atualizacoes_gasto"] += 1
+        return copy.deepcopy(registro)
+
+
+def marcar(campaign_id: str, status: Optional[str] = None, erro: Any = None):
+    with _lock:
+        registro = _campanhas.get(campaign_id)
+        if registro is None:
+            return
+        if status is not None:
+            registro["status"] = status
+        registro["last_error"] = erro
+        registro["atualizado_em"] = _agora()
+        _alteradas.add(campaign_id)
+
+
+# ===============================
+# LEITURA (SNAPSHOTS DA MEMÓRIA)
+# ===============================
+
+def obter(campaign_id: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        registro = _campanhas.get(campaign_id)
+        return copy.deepcopy(registro) if registro is not None else None
+
+
+def snapshot(status: Optional[str] = None) -> List[Dict[str, Any]]:
+    with _lock:
+        return [copy.deepcopy(r) for r in _campanhas.values() if status is None or r["status"] == status]
+
+
+# ===============================
+# POSTGRES (WRITE-THROUGH EM LOTE)
+# ===============================
+
+def descarregar() -> int:
+    with _lock:
+        lote = [copy.deepcopy(_campanhas[c]) for c in _alteradas if c in _campanhas]
+        _alteradas.clear()
+    if not lote or not persistente():
+        return 0
+
+    try:
+        with db.get_conn() as conn, conn.cursor() as cur:
+            execute_values(
+                cur,
+                f"""
+                insert into {TABELA} ({", ".join(CAMPOS)})
+                values %s
+                on conflict (campaign_id) do update
+                   set adset_ids = excluded.adset_ids,
+                       status = excluded.status,
+                       limite_gasto = excluded.limite_gasto,
+                       last_spend = excluded.last_spend,
+                       total_spend = excluded.total_spend,
+                       last_error = excluded.last_error,
+                       atualizado_em = excluded.atualizado_em
+                 where {TABELA}.atualizado_em <= excluded.atualizado_em
+                """,
+                [
+                    tuple(Json(r[c]) if c in ("adset_ids", "last_error") else r[c] for c in CAMPOS)
+                    for r in lote
+                ],
+            )
+    except Exception:
+        # volta a marcar como alteradas para a próxima gravação
+        with _lock:
+            _alteradas.update(r["campaign_id"] for r in lote)
+        raise
+
+    _stats["gravacoes"] += 1
+    _stats["registros_gravados"] += len(lote)
+    return len(lote)
+
+
+def carregar(status: str = "RUNNING") -> List[Dict[str, Any]]:
+    """Repõe em memória as campanhas gravadas (por padrão, só as em andamento)."""
+    if not persistente():
+        return snapshot(status)
+
+    with db.get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"select {', '.join(CAMPOS)} from {TABELA} where status = %s", (status,))
+        linhas = cur.fetchall()
+
+    with _lock:
+        for linha in linhas:
+            registro = dict(linha)
+            for campo in ("limite_gasto", "last_spend", "total_spend"):
+                registro[campo] = float(registro[campo] or 0)
+            for campo in ("started_at", "atualizado_em"):
+                if isinstance(registro[campo], datetime):
+                    registro[campo] = registro[campo].isoformat()
+            _campanhas.setdefault(registro["campaign_id"], registro)
+    _stats["carregados"] += len(linhas)
+    return snapshot(status)
+
+
+def estatisticas() -> Dict[str, Any]:
+    with _lock:
+        por_status: Dict[str, int] = {}
+        for r in _campanhas.values():
+            por_status[r["status"]] = por_status.get(r["status"], 0) + 1
+    return {**_stats, "campanhas": por_status, "pendentes_gravacao": len(_alteradas), "persistente": persistente()}
@@ -0,0 +1,50 @@
+import json
+import os
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+# Backend JSON rápido opcional. Usa orjson quando instalado (e não desligado
+# por JSON_BACKEND=json); caso contrário cai no json da stdlib com a mesma API.
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+
+if os.getenv("JSON_BACKEND", "orjson") == "json":
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+if orjson is not None:
+    _OPCOES = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def loads(dados: Any) -> Any:
+        """Aceita bytes, bytearray, memoryview ou str."""
+        return orjson.loads(dados)
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=str, option=_OPCOES)
+
+else:
+    def loads(dados: Any) -> Any:
+        if isinstance(dados, (bytes, bytearray, memoryview)):
+            dados = bytes(dados).decode("utf-8")
+        return json.loads(dados)
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(
+            obj, ensure_ascii=False, default=str, separators=(",", ":")
+        ).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+class RespostaJSON(JSONResponse):
+    """Resposta padrão da API serializada pelo backend selecionado."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,244 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+import db
+from log_estruturado import log
+
+# Coordenação entre instâncias (Render com mais de uma cópia da API/loop).
+# Leases são linhas em `leases` (sql/leases.sql) com dono e expiração: só o
+# dono renova (heartbeat) e, vencido o prazo, qualquer instância assume.
+# Instâncias vivas mandam batimentos para `instancias`; a lista ordenada
+# define a partição de cada uma no trabalho dividido por hash de produto.
+# Os cursores das sincronizações pull também ficam aqui, compartilhados.
+# Sem DATABASE_URL (desenvolvimento local) tudo vira no-op de uma instância.
+
+LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", "30"))
+LEASE_HEARTBEAT_SECONDS = float(os.getenv("LEASE_HEARTBEAT_SECONDS", "10"))
+
+INSTANCIA_ID = (
+    os.getenv("INSTANCIA_ID")
+    or os.getenv("RENDER_INSTANCE_ID")
+    or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+)
+
+_stats: Dict[str, Any] = {
+    "adquiridos": 0,
+    "recusados": 0,
+    "renovacoes": 0,
+    "perdidos": 0,
+    "batimentos": 0,
+}
+
+
+def ativo() -> bool:
+    return bool(os.getenv("DATABASE_URL"))
+
+
+# ===============================
+# LEASES
+# ===============================
+
+def adquirir(nome: str, ttl: float = LEASE_TTL_SECONDS) -> bool:
+    if not ativo():
+        return True
+    with db.get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            insert into leases (nome, dono, expira_em)
+            values (%s, %s, now() + %s * interval '1 second')
+            on conflict (nome) do update
+               set dono = excluded.dono, expira_em = excluded.expira_em
+             where leases.expira_em < now() or leases.dono = excluded.dono
+            returning dono
+            """,
+            (nome, INSTANCIA_ID, ttl),
+        )
+        adquirido = cur.fetchone() is not None
+    _stats["adquiridos" if adquirido else "recusados"] += 1
+    return adquirido
+
+
+def renovar(nome: str, ttl: float = LEASE_TTL_SECONDS) -> bool:
+    if not ativo():
+        return True
+    with db.get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            update leases set expira_em = now() + %s * interval '1 second'
+             where nome = %s and dono = %s and expira_em >= now()
+            returning dono
+            """,
+            (ttl, nome, INSTANCIA_ID),
+        )
+        renovado = cur.fetchone() is not None
+    _stats["renovacoes" if renovado else "perdidos"] += 1
+    return renovado
+
+
+def liberar(nome: str, reter_por: float = 0):
+    """
+    Solta o lease. Com reter_por > 0 o lease continua com este dono por mais
+    esse tempo, para que outra instância não repita um ciclo recém-concluído.
+    """
+    if not ativo():
+        return
+    with db.get_conn() as conn, conn.cursor() as cur:
+        if reter_por > 0:
+            cur.execute(
+                "update leases set expira_em = now() + %s * interval '1 second' where nome = %s and dono = %s",
+                (reter_por, nome, INSTANCIA_ID),
+            )
+        else:
+            cur.execute("delete from leases where nome = %s and dono = %s", (nome, INSTANCIA_ID))
+
+
+class Posse:
+    """
+    Resultado de manter(): verdadeiro enquanto o lease é desta instância.
+    Vira falso quando o lease é perdido no meio do bloco (renovação recusada
+    ou sem renovar por mais de um TTL); o bloco deve checar entre etapas ou
+    aguardar `perdida` e parar, senão outra instância repete o trabalho.
+    """
+
+    def __init__(self, nome: str, adquirida: bool):
+        self.nome = nome
+        self.adquirida = adquirida
+        self.perdida = asyncio.Event()
+
+    def __bool__(self) -> bool:
+        return self.adquirida and not self.perdida.is_set()
+
+    def perder(self):
+        if not self.perdida.is_set():
+            log("LEASE", "ERROR", "Lease perdido durante a execução", extra={"lease": self.nome})
+        self.perdida.set()
+
+
+@asynccontextmanager
+async def manter(nome: str, ttl: float = LEASE_TTL_SECONDS, reter_por: float = 0):
+    """
+    async with lease.manter("ciclo") as posse:
+        if not posse: return      # com outra instância
+        ...                       # checar `posse` de novo entre etapas
+    Renova o lease em segundo plano enquanto o bloco roda.
+    """
+    posse = Posse(nome, await asyncio.to_thread(adquirir, nome, ttl))
+    if not posse.adquirida:
+        yield posse
+        return
+
+    async def heartbeat():
+        renovado_em = time.monotonic()
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                if not await asyncio.to_thread(renovar, nome, ttl):
+                    posse.perder()
+                    return
+                renovado_em = time.monotonic()
+            except Exception as e:
+                log("LEASE", "ERROR", "Falha ao renovar lease", extra={"lease": nome, "erro": str(e)})
+                # sem renovar por um TTL inteiro outra instância pode ter assumido
+                if time.monotonic() - renovado_em >= ttl:
+                    posse.perder()
+                    return
+
+    tarefa = asyncio.create_task(heartbeat())
+    try:
+        yield posse
+    finally:
+        tarefa.cancel()
+        try:
+            await asyncio.to_thread(liberar, nome, reter_por)
+        except Exception as e:
+            log("LEASE", "ERROR", "Falha ao liberar lease", extra={"lease": nome, "erro": str(e)})
+
+
+# ===============================
+# INSTÂNCIAS VIVAS / PARTIÇÕES
+# ===============================
+
+def bater():
+    if not ativo():
+        return
+    with db.get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            insert into instancias (id, batimento_em) values (%s, now())
+            on conflict (id) do update set batimento_em = excluded.batimento_em
+            """,
+            (INSTANCIA_ID,),
+        )
+    _stats["batimentos"] += 1
+
+
+def instancias_vivas() -> List[str]:
+    if not ativo():
+        return [INSTANCIA_ID]
+    with db.get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "select id from instancias where batimento_em >= now() - %s * interval '1 second' order by id",
+            (LEASE_TTL_SECONDS,),
+        )
+        vivas = [linha["id"] for linha in cur.fetchall()]
+    return vivas if INSTANCIA_ID in vivas else sorted(vivas + [INSTANCIA_ID])
+
+
+def particao() -> Tuple[int, int]:
+    """(índice desta instância, total de instâncias vivas)."""
+    vivas = instancias_vivas()
+    return vivas.index(INSTANCIA_ID), len(vivas)
+
+
+async def loop_batimento():
+    while True:
+        try:
+            await asyncio.to_thread(bater)
+        except Exception as e:
+            log("LEASE", "ERROR", "Falha no batimento da instância", extra={"erro": str(e)})
+        await asyncio.sleep(LEASE_HEARTBEAT_SECONDS)
+
+
+def encerrar():
+    if not ativo():
+        return
+    with db.get_conn() as conn, conn.cursor() as cur:
+        # leases retidos expiram sozinhos; os em uso já foram soltos por manter()
+        cur.execute("delete from instancias where id = %s", (INSTANCIA_ID,))
+
+
+# ===============================
+# CURSORES COMPARTILHADOS
+# ===============================
+
+def ler_cursor(nome: str) -> Optional[str]:
+    if not ativo():
+        return None
+    with db.get_conn() as conn, conn.cursor() as cur:
+        cur.execute("select valor from cursores where nome = %s", (nome,))
+        linha = cur.fetchone()
+    return linha["valor"] if linha else None
+
+
+def gravar_cursor(nome: str, valor: str):
+    """Só avança: um valor menor que o gravado é ignorado."""
+    if not ativo():
+        return
+    with db.get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            insert into cursores (nome, valor) values (%s, %s)
+            on conflict (nome) do update set valor = excluded.valor, atualizado_em = now()
+             where cursores.valor < excluded.valor
+            """,
+            (nome, valor),
+        )
+
+
+def estatisticas() -> Dict[str, Any]:
+    return {**_stats, "instancia": INSTANCIA_ID, "ativo": ativo()}
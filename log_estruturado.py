@@ -0,0 +1,153 @@
+import atexit
+import contextvars
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
+
+import json_rapido
+
+# Logger estruturado compartilhado (API, conectores, fila e loop operacional).
+# log() só coloca uma tupla numa fila limitada; formatação JSON e escrita no
+# stdout acontecem numa thread de background, em lotes. Fila cheia descarta a
+# linha (e conta) em vez de bloquear o webhook.
+
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_AMOSTRAGEM_INFO = float(os.getenv("LOG_AMOSTRAGEM_INFO", "1.0"))
+LOG_FILA_MAX = int(os.getenv("LOG_FILA_MAX", "10000"))
+LOG_LOTE = int(os.getenv("LOG_LOTE", "256"))
+
+NIVEIS = {"DEBUG": 10, "INFO": 20, "WARN": 30, "WARNING": 30, "ERROR": 40}
+
+id_requisicao: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("id_requisicao", default=None)
+
+_fila: "queue.Queue" = queue.Queue(maxsize=LOG_FILA_MAX)
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+_PARAR = object()
+
+_stats: Dict[str, int] = {
+    "escritas": 0,
+    "filtradas": 0,
+    "amostradas_fora": 0,
+    "descartadas": 0,
+}
+
+
+def _formatar(item) -> bytes:
+    instante, origem, nivel, mensagem, extra, rid = item
+    payload = {
+        "timestamp": datetime.fromtimestamp(instante, timezone.utc).isoformat(),
+        "origem": origem,
+        "nivel": nivel,
+        "mensagem": mensagem,
+    }
+    if rid:
+        payload["request_id"] = rid
+    if extra:
+        payload["extra"] = extra
+    return json_rapido.dumps(payload) + b"\n"
+
+
+def _escritor():
+    saida = sys.stdout.buffer if hasattr(sys.stdout, "buffer") else None
+    while True:
+        item = _fila.get()
+        lote = [item]
+        while len(lote) < LOG_LOTE:
+            try:
+                lote.append(_fila.get_nowait())
+            except queue.Empty:
+                break
+
+        parar = any(i is _PARAR for i in lote)
+        dados = b"".join(_formatar(i) for i in lote if i is not _PARAR)
+        if dados:
+            if saida is not None:
+                saida.write(dados)
+                saida.flush()
+            else:
+                sys.stdout.write(dados.decode("utf-8"))
+                sys.stdout.flush()
+            _stats["escritas"] += dados.count(b"\n")
+        if parar:
+            return
+
+
+def _garantir_escritor():
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        with _lock:
+            if _thread is None or not _thread.is_alive():
+                _thread = threading.Thread(target=_escritor, name="log-estruturado", daemon=True)
+                _thread.start()
+
+
+def log(origem: str, nivel: str, mensagem: str, extra: Dict[str, Any] | None = None):
+    nivel = nivel.upper()
+    if NIVEIS.get(nivel, 20) < NIVEIS.get(LOG_NIVEL, 20):
+        _stats["filtradas"] += 1
+        return
+    if nivel == "INFO" and LOG_AMOSTRAGEM_INFO < 1.0 and random.random() >= LOG_AMOSTRAGEM_INFO:
+        _stats["amostradas_fora"] += 1
+        return
+
+    _garantir_escritor()
+    try:
+        _fila.put_nowait((time.time(), origem, nivel, mensagem, extra, id_requisicao.get()))
+    except queue.Full:
+        _stats["descartadas"] += 1
+
+
+def encerrar(timeout: float = 5.0):
+    """Escreve o que estiver na fila e para a thread de escrita."""
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        return
+    _fila.put(_PARAR)
+    _thread.join(timeout)
+    _thread = None
+
+
+def estatisticas() -> Dict[str, Any]:
+    return {**_stats, "na_fila": _fila.qsize(), "nivel": LOG_NIVEL, "amostragem_info": LOG_AMOSTRAGEM_INFO}
+
+
+atexit.register(encerrar)
+
+
+class MiddlewareIdRequisicao:
+    """
+    Middleware ASGI: usa X-Request-ID recebido (ou gera um) como id de
+    correlação de todos os logs da requisição e devolve no response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        rid = None
+        for nome, valor in scope.get("headers", []):
+            if nome == b"x-request-id":
+                rid = valor.decode("latin-1")[:128]
+                break
+        rid = rid or uuid.uuid4().hex
+
+        async def enviar(mensagem):
+            if mensagem["type"] == "http.response.start":
+                mensagem.setdefault("headers", []).append((b"x-request-id", rid.encode("latin-1")))
+            await send(mensagem)
+
+        token = id_requisicao.set(rid)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            id_requisicao.reset(token)
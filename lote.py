@@ -0,0 +1,168 @@
+import os
+import re
+from typing import Any, AsyncIterator, List, Optional, Tuple
+
+import json_rapido
+
+# Leitura incremental do corpo de /atualizar/lote.
+# Aceita NDJSON (um registro por linha) ou um array JSON de objetos; em
+# ambos os casos os registros são produzidos conforme os bytes chegam, sem
+# manter o corpo inteiro em memória.
+
+# maior registro aceito (item do array ou linha NDJSON); o buffer nunca passa muito disso
+LOTE_MAX_REGISTRO_BYTES = int(os.getenv("LOTE_MAX_REGISTRO_BYTES", str(1024 * 1024)))
+
+_FORA_DE_STRING = re.compile(r'[\[\]{}",]')
+_DENTRO_DE_STRING = re.compile(r'["\\]')
+
+
+async def _ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[Any, str]]:
+    # só o chunk novo é dividido; a linha em aberto acumula em partes
+    partes: List[bytes] = []
+    tamanho = 0
+    descartando = False  # linha acima do limite: ignora até o próximo \n
+
+    async for chunk in chunks:
+        *completas, ultima = chunk.split(b"\n")
+        for pedaco in completas:
+            if descartando:
+                descartando = False
+            else:
+                partes.append(pedaco)
+                linha = b"".join(partes)
+                if len(linha) > LOTE_MAX_REGISTRO_BYTES:
+                    yield None, f"Registro excede {LOTE_MAX_REGISTRO_BYTES} bytes"
+                elif linha.strip():
+                    yield _carregar(linha)
+            partes, tamanho = [], 0
+
+        if descartando or not ultima:
+            continue
+        partes.append(ultima)
+        tamanho += len(ultima)
+        if tamanho > LOTE_MAX_REGISTRO_BYTES:
+            # a linha é rejeitada sozinha; a leitura segue na próxima
+            yield None, f"Registro excede {LOTE_MAX_REGISTRO_BYTES} bytes"
+            partes, tamanho = [], 0
+            descartando = True
+
+    if partes and not descartando:
+        linha = b"".join(partes)
+        if linha.strip():
+            yield _carregar(linha)
+
+
+def _carregar(linha) -> Tuple[Any, str]:
+    try:
+        return json_rapido.loads(linha), None
+    except ValueError as e:
+        return None, f"JSON inválido: {e}"
+
+
+def _fim_do_registro(buffer: str, estado: List[Any]) -> Optional[int]:
+    """
+    Localiza o fim do registro que está sendo lido, sem decodificá-lo: o
+    `}`/`]` que volta à profundidade zero ou a `,`/`]` de nível superior.
+    Retorna None se o buffer acabar antes; `estado` = [posição, profundidade,
+    dentro_de_string] guarda onde a varredura parou para a próxima chamada.
+    """
+    i, profundidade, em_string = estado
+    while True:
+        if em_string:
+            m = _DENTRO_DE_STRING.search(buffer, i)
+            if m is None or (m.group() == "\\" and m.end() >= len(buffer)):
+                estado[:] = [len(buffer) if m is None else m.start(), profundidade, True]
+                return None
+            if m.group() == '"':
+                em_string = False
+                i = m.end()
+            else:
+                i = m.end() + 1  # pula o caractere escapado
+            continue
+
+        m = _FORA_DE_STRING.search(buffer, i)
+        if m is None:
+            estado[:] = [len(buffer), profundidade, False]
+            return None
+        c, i = m.group(), m.end()
+        if c == '"':
+            em_string = True
+        elif c in "[{":
+            profundidade += 1
+        elif c in "]}":
+            if profundidade == 0:
+                # "]" fecha o array (registro escalar antes dele); "}" solto é erro do registro
+                return m.start() if c == "]" else i
+            profundidade -= 1
+            if profundidade == 0:
+                return i
+        elif profundidade == 0:
+            return m.start()
+
+
+async def _array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[Any, str]]:
+    buffer = ""
+    pos = 0
+    aberto = False
+    pendente = b""
+    # varredura do registro atual (ver _fim_do_registro), relativa ao buffer
+    estado: Optional[List[Any]] = None
+
+    async for chunk in chunks:
+        # chunks podem cortar um caractere UTF-8 multibyte ao meio
+        pendente += chunk
+        try:
+            texto = pendente.decode("utf-8")
+            pendente = b""
+        except UnicodeDecodeError as e:
+            texto = pendente[:e.start].decode("utf-8")
+            pendente = pendente[e.start:]
+
+        buffer = buffer[pos:] + texto
+        if estado is not None:
+            estado[0] -= pos
+        pos = 0
+
+        while True:
+            if estado is None:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos >= len(buffer):
+                    break
+                if not aberto:
+                    if buffer[pos] != "[":
+                        yield None, "Corpo deve ser um array JSON ou NDJSON"
+                        return
+                    aberto = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    return
+                estado = [pos, 0, False]
+
+            fim = _fim_do_registro(buffer, estado)
+            if fim is None:
+                # registro incompleto: aguarda mais bytes, até o limite por registro
+                if len(buffer) - pos > LOTE_MAX_REGISTRO_BYTES:
+                    yield None, f"Registro excede {LOTE_MAX_REGISTRO_BYTES} bytes"
+                    return
+                break
+
+            # um registro malformado é rejeitado sozinho; a leitura segue no próximo
+            yield _carregar(buffer[pos:fim])
+            pos = fim
+            estado = None
+
+    # o "]" final retorna acima: chegar aqui com o array aberto é corpo truncado
+    if aberto or buffer[pos:].strip() or pendente:
+        yield None, "Array JSON incompleto"
+
+
+def registros(chunks: AsyncIterator[bytes], content_type: str) -> AsyncIterator[Tuple[Any, str]]:
+    """
+    Retorna (registro, erro) para cada item do corpo. application/json é
+    tratado como array; qualquer outro tipo (application/x-ndjson) como NDJSON.
+    """
+    if content_type.split(";")[0].strip().lower() == "application/json":
+        return _array(chunks)
+    return _ndjson(chunks)
@@ -1,16 +1,112 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+import asyncio
+import hmac
+import os
+import re
+from contextlib import asynccontextmanager
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
 from datetime import date
 from typing import Optional, List, Dict, Any
-from supabase_client import get_supabase, get_config
+from supabase_client import get_supabase, get_config, executar
+import supabase_client
+import catalogo_metricas
+import ciclo
+import db
+import json_rapido
+import lease
+import log_estruturado
+import lote
+import pontuacao
+import ranking
+import pontuacao_lote
+import cache_respostas
+from affiliate import clickbank, conectores, consolidacao, dedup, ingestao, persistencia, verificacao
+
+
+# ------------------------------------------------------------
+# CICLO DE VIDA (POOL DE CONEXÕES COMPARTILHADO)
+# ------------------------------------------------------------
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    supabase_client.iniciar()
+    tarefa_ranking = asyncio.create_task(ranking.loop_atualizacao())
+    persistencia.iniciar()
+    ingestao.iniciar()
+    tarefa_consolidacao = asyncio.create_task(consolidacao.loop_consolidacao())
+    tarefa_resultados = asyncio.create_task(ciclo.loop_resultados())
+    tarefas_coordenacao = []
+    if lease.ativo():
+        tarefas_coordenacao.append(asyncio.create_task(lease.loop_batimento()))
+    if pontuacao_lote.PONTUACAO_PARTICIONADA_SECONDS > 0:
+        tarefas_coordenacao.append(asyncio.create_task(pontuacao_lote.loop_particionado()))
+    tarefa_clickbank = None
+    if clickbank.CLICKBANK_PULL_INTERVALO_SECONDS > 0:
+        tarefa_clickbank = asyncio.create_task(clickbank.loop_sincronizacao())
+    yield
+    if tarefa_clickbank is not None:
+        tarefa_clickbank.cancel()
+    for tarefa in tarefas_coordenacao:
+        tarefa.cancel()
+    await ingestao.encerrar()
+    await asyncio.to_thread(persistencia.encerrar)
+    tarefa_consolidacao.cancel()
+    try:
+        await consolidacao.descarregar()
+    except Exception as e:
+        log_estruturado.log("CONSOLIDACAO", "ERROR", "Falha na descarga final", extra={"erro": str(e)})
+    tarefa_resultados.cancel()
+    await ciclo.descarregar_resultados_em_segundo_plano()
+    log_estruturado.encerrar()
+    tarefa_ranking.cancel()
+    try:
+        await asyncio.to_thread(lease.encerrar)
+    except Exception as e:
+        log_estruturado.log("LEASE", "ERROR", "Falha ao remover instância", extra={"erro": str(e)})
+    supabase_client.encerrar()
+    db.fechar_pool()
 
 
 app = FastAPI(
     title="Robô Global de Afiliados",
     description="API para ranking e pontuação de produtos usando Supabase.",
-    version="4.0.0"
+    version="4.0.0",
+    lifespan=lifespan,
+    default_response_class=json_rapido.RespostaJSON
 )
 
+app.add_middleware(log_estruturado.MiddlewareIdRequisicao)
+
+# Webhooks de afiliados: um segredo ausente desativa só a rota da plataforma
+CONECTORES_ATIVOS = conectores.registrar_rotas(app)
+
+# ------------------------------------------------------------
+# AUTENTICAÇÃO DAS ROTAS ADMINISTRATIVAS
+# ------------------------------------------------------------
+
+# ADMIN_TOKEN aceita vários tokens separados por vírgula (rotação, como as
+# secrets dos webhooks). Sem token configurado, as rotas ficam fechadas.
+ADMIN_TOKENS = [t.encode("utf-8") for t in verificacao.segredos("ADMIN_TOKEN")]
+
+
+def exigir_admin(request: Request):
+    token = request.headers.get("x-admin-token") or ""
+    autorizacao = request.headers.get("authorization") or ""
+    if autorizacao.lower().startswith("bearer "):
+        token = autorizacao.split(" ", 1)[1].strip()
+
+    recebido = token.encode("utf-8")
+    valido = False
+    for esperado in ADMIN_TOKENS:
+        valido |= hmac.compare_digest(recebido, esperado)
+    if not valido:
+        raise HTTPException(status_code=401, detail="Token administrativo inválido ou ausente")
+
+
+ADMIN = [Depends(exigir_admin)]
+
+
 # ------------------------------------------------------------
 # MODELAGEM DO PAYLOAD /atualizar
 # ------------------------------------------------------------
@@ -33,88 +129,429 @@ class AtualizarPayload(BaseModel):
 async def status():
     try:
         supabase = get_supabase()
-        supabase.table("produtos").select("id_produto").limit(1).execute()
-        return {"status": "ok", "supabase": "conectado"}
+        await executar(supabase.table("produtos").select("id_produto").limit(1))
+        return {
+            "status": "ok",
+            "supabase": "conectado",
+            "operacao_ativa": await asyncio.to_thread(ciclo.operacao_ativa),
+            "pool": {
+                "supabase": supabase_client.saude_pool(),
+                "postgres": db.saude_pool(),
+            }
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ------------------------------------------------------------
+# CICLO OPERACIONAL (CHAMADO POR operational_loop.py)
+# ------------------------------------------------------------
+
+class ResultadoPayload(BaseModel):
+    timestamp: Optional[str] = None
+    resultado: Dict[str, Any] = {}
+
+
+@app.post("/ciclo", dependencies=ADMIN)
+async def executar_ciclo():
+    if not await asyncio.to_thread(ciclo.operacao_ativa):
+        return {"status": "inativa"}
+    return await ciclo.executar_ciclo()
+
+
+@app.post("/resultado", dependencies=ADMIN)
+async def registrar_resultado(payload: ResultadoPayload, background_tasks: BackgroundTasks):
+    if ciclo.registrar_resultado(payload.model_dump()):
+        background_tasks.add_task(ciclo.descarregar_resultados_em_segundo_plano)
+    return {"status": "registrado"}
+
+
+@app.post("/admin/operacao", dependencies=ADMIN)
+async def definir_operacao(ativa: bool):
+    await asyncio.to_thread(ciclo.definir_operacao_ativa, ativa)
+    return ciclo.estatisticas()
+
+
+@app.get("/admin/ciclo", dependencies=ADMIN)
+async def ciclo_estatisticas():
+    return {**ciclo.estatisticas(), "lease": lease.estatisticas()}
+
+
 # ------------------------------------------------------------
 # ENDPOINT /produtos
 # ------------------------------------------------------------
 
+PRODUTOS_LIMITE_PADRAO = 100
+PRODUTOS_LIMITE_MAXIMO = 1000
+PRODUTOS_PAGINA_EXPORTACAO = int(os.getenv("PRODUTOS_PAGINA_EXPORTACAO", "1000"))
+
+_CAMPO_VALIDO = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def projecao_produtos(fields: Optional[str]) -> str:
+    if not fields:
+        return "*"
+
+    campos = [c.strip() for c in fields.split(",") if c.strip()]
+    invalidos = [c for c in campos if not _CAMPO_VALIDO.match(c)]
+    if invalidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos inválidos em fields: {', '.join(invalidos)}"
+        )
+
+    # id_produto é a chave do cursor: sempre projetado
+    if "id_produto" not in campos:
+        campos.insert(0, "id_produto")
+    return ",".join(campos)
+
+
+async def pagina_produtos(supabase, projecao: str, limite: int, cursor: Optional[str],
+                          origem: Optional[str], nome: Optional[str]) -> List[Dict[str, Any]]:
+    consulta = supabase.table("produtos").select(projecao)
+    if cursor:
+        consulta = consulta.gt("id_produto", cursor)
+    if origem:
+        consulta = consulta.eq("origem", origem)
+    if nome:
+        consulta = consulta.ilike("nome", f"%{nome}%")
+
+    result = await executar(consulta.order("id_produto").limit(limite))
+    return result.data
+
+
+async def exportar_produtos(supabase, projecao: str, formato: str,
+                            origem: Optional[str], nome: Optional[str]):
+    # uma página em memória por vez; o primeiro byte sai com a primeira página
+    cursor = None
+    primeiro = True
+
+    if formato == "json":
+        yield b"["
+
+    while True:
+        itens = await pagina_produtos(
+            supabase, projecao, PRODUTOS_PAGINA_EXPORTACAO, cursor, origem, nome
+        )
+
+        for item in itens:
+            if formato == "ndjson":
+                yield json_rapido.dumps(item) + b"\n"
+            else:
+                yield (b"" if primeiro else b",") + json_rapido.dumps(item)
+                primeiro = False
+
+        if len(itens) < PRODUTOS_PAGINA_EXPORTACAO:
+            break
+        cursor = itens[-1]["id_produto"]
+
+    if formato == "json":
+        yield b"]"
+
+
 @app.get("/produtos")
-async def listar_produtos():
+async def listar_produtos(
+    request: Request,
+    limite: int = Query(PRODUTOS_LIMITE_PADRAO, ge=1, le=PRODUTOS_LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    origem: Optional[str] = None,
+    nome: Optional[str] = None,
+    formato: Optional[str] = Query(None, pattern="^(ndjson|json)$")
+):
+    """
+    Paginação por cursor (keyset em id_produto). O cursor da próxima página
+    volta no header X-Proximo-Cursor. Com formato=ndjson|json o catálogo
+    inteiro é exportado em streaming, página a página.
+    """
     supabase = get_supabase()
-    result = supabase.table("produtos").select("*").execute()
-    return result.data
+    projecao = projecao_produtos(fields)
+
+    if formato:
+        return StreamingResponse(
+            exportar_produtos(supabase, projecao, formato, origem, nome),
+            media_type="application/x-ndjson" if formato == "ndjson" else "application/json"
+        )
+
+    def proximo_cursor(itens):
+        if len(itens) == limite:
+            return {"X-Proximo-Cursor": str(itens[-1]["id_produto"])}
+        return {}
+
+    return await cache_respostas.responder(
+        request,
+        ["produtos"],
+        lambda: pagina_produtos(supabase, projecao, limite, cursor, origem, nome),
+        headers=proximo_cursor
+    )
 
 
 # ------------------------------------------------------------
 # ENDPOINT /atualizar  (INSERÇÃO DE MÉTRICAS)
 # ------------------------------------------------------------
 
-@app.post("/atualizar")
-async def atualizar_metricas(payload: AtualizarPayload):
+HISTORICO_ON_CONFLICT = "id_produto,id_metrica,referencia_data"
 
-    supabase = get_supabase()
 
-    id_produto = payload.id_produto
-    referencia = payload.referencia_data or date.today()
-
-    metricas_recebidas = {
+def metricas_do_payload(payload: AtualizarPayload) -> Dict[str, float]:
+    recebidas = {
         "CLIQUES": payload.cliques,
         "VENDAS": payload.vendas,
         "CONVERSAO": payload.conversao,
         "CPC": payload.cpc,
         "ROI": payload.roi
     }
+    return {codigo: valor for codigo, valor in recebidas.items() if valor is not None}
 
-    # 1) Carregar catálogo de métricas
-    catalogo = supabase.table("metricas_tipo").select("*").execute()
-    mapa_metricas = {m["codigo"]: m["id"] for m in catalogo.data}
-
-    processadas = []
-
-    # 2) Inserir ou atualizar métricas
-    for codigo, valor in metricas_recebidas.items():
-
-        if valor is None:
-            continue
 
+def linhas_historico(id_produto: str, referencia: date, metricas: Dict[str, float],
+                     mapa_metricas: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Valida tudo antes de montar qualquer linha: um código desconhecido
+    # não pode deixar um dia gravado pela metade.
+    for codigo in metricas:
         if codigo not in mapa_metricas:
             raise HTTPException(
                 status_code=400,
                 detail=f"Métrica {codigo} não cadastrada no Supabase"
             )
 
-        id_metrica = mapa_metricas[codigo]
-
-        supabase.table("produto_metrica_historico").upsert({
+    return [
+        {
             "id_produto": id_produto,
-            "id_metrica": id_metrica,
+            "id_metrica": mapa_metricas[codigo],
             "valor": valor,
-            "referencia_data": referencia
-        }, on_conflict=["id_produto", "id_metrica", "referencia_data"]).execute()
+            "referencia_data": referencia.isoformat()
+        }
+        for codigo, valor in metricas.items()
+    ]
 
-        processadas.append({codigo: "ok"})
+
+@app.post("/atualizar")
+async def atualizar_metricas(payload: AtualizarPayload):
+
+    supabase = get_supabase()
+
+    id_produto = payload.id_produto
+    referencia = payload.referencia_data or date.today()
+
+    metricas_recebidas = metricas_do_payload(payload)
+
+    # 1) Catálogo de métricas (cache em processo; código desconhecido
+    #    força um único refresh antes de rejeitar)
+    mapa_metricas = await catalogo_metricas.obter_mapa(supabase)
+    if any(c not in mapa_metricas for c in metricas_recebidas):
+        mapa_metricas = await catalogo_metricas.obter_mapa(supabase, forcar=True)
+
+    # 2) Inserir ou atualizar todas as métricas em um único upsert
+    linhas = linhas_historico(id_produto, referencia, metricas_recebidas, mapa_metricas)
+
+    if linhas:
+        await executar(supabase.table("produto_metrica_historico").upsert(
+            linhas, on_conflict=HISTORICO_ON_CONFLICT
+        ))
+        ranking.marcar(id_produto)
+        cache_respostas.invalidar_produto(id_produto)
 
     return {
         "status": "sucesso",
         "referencia_data": str(referencia),
-        "metricas": processadas
+        "metricas": [{codigo: "ok"} for codigo in metricas_recebidas]
+    }
+
+
+# ------------------------------------------------------------
+# ENDPOINT /atualizar/lote  (INGESTÃO EM MASSA — JSON ARRAY OU NDJSON)
+# ------------------------------------------------------------
+
+LOTE_CHUNK_LINHAS = int(os.getenv("LOTE_CHUNK_LINHAS", "500"))
+LOTE_MAX_ERROS = int(os.getenv("LOTE_MAX_ERROS", "1000"))
+
+
+@app.post("/atualizar/lote")
+async def atualizar_metricas_lote(request: Request):
+
+    supabase = get_supabase()
+    mapa_metricas = await catalogo_metricas.obter_mapa(supabase)
+    catalogo_recarregado = False
+
+    resumo = {"recebidos": 0, "gravados": 0, "rejeitados": 0, "linhas": 0, "erros": []}
+
+    # chave de conflito -> linha; evita repetir a mesma chave num upsert
+    pendentes: Dict[tuple, Dict[str, Any]] = {}
+
+    async def gravar():
+        if pendentes:
+            await executar(supabase.table("produto_metrica_historico").upsert(
+                list(pendentes.values()), on_conflict=HISTORICO_ON_CONFLICT
+            ))
+            resumo["linhas"] += len(pendentes)
+            pendentes.clear()
+
+    def rejeitar(indice: int, registro: Any, erro: str):
+        resumo["rejeitados"] += 1
+        if len(resumo["erros"]) < LOTE_MAX_ERROS:
+            id_produto = registro.get("id_produto") if isinstance(registro, dict) else None
+            resumo["erros"].append({"indice": indice, "id_produto": id_produto, "erro": erro})
+
+    indice = -1
+    async for registro, erro in lote.registros(request.stream(), request.headers.get("content-type", "")):
+        indice += 1
+        resumo["recebidos"] += 1
+
+        if erro:
+            rejeitar(indice, registro, erro)
+            continue
+
+        try:
+            payload = AtualizarPayload.model_validate(registro)
+        except ValidationError as e:
+            rejeitar(indice, registro, "; ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+            ))
+            continue
+
+        metricas = metricas_do_payload(payload)
+        if not catalogo_recarregado and any(c not in mapa_metricas for c in metricas):
+            mapa_metricas = await catalogo_metricas.obter_mapa(supabase, forcar=True)
+            catalogo_recarregado = True
+
+        try:
+            linhas = linhas_historico(
+                payload.id_produto,
+                payload.referencia_data or date.today(),
+                metricas,
+                mapa_metricas
+            )
+        except HTTPException as e:
+            rejeitar(indice, registro, e.detail)
+            continue
+
+        for linha in linhas:
+            pendentes[(linha["id_produto"], linha["id_metrica"], linha["referencia_data"])] = linha
+        if linhas:
+            ranking.marcar(payload.id_produto)
+            cache_respostas.invalidar_produto(payload.id_produto)
+        resumo["gravados"] += 1
+
+        if len(pendentes) >= LOTE_CHUNK_LINHAS:
+            await gravar()
+
+    await gravar()
+
+    return {"status": "sucesso" if not resumo["rejeitados"] else "parcial", **resumo}
+
+
+# ------------------------------------------------------------
+# ADMIN — CATÁLOGO DE MÉTRICAS
+# ------------------------------------------------------------
+
+@app.get("/admin/ingestao", dependencies=ADMIN)
+async def ingestao_estatisticas():
+    return {
+        "conectores": CONECTORES_ATIVOS,
+        "verificacao": verificacao.estatisticas(),
+        "fila": await asyncio.to_thread(ingestao.estatisticas),
+        "persistencia": persistencia.estatisticas(),
+        "dedup": dedup.estatisticas(),
+        "consolidacao": consolidacao.estatisticas(),
+        "clickbank_pull": clickbank.estatisticas()
     }
 
 
+@app.post("/admin/clickbank/sincronizar", dependencies=ADMIN)
+async def sincronizar_clickbank(desde: Optional[date] = None, ate: Optional[date] = None):
+    try:
+        return await clickbank.sincronizar(desde, ate)
+    except clickbank.IntervaloInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/admin/log", dependencies=ADMIN)
+async def log_estatisticas():
+    return log_estruturado.estatisticas()
+
+
+@app.get("/admin/cache", dependencies=ADMIN)
+async def cache_estatisticas():
+    return cache_respostas.estatisticas()
+
+
+@app.get("/admin/catalogo", dependencies=ADMIN)
+async def catalogo_estatisticas():
+    return catalogo_metricas.estatisticas()
+
+
+@app.post("/admin/catalogo/recarregar", dependencies=ADMIN)
+async def catalogo_recarregar():
+    supabase = get_supabase()
+    await catalogo_metricas.recarregar(supabase)
+    return catalogo_metricas.estatisticas()
+
+
+# ------------------------------------------------------------
+# ADMIN — RECÁLCULO DO CATÁLOGO INTEIRO (VETORIZADO)
+# ------------------------------------------------------------
+
+@app.post("/admin/pontuacao/recalcular", dependencies=ADMIN)
+async def recalcular_pontuacao_catalogo(particionado: bool = False):
+    # produto_ranking guarda a pontuação de todo o histórico (janela só em /pontuacao/{id})
+    # particionado: só a fatia do catálogo desta instância (hash de id_produto)
+    particao = await asyncio.to_thread(lease.particao) if particionado else None
+    return await asyncio.to_thread(pontuacao_lote.recalcular_catalogo, particao)
+
+
 # ------------------------------------------------------------
 # ENDPOINT /pontuacao (CALCULA PONTUAÇÃO DO PRODUTO)
 # ------------------------------------------------------------
 
 @app.get("/pontuacao/{id_produto}")
-async def calcular_pontuacao(id_produto: str):
+async def calcular_pontuacao(request: Request, id_produto: str, janela_dias: Optional[int] = Query(None, ge=1)):
+    return await cache_respostas.responder(
+        request,
+        [f"produto:{id_produto}"],
+        lambda: pontuacao_produto(id_produto, janela_dias)
+    )
+
+
+async def pontuacao_produto(id_produto: str, janela_dias: Optional[int]) -> Dict[str, Any]:
 
     supabase = get_supabase()
 
-    # 1) Buscar histórico
-    historico = supabase.table("produto_metrica_historico").select("*").eq("id_produto", id_produto).execute()
-    metricas = historico.data
+    # 1) Agregados por métrica calculados no banco (sem trafegar o histórico)
+    agregados = await executar(supabase.rpc("pontuacao_agregados", {
+        "p_id_produto": id_produto,
+        "p_janela_dias": janela_dias
+    }))
+
+    if not agregados.data:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Produto {id_produto} sem histórico de métricas"
+        )
+
+    # 2) Aplicar a fórmula
+    mapa_metricas = await catalogo_metricas.obter_mapa(supabase)
+    codigo_por_id = {id_metrica: codigo for codigo, id_metrica in mapa_metricas.items()}
+
+    return pontuacao.resultado(
+        id_produto,
+        pontuacao.agregados_de_linhas(agregados.data, codigo_por_id),
+        janela_dias
+    )
+
+
+# ------------------------------------------------------------
+# ENDPOINT /ranking (RANKING MATERIALIZADO)
+# ------------------------------------------------------------
+
+@app.get("/ranking")
+async def listar_ranking(
+    limite: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    origem: Optional[str] = None
+):
+    supabase = get_supabase()
+    try:
+        return await ranking.listar(supabase, limite, cursor, origem.upper() if origem else None)
+    except ranking.CursorInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -2,50 +2,152 @@
 # LOOP OPERACIONAL REAL — ROBO GLOBAL AI
 # Executa continuamente no Render
 
-import time
-import requests
-from datetime import datetime
+import asyncio
 import os
+import signal
+from datetime import datetime, timezone
+from typing import Dict, Any, Callable, Awaitable
+
+import httpx
+
+import log_estruturado
 
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+# /ciclo, /resultado e /admin/* exigem o token administrativo (o primeiro, se houver rotação)
+ADMIN_TOKEN = (os.getenv("ADMIN_TOKEN") or "").split(",")[0].strip()
 LOOP_INTERVAL_SECONDS = int(os.getenv("LOOP_INTERVAL_SECONDS", "600"))  # 10 minutos
 
-STATUS_ENDPOINT = f"{API_BASE_URL}/status"
-CICLO_ENDPOINT = f"{API_BASE_URL}/ciclo"
-REGISTRO_ENDPOINT = f"{API_BASE_URL}/resultado"
+# orçamento de tempo por passo do ciclo operacional
+LOOP_TIMEOUT_STATUS = float(os.getenv("LOOP_TIMEOUT_STATUS", "10"))
+LOOP_TIMEOUT_CICLO = float(os.getenv("LOOP_TIMEOUT_CICLO", "300"))  # /ciclo inclui o pull da ClickBank e a fila
+LOOP_TIMEOUT_RESULTADO = float(os.getenv("LOOP_TIMEOUT_RESULTADO", "10"))
+
+# ciclos adicionais no mesmo processo (0 = desativado). O recálculo do
+# catálogo não é disparado daqui: a partição é de cada instância da API
+# (PONTUACAO_PARTICIONADA_SECONDS, pontuacao_lote.loop_particionado), e um
+# POST passa pelo balanceador e cairia numa instância qualquer.
+LOOP_CLICKBANK_SECONDS = int(os.getenv("LOOP_CLICKBANK_SECONDS", "0"))
+LOOP_TIMEOUT_ADMIN = float(os.getenv("LOOP_TIMEOUT_ADMIN", "300"))
+
+STATUS_ENDPOINT = "/status"
+CICLO_ENDPOINT = "/ciclo"
+REGISTRO_ENDPOINT = "/resultado"
+
+# respostas de /ciclo em que nada rodou: não viram registro em ciclos_resultado
+CICLO_NAO_EXECUTADO = {"em_outra_instancia", "em_andamento", "inativa"}
+
 
-def log(msg):
-    print(f"[ROBO-LOOP] {datetime.utcnow().isoformat()} | {msg}", flush=True)
+def log(msg, nivel="INFO", extra=None):
+    log_estruturado.log("ROBO-LOOP", nivel, msg, extra)
 
-def executar_ciclo():
+
+async def _passo(nome: str, coro: Awaitable[httpx.Response], timeout: float) -> Any:
     try:
-        log("Iniciando ciclo operacional")
+        response = await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"passo {nome} excedeu {timeout}s")
+    response.raise_for_status()
+    return response.json()
+
+
+# ===============================
+# TIPOS DE CICLO
+# ===============================
+
+async def executar_ciclo(cliente: httpx.AsyncClient):
+    log("Iniciando ciclo operacional")
+
+    status = await _passo("status", cliente.get(STATUS_ENDPOINT), LOOP_TIMEOUT_STATUS)
+
+    if status.get("operacao_ativa") is not True:
+        log("Operação não ativa — ciclo encerrado")
+        return
 
-        status = requests.get(STATUS_ENDPOINT, timeout=10).json()
+    resultado = await _passo("ciclo", cliente.post(CICLO_ENDPOINT), LOOP_TIMEOUT_CICLO)
+    if resultado.get("status") in CICLO_NAO_EXECUTADO:
+        log(f"Ciclo não executado: {resultado.get('status')}")
+        return
 
-        if status.get("operacao_ativa") is not True:
-            log("Operação não ativa — ciclo encerrado")
-            return
+    await _passo("resultado", cliente.post(REGISTRO_ENDPOINT, json={
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "resultado": resultado
+    }), LOOP_TIMEOUT_RESULTADO)
 
-        response = requests.post(CICLO_ENDPOINT, timeout=30)
-        resultado = response.json()
+    log(f"Ciclo executado com sucesso: {resultado.get('status')}")
 
-        requests.post(REGISTRO_ENDPOINT, json={
-            "timestamp": datetime.utcnow().isoformat(),
-            "resultado": resultado
-        }, timeout=10)
 
-        log(f"Ciclo executado com sucesso: {resultado.get('status')}")
+async def executar_clickbank(cliente: httpx.AsyncClient):
+    resumo = await _passo("clickbank", cliente.post("/admin/clickbank/sincronizar"), LOOP_TIMEOUT_ADMIN)
+    log("Pull ClickBank executado", extra={"enfileirados": resumo.get("enfileirados"), "cursor": resumo.get("cursor")})
 
-    except Exception as e:
-        log(f"ERRO NO CICLO: {str(e)}")
 
-def loop_infinito():
+CICLOS: Dict[str, Dict[str, Any]] = {
+    "operacional": {"intervalo": LOOP_INTERVAL_SECONDS, "executar": executar_ciclo},
+    "clickbank": {"intervalo": LOOP_CLICKBANK_SECONDS, "executar": executar_clickbank},
+}
+
+
+# ===============================
+# AGENDADOR
+# ===============================
+
+async def agendar(nome: str, intervalo: float, executar: Callable[[httpx.AsyncClient], Awaitable[None]],
+                  cliente: httpx.AsyncClient, parar: asyncio.Event):
+    """
+    Ticks em taxa fixa (inicio + k * intervalo), descontando a duração do
+    ciclo. Um ciclo nunca sobrepõe o anterior: ticks perdidos por um ciclo
+    longo são pulados, não acumulados.
+    """
+    loop = asyncio.get_running_loop()
+    inicio = loop.time()
+    tick = 0
+
+    while not parar.is_set():
+        comeco = loop.time()
+        try:
+            await executar(cliente)
+        except Exception as e:
+            log(f"ERRO NO CICLO {nome}: {str(e)}", "ERROR")
+        duracao = loop.time() - comeco
+
+        proximo = tick + 1
+        tick = max(proximo, int((loop.time() - inicio) // intervalo) + 1)
+        if tick > proximo:
+            log(f"Ciclo {nome} durou {duracao:.1f}s — {tick - proximo} tick(s) pulado(s)", "WARN")
+
+        espera = inicio + tick * intervalo - loop.time()
+        log(f"Aguardando {espera:.1f} segundos para próximo ciclo {nome}")
+        try:
+            await asyncio.wait_for(parar.wait(), timeout=max(espera, 0))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def loop_infinito():
     log("LOOP OPERACIONAL INICIADO — ROBO GLOBAL VIVO")
-    while True:
-        executar_ciclo()
-        log(f"Aguardando {LOOP_INTERVAL_SECONDS} segundos para próximo ciclo")
-        time.sleep(LOOP_INTERVAL_SECONDS)
+
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sinal, parar.set)
+        except NotImplementedError:  # pragma: no cover - Windows
+            pass
+
+    ativos = {nome: c for nome, c in CICLOS.items() if c["intervalo"] > 0}
+    async with httpx.AsyncClient(
+        base_url=API_BASE_URL,
+        headers={"Authorization": f"Bearer {ADMIN_TOKEN}"} if ADMIN_TOKEN else None,
+        timeout=max([LOOP_TIMEOUT_STATUS, LOOP_TIMEOUT_CICLO, LOOP_TIMEOUT_RESULTADO, LOOP_TIMEOUT_ADMIN]),
+        limits=httpx.Limits(max_keepalive_connections=len(ativos) or 1),
+    ) as cliente:
+        await asyncio.gather(*(
+            agendar(nome, c["intervalo"], c["executar"], cliente, parar) for nome, c in ativos.items()
+        ))
+
+    log("LOOP OPERACIONAL ENCERRADO")
+    log_estruturado.encerrar()
+
 
 if __name__ == "__main__":
-    loop_infinito()
+    asyncio.run(loop_infinito())
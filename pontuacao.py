@@ -0,0 +1,82 @@
+from typing import Dict, Any, Iterable, List, Optional
+
+# Fórmula de pontuação do produto.
+# Cada métrica contribui com a sua média no período multiplicada pelo peso;
+# CPC entra com peso negativo (custo). O cálculo de produção recebe apenas os
+# agregados por métrica (soma e quantidade) vindos do banco — ver
+# sql/pontuacao_agregados.sql. calcular_pontuacao_referencia() mantém o
+# cálculo sobre o histórico bruto para os testes de paridade.
+# VENDAS_AFILIADOS é a contagem líquida (vendas - estornos) consolidada dos
+# webhooks (affiliate/consolidacao.py), gravada em código próprio porque
+# /atualizar sobrescreve VENDAS; pesa como as vendas informadas.
+
+PESOS = {
+    "CLIQUES": 0.10,
+    "VENDAS": 0.30,
+    "VENDAS_AFILIADOS": 0.30,
+    "CONVERSAO": 0.25,
+    "CPC": -0.10,
+    "ROI": 0.25,
+}
+
+
+def medias(agregados: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    return {
+        codigo: a["soma"] / a["quantidade"]
+        for codigo, a in agregados.items()
+        if a.get("quantidade")
+    }
+
+
+def pontuar(agregados: Dict[str, Dict[str, float]]) -> float:
+    return round(sum(
+        PESOS[codigo] * media
+        for codigo, media in medias(agregados).items()
+        if codigo in PESOS
+    ), 6)
+
+
+def agregados_de_linhas(linhas: Iterable[Dict[str, Any]],
+                        codigo_por_id: Dict[Any, str]) -> Dict[str, Dict[str, float]]:
+    """
+    Converte linhas {id_metrica, soma, quantidade} (saída da RPC) ou linhas
+    brutas {id_metrica, valor} do histórico em agregados por código.
+    """
+    agregados: Dict[str, Dict[str, float]] = {}
+    for linha in linhas:
+        codigo = codigo_por_id.get(linha["id_metrica"])
+        if codigo is None:
+            continue
+        a = agregados.setdefault(codigo, {"soma": 0.0, "quantidade": 0})
+        if "soma" in linha:
+            a["soma"] += float(linha["soma"] or 0)
+            a["quantidade"] += int(linha["quantidade"] or 0)
+        elif linha.get("valor") is not None:
+            a["soma"] += float(linha["valor"])
+            a["quantidade"] += 1
+    return agregados
+
+
+def calcular_pontuacao_referencia(historico: Iterable[Dict[str, Any]],
+                                  codigo_por_id: Dict[Any, str]) -> float:
+    """
+    Implementação de referência, direta sobre o histórico bruto e sem passar
+    pelos agregados: média dos valores de cada métrica vezes o peso.
+    Usada nos testes de paridade (tests/test_pontuacao.py).
+    """
+    valores: Dict[str, List[float]] = {}
+    for linha in historico:
+        codigo = codigo_por_id.get(linha["id_metrica"])
+        if codigo in PESOS and linha.get("valor") is not None:
+            valores.setdefault(codigo, []).append(float(linha["valor"]))
+    return round(sum(PESOS[codigo] * sum(v) / len(v) for codigo, v in valores.items()), 6)
+
+
+def resultado(id_produto: str, agregados: Dict[str, Dict[str, float]],
+              janela_dias: Optional[int]) -> Dict[str, Any]:
+    return {
+        "id_produto": id_produto,
+        "pontuacao": pontuar(agregados),
+        "janela_dias": janela_dias,
+        "metricas": {codigo: round(m, 6) for codigo, m in medias(agregados).items()},
+    }
@@ -0,0 +1,182 @@
+# pontuacao_lote.py
+# Recalcula a pontuação de TODO o catálogo em uma única passada.
+# Lê produto_metrica_historico por cursor de servidor (streaming), acumula
+# soma/quantidade por (produto, métrica) em matrizes NumPy e grava o
+# resultado em produto_ranking com upserts em bloco.
+#
+# Uso: python pontuacao_lote.py [--particao I/N]
+# Também exposto em POST /admin/pontuacao/recalcular. Com várias instâncias,
+# cada uma pode recalcular só a sua partição do catálogo (ver lease.py).
+# produto_ranking guarda a pontuação sobre todo o histórico (a mesma de
+# ranking.py), por isso o recálculo gravado não aceita janela de dias.
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Tuple, List
+
+import numpy as np
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+
+import db
+import lease
+import pontuacao
+from log_estruturado import log
+
+PONTUACAO_LOTE_ITERSIZE = int(os.getenv("PONTUACAO_LOTE_ITERSIZE", "50000"))
+PONTUACAO_LOTE_PAGE_SIZE = int(os.getenv("PONTUACAO_LOTE_PAGE_SIZE", "5000"))
+PONTUACAO_PARTICIONADA_SECONDS = float(os.getenv("PONTUACAO_PARTICIONADA_SECONDS", "0"))  # 0 = sem loop
+
+# linhas iniciais das matrizes; depois a capacidade dobra quando preciso
+CAPACIDADE_INICIAL = 1024
+
+CODIGOS = list(pontuacao.PESOS)
+VETOR_PESOS = np.array([pontuacao.PESOS[c] for c in CODIGOS], dtype=np.float64)
+
+
+def _coluna_por_metrica(conn) -> Dict[Any, int]:
+    with conn.cursor() as cur:
+        cur.execute("select id, codigo from metricas_tipo")
+        return {
+            linha["id"]: CODIGOS.index(linha["codigo"])
+            for linha in cur.fetchall()
+            if linha["codigo"] in pontuacao.PESOS
+        }
+
+
+def _crescer(matriz: np.ndarray, linhas: int) -> np.ndarray:
+    maior = np.zeros((linhas, matriz.shape[1]), dtype=matriz.dtype)
+    maior[:matriz.shape[0]] = matriz
+    return maior
+
+
+def carregar_agregados(conn, particao: Optional[Tuple[int, int]] = None) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Retorna (ids_produto, somas, quantidades); somas e quantidades têm forma
+    (produtos, métricas) na ordem de CODIGOS. A memória cresce com o número de
+    produtos, não com o tamanho do histórico. particao=(indice, total) lê só
+    os produtos com mod(hash(id_produto), total) = indice.
+    """
+    coluna = _coluna_por_metrica(conn)
+
+    sql = "select id_produto, id_metrica, valor from produto_metrica_historico where valor is not null"
+    params: Tuple = ()
+    if particao is not None and particao[1] > 1:
+        sql += " and mod(abs(hashtext(id_produto::text)), %s) = %s"
+        params += (particao[1], particao[0])
+
+    indice: Dict[str, int] = {}
+    somas = np.zeros((0, len(CODIGOS)), dtype=np.float64)
+    quantidades = np.zeros((0, len(CODIGOS)), dtype=np.int64)
+
+    with conn.cursor(name="pontuacao_lote", cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.itersize = PONTUACAO_LOTE_ITERSIZE
+        cur.execute(sql, params)
+
+        while True:
+            linhas = cur.fetchmany(PONTUACAO_LOTE_ITERSIZE)
+            if not linhas:
+                break
+
+            linhas = [l for l in linhas if l[1] in coluna]
+            if not linhas:
+                continue
+
+            produtos = np.fromiter(
+                (indice.setdefault(str(l[0]), len(indice)) for l in linhas),
+                dtype=np.int64, count=len(linhas)
+            )
+            metricas = np.fromiter((coluna[l[1]] for l in linhas), dtype=np.int64, count=len(linhas))
+            valores = np.fromiter((l[2] for l in linhas), dtype=np.float64, count=len(linhas))
+
+            if len(indice) > somas.shape[0]:
+                # crescimento geométrico: realocação amortizada, não uma por bloco
+                capacidade = max(len(indice), 2 * somas.shape[0], CAPACIDADE_INICIAL)
+                somas = _crescer(somas, capacidade)
+                quantidades = _crescer(quantidades, capacidade)
+
+            np.add.at(somas, (produtos, metricas), valores)
+            np.add.at(quantidades, (produtos, metricas), 1)
+
+    return list(indice), somas[:len(indice)], quantidades[:len(indice)]
+
+
+def pontuar_matriz(somas: np.ndarray, quantidades: np.ndarray) -> np.ndarray:
+    """Versão vetorizada de pontuacao.pontuar() para todas as linhas."""
+    medias = np.divide(somas, quantidades, out=np.zeros_like(somas), where=quantidades > 0)
+    return np.round(medias @ VETOR_PESOS, 6)
+
+
+def gravar_ranking(conn, ids_produto: List[str], pontuacoes: np.ndarray):
+    agora = datetime.now(timezone.utc)
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            insert into produto_ranking (id_produto, pontuacao, atualizado_em)
+            values %s
+            on conflict (id_produto) do update
+               set pontuacao = excluded.pontuacao,
+                   atualizado_em = excluded.atualizado_em
+            """,
+            ((id_produto, float(p), agora) for id_produto, p in zip(ids_produto, pontuacoes)),
+            page_size=PONTUACAO_LOTE_PAGE_SIZE,
+        )
+        # produtos que ainda não têm origem no ranking herdam a do cadastro
+        cur.execute(
+            """
+            update produto_ranking r set origem = upper(p.origem)
+              from produtos p
+             where p.id_produto::text = r.id_produto and r.origem is null and p.origem is not null
+            """
+        )
+
+
+def recalcular_catalogo(particao: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+    inicio = time.monotonic()
+
+    with db.get_conn() as conn:
+        ids_produto, somas, quantidades = carregar_agregados(conn, particao)
+        carregado = time.monotonic()
+
+        pontuacoes = pontuar_matriz(somas, quantidades)
+        gravar_ranking(conn, ids_produto, pontuacoes)
+
+    fim = time.monotonic()
+    return {
+        "produtos": len(ids_produto),
+        "particao": list(particao) if particao else None,
+        "tempos": {
+            "leitura_s": round(carregado - inicio, 3),
+            "calculo_e_gravacao_s": round(fim - carregado, 3),
+            "total_s": round(fim - inicio, 3),
+        },
+    }
+
+
+async def loop_particionado():
+    """Cada instância viva recalcula periodicamente só a sua partição do catálogo."""
+    while True:
+        await asyncio.sleep(PONTUACAO_PARTICIONADA_SECONDS)
+        try:
+            particao = await asyncio.to_thread(lease.particao)
+            resumo = await asyncio.to_thread(recalcular_catalogo, particao)
+            log("PONTUACAO", "INFO", "Partição do catálogo recalculada", extra=resumo)
+        except Exception as e:
+            log("PONTUACAO", "ERROR", "Falha ao recalcular partição", extra={"erro": str(e)})
+
+
+def _particao_arg(valor: str) -> Tuple[int, int]:
+    indice, total = valor.split("/")
+    return int(indice), int(total)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalcula a pontuação de todo o catálogo")
+    parser.add_argument("--particao", type=_particao_arg, default=None, help="INDICE/TOTAL, ex.: 0/3")
+    args = parser.parse_args()
+
+    print(recalcular_catalogo(args.particao), flush=True)
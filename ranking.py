@@ -0,0 +1,189 @@
+import asyncio
+import math
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, List, Tuple
+
+import catalogo_metricas
+import pontuacao
+from log_estruturado import log
+from supabase_client import get_supabase, executar
+
+# Ranking materializado em produto_ranking (sql/produto_ranking.sql).
+# /atualizar e a consolidação dos webhooks apenas marcam o produto;
+# atualizar_pendentes() é o único consumidor dos marcados (o laço em
+# background e a etapa de ranking do /ciclo passam por ela, uma de cada vez),
+# recalcula em lote só esses produtos e grava com um único upsert.
+
+RANKING_FLUSH_SECONDS = float(os.getenv("RANKING_FLUSH_SECONDS", "5"))
+RANKING_LOTE = int(os.getenv("RANKING_LOTE", "500"))
+
+_lock = threading.Lock()
+_pendentes: Dict[str, Optional[str]] = {}
+_atualizando: Optional[asyncio.Lock] = None
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def marcar(id_produto: Any, origem: Optional[str] = None):
+    if id_produto is None:
+        return
+    with _lock:
+        _pendentes[str(id_produto)] = origem or _pendentes.get(str(id_produto))
+
+
+def pendentes() -> int:
+    return len(_pendentes)
+
+
+def retirar_pendentes(limite: Optional[int] = RANKING_LOTE) -> Dict[str, Optional[str]]:
+    with _lock:
+        lote = dict(list(_pendentes.items())[:limite])
+        for id_produto in lote:
+            del _pendentes[id_produto]
+    return lote
+
+
+def devolver_pendentes(lote: Dict[str, Optional[str]]):
+    # lote não gravado volta para a próxima rodada
+    with _lock:
+        for id_produto, origem in lote.items():
+            _pendentes.setdefault(id_produto, origem)
+
+
+async def pontuar_produtos(supabase, produtos: Dict[str, Optional[str]]) -> List[Dict[str, Any]]:
+    """Linhas de produto_ranking recalculadas (sem gravar) para os produtos dados."""
+    if not produtos:
+        return []
+
+    mapa_metricas = await catalogo_metricas.obter_mapa(supabase)
+    codigo_por_id = {id_metrica: codigo for codigo, id_metrica in mapa_metricas.items()}
+
+    ids = list(produtos)
+    origens = {id_produto: origem for id_produto, origem in produtos.items() if origem}
+    # /atualizar não informa a origem: vem do cadastro em produtos
+    sem_origem = [id_produto for id_produto in ids if id_produto not in origens]
+    for inicio in range(0, len(sem_origem), RANKING_LOTE):
+        cadastro = await executar(
+            supabase.table("produtos").select("id_produto, origem")
+            .in_("id_produto", sem_origem[inicio:inicio + RANKING_LOTE])
+        )
+        for linha in cadastro.data:
+            if linha.get("origem"):
+                origens[str(linha["id_produto"])] = str(linha["origem"]).upper()
+
+    por_produto: Dict[str, List[Dict[str, Any]]] = {}
+    for inicio in range(0, len(ids), RANKING_LOTE):
+        agregados = await executar(supabase.rpc("pontuacao_agregados_lote", {
+            "p_ids_produto": ids[inicio:inicio + RANKING_LOTE]
+        }))
+        for linha in agregados.data:
+            por_produto.setdefault(linha["id_produto"], []).append(linha)
+
+    agora = datetime.now(timezone.utc).isoformat()
+    resultado = []
+    for id_produto, linhas in por_produto.items():
+        linha = {
+            "id_produto": id_produto,
+            "pontuacao": pontuacao.pontuar(pontuacao.agregados_de_linhas(linhas, codigo_por_id)),
+            "atualizado_em": agora,
+        }
+        if origens.get(id_produto):
+            linha["origem"] = origens[id_produto]
+        resultado.append(linha)
+    return resultado
+
+
+async def gravar(supabase, linhas: List[Dict[str, Any]]) -> int:
+    # sem origem conhecida: não sobrescreve a já gravada (upsert separado)
+    com_origem = [l for l in linhas if "origem" in l]
+    sem_origem = [l for l in linhas if "origem" not in l]
+    for grupo in (com_origem, sem_origem):
+        if grupo:
+            await executar(supabase.table("produto_ranking").upsert(
+                grupo, on_conflict="id_produto"
+            ))
+    return len(linhas)
+
+
+async def recalcular(supabase, produtos: Dict[str, Optional[str]]) -> int:
+    return await gravar(supabase, await pontuar_produtos(supabase, produtos))
+
+
+async def atualizar_pendentes(supabase=None) -> int:
+    """
+    Recalcula e grava todos os produtos marcados até aqui. Uma chamada
+    concorrente espera a anterior: ao retornar, tudo o que estava marcado na
+    entrada já foi gravado (por esta chamada ou pela que estava em curso).
+    """
+    global _atualizando
+    if _atualizando is None:
+        _atualizando = asyncio.Lock()
+
+    supabase = supabase or get_supabase()
+    total = 0
+    async with _atualizando:
+        while _pendentes:
+            lote = retirar_pendentes()
+            try:
+                total += await recalcular(supabase, lote)
+            except Exception:
+                devolver_pendentes(lote)
+                raise
+    return total
+
+
+async def loop_atualizacao():
+    while True:
+        await asyncio.sleep(RANKING_FLUSH_SECONDS)
+        try:
+            await atualizar_pendentes()
+        except Exception as e:
+            log("RANKING", "ERROR", "Falha ao atualizar ranking", extra={"erro": str(e)})
+
+
+def ler_cursor(cursor: str) -> Tuple[float, str]:
+    """"<pontuacao>:<id_produto>" (formato de proximo_cursor)."""
+    pontuacao_txt, separador, id_produto = cursor.partition(":")
+    try:
+        ultima_pontuacao = float(pontuacao_txt)
+    except ValueError:
+        raise CursorInvalido("Cursor inválido")
+    if not separador or not id_produto or not math.isfinite(ultima_pontuacao):
+        raise CursorInvalido("Cursor inválido")
+    return ultima_pontuacao, id_produto
+
+
+def _literal(valor: str) -> str:
+    # valor entre aspas num filtro PostgREST: \ e " escapados
+    return '"' + valor.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+async def listar(supabase, limite: int, cursor: Optional[str] = None,
+                 origem: Optional[str] = None) -> Dict[str, Any]:
+    consulta = supabase.table("produto_ranking").select("id_produto, pontuacao, origem, atualizado_em")
+
+    if origem:
+        consulta = consulta.eq("origem", origem)
+
+    if cursor:
+        # keyset: (pontuacao desc, id_produto asc) após o último item da página
+        ultima_pontuacao, ultimo_id = ler_cursor(cursor)
+        consulta = consulta.or_(
+            f"pontuacao.lt.{ultima_pontuacao!r},"
+            f"and(pontuacao.eq.{ultima_pontuacao!r},id_produto.gt.{_literal(ultimo_id)})"
+        )
+
+    result = await executar(
+        consulta.order("pontuacao", desc=True).order("id_produto").limit(limite)
+    )
+    itens = result.data
+
+    proximo = None
+    if len(itens) == limite:
+        proximo = f"{itens[-1]['pontuacao']}:{itens[-1]['id_produto']}"
+
+    return {"itens": itens, "proximo_cursor": proximo}
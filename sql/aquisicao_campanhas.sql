@@ -0,0 +1,18 @@
+-- Estado das campanhas de aquisição Meta Ads (ver estado_aquisicao.py).
+-- Um registro por campanha, gravado em lote a partir da memória; no restart
+-- as campanhas RUNNING são recarregadas e o monitor retoma sem a Graph API.
+-- atualizado_em impede que uma gravação atrasada sobrescreva uma mais nova.
+
+create table if not exists aquisicao_campanhas (
+    campaign_id   text primary key,
+    adset_ids     jsonb not null default '[]'::jsonb,
+    status        text not null,
+    limite_gasto  numeric not null,
+    started_at    timestamptz not null,
+    last_spend    numeric not null default 0,
+    total_spend   numeric not null default 0,
+    last_error    jsonb,
+    atualizado_em timestamptz not null default now()
+);
+
+create index if not exists aquisicao_campanhas_status_idx on aquisicao_campanhas (status);
@@ -0,0 +1,13 @@
+-- Registros dos ciclos operacionais (POST /resultado, ver ciclo.py).
+-- Gravados em inserts multi-linha a partir de um buffer em memória.
+
+create table if not exists ciclos_resultado (
+    id            bigserial primary key,
+    registrado_em timestamptz not null default now(),
+    status        text,
+    duracao_ms    double precision,
+    resultado     jsonb
+);
+
+create index if not exists ciclos_resultado_registrado_em_idx
+    on ciclos_resultado (registrado_em desc);
@@ -0,0 +1,27 @@
+-- Consolidação dos eventos de afiliados em produto_metrica_historico
+-- (ver affiliate/consolidacao.py). Recebe deltas já agregados por
+-- (produto, métrica, dia) e soma ao valor existente usando a mesma chave de
+-- conflito de /atualizar. Reembolsos e chargebacks chegam como deltas negativos.
+-- Só escreve as métricas próprias da consolidação (abaixo): VENDAS continua
+-- sendo de /atualizar, que sobrescreve em vez de somar.
+
+insert into metricas_tipo (codigo)
+select v.codigo
+  from (values ('VENDAS_AFILIADOS'), ('RECEITA_AFILIADOS')) as v(codigo)
+ where not exists (select 1 from metricas_tipo m where m.codigo = v.codigo);
+
+create or replace function acumular_metrica_historico(p_linhas jsonb)
+returns integer
+language sql
+as $$
+    with gravadas as (
+        insert into produto_metrica_historico (id_produto, id_metrica, valor, referencia_data)
+        select x.id_produto, x.id_metrica, x.valor, x.referencia_data
+          from jsonb_to_recordset(p_linhas)
+               as x(id_produto text, id_metrica bigint, valor double precision, referencia_data date)
+        on conflict (id_produto, id_metrica, referencia_data) do update
+           set valor = coalesce(produto_metrica_historico.valor, 0) + excluded.valor
+        returning 1
+    )
+    select count(*)::integer from gravadas
+$$;
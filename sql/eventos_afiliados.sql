@@ -0,0 +1,29 @@
+-- Eventos normalizados das plataformas de afiliados (ver affiliate/persistencia.py).
+-- Gravados em inserts multi-linha pelo buffer de persistência.
+
+create table if not exists eventos_afiliados (
+    id                 bigserial primary key,
+    origem             text not null,
+    evento             text,
+    status             text,
+    transacao_id       text,
+    produto_id         text,
+    produto_nome       text,
+    afiliado_id        text,
+    comprador_email    text,
+    valor              numeric(14, 2),
+    moeda              text,
+    timestamp_evento   text,
+    timestamp_ingestao timestamptz not null default now(),
+    raw                jsonb,
+    raw_texto          text  -- corpo original quando NORMALIZACAO_RAW=bytes
+);
+
+create index if not exists eventos_afiliados_produto_idx
+    on eventos_afiliados (produto_id, timestamp_ingestao);
+
+-- Idempotência: reentregas das plataformas não geram linhas novas.
+create unique index if not exists eventos_afiliados_dedup_idx
+    on eventos_afiliados (origem, transacao_id, evento);
+
+alter table eventos_afiliados add column if not exists raw_texto text;
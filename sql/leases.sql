@@ -0,0 +1,34 @@
+-- Coordenação entre instâncias (ver lease.py).
+-- leases: um dono por nome até expira_em; o dono renova por heartbeat.
+-- instancias: batimentos das instâncias vivas, usados para particionar
+-- trabalho por hash de produto (mod(abs(hashtext(id_produto)), total)).
+
+create table if not exists leases (
+    nome      text primary key,
+    dono      text not null,
+    expira_em timestamptz not null
+);
+
+create table if not exists instancias (
+    id           text primary key,
+    batimento_em timestamptz not null default now()
+);
+
+create index if not exists instancias_batimento_idx on instancias (batimento_em);
+
+-- operacao: flag de operação ativa (linha única), lida por todas as
+-- instâncias com cache curto (ver ciclo.py, POST /admin/operacao).
+create table if not exists operacao (
+    id            smallint primary key default 1 check (id = 1),
+    ativa         boolean not null,
+    atualizado_em timestamptz not null default now()
+);
+
+-- cursores: marcas d'água compartilhadas das sincronizações pull (ex.:
+-- ClickBank). Só avançam; a instância publica o valor depois que os
+-- pedidos até ele saíram da sua fila local (ver affiliate/clickbank.py).
+create table if not exists cursores (
+    nome          text primary key,
+    valor         text not null,
+    atualizado_em timestamptz not null default now()
+);
@@ -0,0 +1,25 @@
+-- Agregados por métrica para /pontuacao/{id_produto}.
+-- Retorna uma linha por métrica (soma e quantidade) em vez do histórico
+-- completo; p_janela_dias limita o período aos últimos N dias.
+-- Índice recomendado: (id_produto, referencia_data).
+
+create index if not exists produto_metrica_historico_produto_data_idx
+    on produto_metrica_historico (id_produto, referencia_data);
+
+create or replace function pontuacao_agregados(
+    p_id_produto text,
+    p_janela_dias integer default null
+)
+returns table (id_metrica bigint, soma double precision, quantidade bigint)
+language sql
+stable
+as $$
+    select h.id_metrica::bigint,
+           sum(h.valor)::double precision,
+           count(h.valor)
+      from produto_metrica_historico h
+     where h.id_produto = p_id_produto
+       and (p_janela_dias is null
+            or h.referencia_data >= current_date - p_janela_dias)
+     group by h.id_metrica
+$$;
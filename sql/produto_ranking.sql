@@ -0,0 +1,36 @@
+-- Ranking materializado de produtos (servido por GET /ranking).
+-- Atualizado incrementalmente pela API apenas para produtos tocados por
+-- /atualizar ou pelos webhooks de afiliados (ver ranking.py).
+
+create table if not exists produto_ranking (
+    id_produto    text primary key,
+    pontuacao     double precision not null,
+    origem        text,
+    atualizado_em timestamptz not null default now()
+);
+
+create index if not exists produto_ranking_pontuacao_idx
+    on produto_ranking (pontuacao desc, id_produto);
+
+create index if not exists produto_ranking_origem_pontuacao_idx
+    on produto_ranking (origem, pontuacao desc, id_produto);
+
+-- Agregados por métrica para vários produtos de uma vez.
+create or replace function pontuacao_agregados_lote(
+    p_ids_produto text[],
+    p_janela_dias integer default null
+)
+returns table (id_produto text, id_metrica bigint, soma double precision, quantidade bigint)
+language sql
+stable
+as $$
+    select h.id_produto::text,
+           h.id_metrica::bigint,
+           sum(h.valor)::double precision,
+           count(h.valor)
+      from produto_metrica_historico h
+     where h.id_produto = any(p_ids_produto)
+       and (p_janela_dias is null
+            or h.referencia_data >= current_date - p_janela_dias)
+     group by h.id_produto, h.id_metrica
+$$;
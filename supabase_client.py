@@ -1,11 +1,132 @@
+import asyncio
 import os
-from supabase import create_client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional
 
-def get_supabase():
+import httpx
+from supabase import create_client, Client
+from supabase.lib.client_options import SyncClientOptions
+
+# Cliente único por processo: um pool HTTP keep-alive compartilhado por
+# todos os handlers, criado no lifespan do FastAPI (ver main.py).
+_lock = threading.Lock()
+_client: Optional[Client] = None
+_http: Optional[httpx.Client] = None
+
+# supabase-py é síncrono: cada .execute() roda num executor limitado para não
+# bloquear o event loop do uvicorn (SUPABASE_MAX_CONCORRENCIA consultas em voo).
+_executor: Optional[ThreadPoolExecutor] = None
+
+# atualizado pelas threads do executor (hook de resposta do httpx)
+_saude_lock = threading.Lock()
+_saude: Dict[str, Any] = {
+    "iniciado_em": None,
+    "requisicoes": 0,
+    "erros": 0,
+    "ultimo_erro": None,
+    "ultima_resposta": None,
+}
+
+
+def get_config() -> Dict[str, Any]:
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_KEY")
 
     if not url or not key:
         raise Exception("Variáveis de ambiente não configuradas.")
 
-    return create_client(url, key)
+    return {
+        "url": url,
+        "key": key,
+        "pool_size": int(os.getenv("SUPABASE_POOL_SIZE", "20")),
+        "pool_idle_timeout": float(os.getenv("SUPABASE_POOL_IDLE_TIMEOUT", "30")),
+        "timeout": float(os.getenv("SUPABASE_TIMEOUT", "30")),
+        "max_concorrencia": int(os.getenv("SUPABASE_MAX_CONCORRENCIA", "20")),
+    }
+
+
+def _on_response(response: httpx.Response):
+    with _saude_lock:
+        _saude["requisicoes"] += 1
+        _saude["ultima_resposta"] = time.time()
+        if response.status_code >= 500:
+            _saude["erros"] += 1
+            _saude["ultimo_erro"] = f"HTTP {response.status_code}"
+
+
+def iniciar() -> Client:
+    global _client, _http, _executor
+
+    with _lock:
+        if _client is not None:
+            return _client
+
+        config = get_config()
+        _http = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=config["pool_size"],
+                max_keepalive_connections=config["pool_size"],
+                keepalive_expiry=config["pool_idle_timeout"],
+            ),
+            timeout=config["timeout"],
+            event_hooks={"response": [_on_response]},
+        )
+        _client = create_client(
+            config["url"],
+            config["key"],
+            options=SyncClientOptions(httpx_client=_http),
+        )
+        _executor = ThreadPoolExecutor(
+            max_workers=config["max_concorrencia"],
+            thread_name_prefix="supabase",
+        )
+        with _saude_lock:
+            _saude["iniciado_em"] = time.time()
+        return _client
+
+
+def encerrar():
+    global _client, _http, _executor
+
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        if _http is not None:
+            _http.close()
+        _client = None
+        _http = None
+        _executor = None
+        with _saude_lock:
+            _saude["iniciado_em"] = None
+
+
+def get_supabase() -> Client:
+    if _client is None:
+        return iniciar()
+    return _client
+
+
+async def executar(consulta):
+    """
+    Executa uma consulta supabase-py (qualquer builder com .execute()) fora do
+    event loop, respeitando o limite de concorrência do executor.
+    """
+    if _executor is None:
+        iniciar()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, consulta.execute)
+
+
+def saude_pool() -> Dict[str, Any]:
+    config = get_config()
+    with _saude_lock:
+        saude = dict(_saude)
+    return {
+        "ativo": _client is not None,
+        "pool_size": config["pool_size"],
+        "pool_idle_timeout": config["pool_idle_timeout"],
+        "max_concorrencia": config["max_concorrencia"],
+        **saude,
+    }
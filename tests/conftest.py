@@ -0,0 +1,47 @@
+# Fixtures compartilhadas: fila de ingestão num arquivo temporário e
+# armazenamento SQLiteBackend(':memory:') que pode ser "derrubado".
+
+import pytest
+
+from affiliate import conectores, consolidacao, dedup, ingestao, persistencia  # noqa: F401 (registra os processadores)
+
+
+class _Armazenamento:
+    """SQLiteBackend em memória que pode ser "derrubado"."""
+    nome = "teste"
+
+    def __init__(self):
+        self.sqlite = persistencia.SQLiteBackend(":memory:")
+        self.fora = False
+
+    def gravar(self, linhas):
+        if self.fora:
+            raise RuntimeError("armazenamento fora")
+        return self.sqlite.gravar(linhas)
+
+    def linhas(self):
+        with self.sqlite.lock:
+            return self.sqlite.conn.execute(
+                f"select transacao_id, evento from {persistencia.TABELA_EVENTOS} order by transacao_id"
+            ).fetchall()
+
+
+@pytest.fixture
+def armazenamento(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestao, "FILA_INGESTAO_PATH", str(tmp_path / "fila.db"))
+    monkeypatch.setattr(ingestao, "FILA_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(ingestao, "_conn", None)
+    monkeypatch.setattr(persistencia, "_buffer", [])
+    monkeypatch.setattr(persistencia, "_no_buffer", set())
+    monkeypatch.setattr(persistencia, "_gravados", set())
+    monkeypatch.setattr(persistencia, "_primeiro_em", None)
+    monkeypatch.setattr(consolidacao, "_acumulado", {})
+    monkeypatch.setattr(consolidacao, "_origens", {})
+    dedup._vistos.clear()
+
+    backend = _Armazenamento()
+    monkeypatch.setattr(persistencia, "_backend", backend)
+    yield backend
+    if ingestao._conn is not None:
+        ingestao._conn.close()
+    dedup._vistos.clear()
@@ -0,0 +1,139 @@
+# Monitor de campanhas (acquisition_meta_ads.py) contra uma Graph API falsa
+# em httpx.MockTransport: divisão dos batches em 50, pausa no teto, nova
+# tentativa de pausa que falhou e intervalo adaptado aos headers de uso.
+
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+import acquisition_meta_ads as meta
+import estado_aquisicao as estado
+
+
+class GraphFalsa:
+    """Responde requisições batch; gasto, falhas de pausa e headers configuráveis."""
+
+    def __init__(self):
+        self.gastos = {}
+        self.falhar_pausa = set()
+        self.erros = {}
+        self.headers = {}
+        self.batches = []
+        self.pausados = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        operacoes = json.loads(parse_qs(request.content.decode())["batch"][0])
+        self.batches.append(operacoes)
+        return httpx.Response(200, json=[self._operacao(op) for op in operacoes], headers=self.headers)
+
+    def _operacao(self, op):
+        objeto = op["relative_url"].split("/")[0].split("?")[0]
+        if objeto in self.erros:
+            return {"code": 400, "body": json.dumps(self.erros[objeto])}
+        if op["method"] == "GET":
+            gasto = self.gastos.get(objeto)
+            dados = [] if gasto is None else [{} if gasto == "omitido" else {"spend": str(gasto)}]
+            return {"code": 200, "body": json.dumps({"data": dados})}
+        if op.get("body") == "status=PAUSED":
+            if objeto in self.falhar_pausa:
+                return {"code": 500, "body": json.dumps({"error": {"message": "erro"}})}
+            self.pausados.append(objeto)
+        return {"code": 200, "body": json.dumps({"success": True})}
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.setattr(estado, "_campanhas", {})
+    monkeypatch.setattr(estado, "_alteradas", set())
+    monkeypatch.setattr(meta, "_uso", {"pct": 0.0, "bloqueado_ate": 0.0, "backoff": 0})
+    return GraphFalsa()
+
+
+def _rodar(graph, corotina):
+    async def principal():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(graph), base_url="https://graph.teste/v19.0") as c:
+            return await corotina(c)
+    return asyncio.run(principal())
+
+
+def test_batch_divide_em_50_e_preserva_ordem(graph):
+    operacoes = [{"method": "POST", "relative_url": f"obj{i}", "body": "status=ACTIVE"} for i in range(120)]
+    graph.erros = {"obj7": {"error": {"code": 100}}, "obj77": {"error": {"code": 100}}}
+
+    resultados = _rodar(graph, lambda c: meta.batch(c, operacoes))
+
+    assert [len(b) for b in graph.batches] == [50, 50, 20]
+    assert len(resultados) == 120
+    assert [i for i, (codigo, _) in enumerate(resultados) if codigo >= 400] == [7, 77]
+
+
+def test_pausa_no_teto_com_gasto_de_toda_a_vida(graph):
+    meta.acompanhar("c1", ["a1"], 10.0)
+    meta.acompanhar("c2", ["a2"], 10.0)
+    graph.gastos = {"c1": 12.5, "c2": 3}
+
+    gastos = _rodar(graph, meta.verificar)
+
+    assert gastos == {"c1": 12.5, "c2": 3.0}
+    assert all("date_preset=maximum" in op["relative_url"] for op in graph.batches[0])
+    assert sorted(graph.pausados) == ["a1", "c1"]
+    assert estado.obter("c1")["status"] == "CAPPED"
+    assert estado.obter("c2")["status"] == "RUNNING"
+
+
+def test_pausa_que_falhou_e_repetida_na_proxima_rodada(graph):
+    meta.acompanhar("c1", ["a1"], 10.0)
+    graph.gastos = {"c1": 11}
+    graph.falhar_pausa = {"a1"}
+
+    _rodar(graph, meta.verificar)
+    registro = estado.obter("c1")
+    assert registro["status"] == "RUNNING"
+    assert registro["last_error"] == "falha ao pausar"
+
+    graph.falhar_pausa = set()
+    _rodar(graph, meta.verificar)
+    assert estado.obter("c1")["status"] == "CAPPED"
+    assert graph.pausados.count("a1") == 1
+
+
+def test_gasto_omitido_conta_como_zero_sem_backoff(graph):
+    meta.acompanhar("c1", ["a1"], 10.0)
+    meta.acompanhar("c2", ["a2"], 10.0)
+    graph.gastos = {"c1": "omitido"}  # c2: sem linha nenhuma
+
+    assert _rodar(graph, meta.verificar) == {"c1": 0.0, "c2": 0.0}
+    assert meta._uso["backoff"] == 0
+    assert estado.obter("c1")["last_error"] is None
+
+
+def test_intervalo_segue_headers_de_uso_e_limite(graph):
+    meta.acompanhar("c1", ["a1"], 10.0)
+    graph.gastos = {"c1": 1}
+    base = meta.META_MONITOR_INTERVALO_SECONDS
+
+    async def rodada(c):
+        await meta.verificar(c)
+        return meta.proximo_intervalo()
+
+    graph.headers = {"x-app-usage": json.dumps({"call_count": 80, "total_time": 10})}
+    assert _rodar(graph, rodada) == min(base * 4, meta.META_MONITOR_INTERVALO_MAX_SECONDS)
+
+    # erro de limite (código 17) numa operação: backoff exponencial por cima do uso
+    graph.headers = {}
+    graph.erros = {"c1": {"error": {"code": 17, "message": "User request limit reached"}}}
+    assert _rodar(graph, rodada) == min(base * 2, meta.META_MONITOR_INTERVALO_MAX_SECONDS)
+    assert meta._uso["backoff"] == 1
+
+    # rodada sem erro zera o backoff; o bloqueio informado prevalece sobre o teto
+    graph.erros = {}
+    graph.headers = {"x-business-use-case-usage": json.dumps(
+        {"act_1": [{"call_count": 10, "estimated_time_to_regain_access": 30}]}
+    )}
+    intervalo = _rodar(graph, rodada)
+    assert meta._uso["backoff"] == 0
+    assert intervalo > 29 * 60
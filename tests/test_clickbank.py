@@ -0,0 +1,134 @@
+# Pull da ClickBank (affiliate/clickbank.py) contra uma API falsa em
+# httpx.MockTransport: paginação 206/Page, retentativa em 429/5xx com o
+# Retry-After limitado, cursor que não passa de um dia com falha e dedup
+# com um postback já recebido.
+
+import asyncio
+from datetime import date
+from urllib.parse import urlencode
+
+import httpx
+import pytest
+
+from affiliate import clickbank, consolidacao, dedup, ingestao
+
+DIA = date(2024, 3, 10)
+
+
+class ApiFalsa:
+    """Pedidos por dia em páginas; respostas de erro enfileiradas por dia."""
+
+    def __init__(self):
+        self.paginas = {}
+        self.erros = {}
+        self.chamadas = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        dia = request.url.params["startDate"]
+        pagina = int(request.headers["Page"])
+        self.chamadas.append((dia, pagina))
+        erros = self.erros.get(dia)
+        if erros:
+            status, headers = erros.pop(0) if isinstance(erros, list) else erros
+            return httpx.Response(status, headers=headers)
+        paginas = self.paginas.get(dia, [[]])
+        status = 206 if pagina < len(paginas) else 200
+        return httpx.Response(status, json={"orderData": paginas[pagina - 1]})
+
+
+@pytest.fixture
+def api(armazenamento, monkeypatch):
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.setattr(clickbank, "CLICKBANK_PULL_BACKOFF_SECONDS", 0)
+    return ApiFalsa()
+
+
+def _pedido(receipt, produto="p1", valor="10"):
+    return {"receipt": receipt, "transactionType": "SALE", "totalOrderAmount": valor,
+            "lineItemData": {"itemNo": produto}}
+
+
+def _rodar(api, corotina):
+    async def principal():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(api), base_url="https://cb.teste/rest/1.3") as c:
+            return await corotina(c)
+    return asyncio.run(principal())
+
+
+def _sincronizar(api, desde, ate):
+    return _rodar(api, lambda c: clickbank.sincronizar(desde, ate, cliente=c))
+
+
+def test_paginas_206_seguem_ate_a_ultima(api):
+    api.paginas[DIA.isoformat()] = [[_pedido("R1"), _pedido("R2")], [_pedido("R3")], [_pedido("R4")]]
+
+    pedidos = _rodar(api, lambda c: clickbank.buscar_dia(c, DIA))
+
+    assert [p["receipt"] for p in pedidos] == ["R1", "R2", "R3", "R4"]
+    assert api.chamadas == [(DIA.isoformat(), 1), (DIA.isoformat(), 2), (DIA.isoformat(), 3)]
+
+
+def test_429_e_5xx_sao_repetidos_com_retry_after_limitado(api, monkeypatch):
+    monkeypatch.setattr(clickbank, "CLICKBANK_PULL_RETRY_AFTER_MAX_SECONDS", 2)
+    esperas = []
+    dormir = asyncio.sleep
+
+    async def sleep_falso(segundos, *args, **kwargs):
+        esperas.append(segundos)
+        await dormir(0)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep_falso)
+    api.paginas[DIA.isoformat()] = [[_pedido("R1")]]
+    api.erros[DIA.isoformat()] = [(429, {"Retry-After": "3600"}), (503, {})]
+
+    pedidos = _rodar(api, lambda c: clickbank.buscar_dia(c, DIA))
+
+    assert [p["receipt"] for p in pedidos] == ["R1"]
+    assert len(api.chamadas) == 3
+    assert esperas[:2] == [2, 0]
+
+
+def test_erro_4xx_nao_e_repetido(api):
+    api.erros[DIA.isoformat()] = [(403, {})]
+
+    with pytest.raises(clickbank.ErroPull):
+        _rodar(api, lambda c: clickbank.buscar_dia(c, DIA))
+    assert len(api.chamadas) == 1
+
+
+def test_cursor_nao_passa_do_dia_com_falha(api):
+    dias = [date(2024, 3, d) for d in (10, 11, 12, 13)]
+    for i, dia in enumerate(dias):
+        api.paginas[dia.isoformat()] = [[_pedido(f"R{i}")]]
+    api.erros[dias[1].isoformat()] = (500, {})  # falha em todas as tentativas
+
+    resumo = _sincronizar(api, dias[0], dias[-1])
+
+    assert resumo["status"] == "parcial"
+    assert list(resumo["falhas"]) == [dias[1].isoformat()]
+    # os dias seguintes são enfileirados, mas o cursor para antes do buraco
+    assert resumo["enfileirados"] == 3
+    assert ingestao.ler_cursor(clickbank.CURSOR) == dias[0].isoformat()
+
+    # o dia volta: a retomada pelo cursor rebusca o intervalo e o cursor avança
+    del api.erros[dias[1].isoformat()]
+    resumo = _sincronizar(api, None, dias[-1])
+    assert resumo["status"] == "ok"
+    assert ingestao.ler_cursor(clickbank.CURSOR) == dias[-1].isoformat()
+
+
+def test_pedido_ja_recebido_por_postback_e_gravado_uma_vez(api, armazenamento):
+    postback = urlencode({"receipt": "R1", "transactionType": "SALE", "amount": "10", "itemNo": "p1"})
+    ingestao._inserir("CLICKBANK", postback.encode(), {})
+    assert ingestao.processar_lote() == 1
+
+    # outra instância / fora da janela em memória: quem decide é o índice único
+    dedup._vistos.clear()
+    api.paginas[DIA.isoformat()] = [[_pedido("R1"), _pedido("R2")]]
+    assert _sincronizar(api, DIA, DIA)["enfileirados"] == 2
+    while ingestao.processar_lote():
+        pass
+
+    assert armazenamento.linhas() == [("R1", "SALE"), ("R2", "SALE")]
+    vendas = sum(d[consolidacao.VENDAS] for (p, _), d in consolidacao._acumulado.items() if p == "p1")
+    assert vendas == 2
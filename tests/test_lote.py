@@ -0,0 +1,89 @@
+# Leitura incremental de /atualizar/lote (lote.registros): cortes de chunk em
+# qualquer byte, strings com aspas escapadas, registro ruim no meio, registro
+# acima do limite e corpo truncado, nos dois formatos.
+
+import asyncio
+import json
+
+import pytest
+
+import lote
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+
+
+def _ler(corpo: bytes, content_type: str, tamanho: int = 1):
+    async def chunks():
+        for i in range(0, len(corpo), tamanho):
+            yield corpo[i:i + tamanho]
+
+    async def coletar():
+        return [r async for r in lote.registros(chunks(), content_type)]
+
+    return asyncio.run(coletar())
+
+
+REGISTROS = [
+    {"id_produto": "p1", "nome": "Café ☕ — ação", "vendas": 3},
+    {"id_produto": "p\"2", "nome": "aspas \"internas\" e barra \\ final\\", "lista": [1, {"a": "]}"}]},
+    {"id_produto": "p3", "texto": "vírgula, colchete ] e chave }"},
+]
+
+
+@pytest.mark.parametrize("tamanho", [1, 2, 3, 7, 4096])
+def test_array_com_chunks_cortando_utf8_e_escapes(tamanho):
+    corpo = json.dumps(REGISTROS, ensure_ascii=False).encode("utf-8")
+    assert _ler(corpo, JSON, tamanho) == [(r, None) for r in REGISTROS]
+
+
+@pytest.mark.parametrize("tamanho", [1, 2, 3, 7, 4096])
+def test_ndjson_com_chunks_cortando_utf8_e_escapes(tamanho):
+    corpo = "\n".join(json.dumps(r, ensure_ascii=False) for r in REGISTROS).encode("utf-8") + b"\n"
+    assert _ler(corpo, NDJSON, tamanho) == [(r, None) for r in REGISTROS]
+
+
+@pytest.mark.parametrize("content_type,corpo", [
+    (JSON, b'[{"a": 1}, {"b": tru}, {"c": 3}]'),
+    (NDJSON, b'{"a": 1}\n{"b": tru}\n{"c": 3}\n'),
+])
+def test_registro_ruim_no_meio_nao_interrompe(content_type, corpo):
+    resultado = _ler(corpo, content_type, 5)
+    assert [r for r, _ in resultado] == [{"a": 1}, None, {"c": 3}]
+    assert resultado[1][1].startswith("JSON inválido")
+
+
+def test_array_registro_acima_do_limite(monkeypatch):
+    monkeypatch.setattr(lote, "LOTE_MAX_REGISTRO_BYTES", 64)
+    corpo = b'[{"a": 1}, {"grande": "' + b"x" * 500 + b'"}, {"c": 3}]'
+    resultado = _ler(corpo, JSON, 16)
+    assert resultado[0] == ({"a": 1}, None)
+    assert resultado[-1] == (None, "Registro excede 64 bytes")
+
+
+def test_ndjson_linha_acima_do_limite_e_rejeitada_sozinha(monkeypatch):
+    monkeypatch.setattr(lote, "LOTE_MAX_REGISTRO_BYTES", 64)
+    corpo = b'{"a": 1}\n{"grande": "' + b"x" * 500 + b'"}\n{"c": 3}\n'
+    assert _ler(corpo, NDJSON, 16) == [
+        ({"a": 1}, None),
+        (None, "Registro excede 64 bytes"),
+        ({"c": 3}, None),
+    ]
+
+
+def test_ndjson_sem_quebra_de_linha_nao_acumula(monkeypatch):
+    monkeypatch.setattr(lote, "LOTE_MAX_REGISTRO_BYTES", 64)
+    resultado = _ler(b"x" * 10_000, NDJSON, 100)
+    assert resultado == [(None, "Registro excede 64 bytes")]
+
+
+@pytest.mark.parametrize("corpo", [b'[{"a":1}', b'[{"a":1},', b'[{"a":1}, {"b":', b"[", b'["caf\xc3'])
+def test_array_truncado(corpo):
+    resultado = _ler(corpo, JSON, 3)
+    assert resultado[-1] == (None, "Array JSON incompleto")
+    assert all(erro is None for _, erro in resultado[:-1])
+
+
+def test_array_vazio_e_fechado():
+    assert _ler(b"[ ]", JSON) == []
+    assert _ler(b'[{"a":1}]', JSON) == [({"a": 1}, None)]
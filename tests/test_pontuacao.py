@@ -0,0 +1,123 @@
+# Paridade entre a fórmula de referência (histórico bruto), o cálculo de
+# produção sobre agregados (pontuacao.py / RPC pontuacao_agregados) e o
+# recálculo vetorizado do catálogo (pontuacao_lote.py).
+
+import random
+
+import numpy as np
+import psycopg2.extensions
+import pytest
+
+import pontuacao
+import pontuacao_lote
+
+CODIGO_POR_ID = {1: "CLIQUES", 2: "VENDAS", 3: "CONVERSAO", 4: "CPC", 5: "ROI", 6: "IMPRESSOES",
+                 7: "VENDAS_AFILIADOS", 8: "RECEITA_AFILIADOS"}
+
+
+def _historico(produtos=40, seed=7):
+    aleatorio = random.Random(seed)
+    linhas = []
+    for p in range(produtos):
+        for id_metrica in CODIGO_POR_ID:
+            for dia in range(aleatorio.randint(0, 6)):
+                valor = None if aleatorio.random() < 0.1 else round(aleatorio.uniform(-5, 500), 2)
+                linhas.append({
+                    "id_produto": f"p{p:03d}",
+                    "id_metrica": id_metrica,
+                    "valor": valor,
+                    "referencia_data": f"2026-01-{dia + 1:02d}",
+                })
+    aleatorio.shuffle(linhas)
+    return linhas
+
+
+def _por_produto(linhas):
+    grupos = {}
+    for linha in linhas:
+        grupos.setdefault(linha["id_produto"], []).append(linha)
+    return grupos
+
+
+def _como_rpc(linhas):
+    """O que pontuacao_agregados devolve: soma e contagem não nula por métrica."""
+    agregados = {}
+    for linha in linhas:
+        a = agregados.setdefault(linha["id_metrica"], {"id_metrica": linha["id_metrica"], "soma": 0.0, "quantidade": 0})
+        if linha["valor"] is not None:
+            a["soma"] += linha["valor"]
+            a["quantidade"] += 1
+    return list(agregados.values())
+
+
+class _CursorFalso:
+    def __init__(self, linhas):
+        self.linhas = linhas
+        self.itersize = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        self.sql = sql
+
+    def fetchall(self):
+        return self.linhas
+
+    def fetchmany(self, tamanho):
+        lote, self.linhas = self.linhas[:tamanho], self.linhas[tamanho:]
+        return lote
+
+
+class _ConexaoFalsa:
+    """Só o necessário para pontuacao_lote.carregar_agregados."""
+
+    def __init__(self, historico):
+        self.historico = historico
+
+    def cursor(self, name=None, cursor_factory=None):
+        if name is None:
+            return _CursorFalso([{"id": i, "codigo": c} for i, c in CODIGO_POR_ID.items()])
+        assert cursor_factory is psycopg2.extensions.cursor
+        return _CursorFalso([
+            (l["id_produto"], l["id_metrica"], l["valor"]) for l in self.historico if l["valor"] is not None
+        ])
+
+
+def test_agregados_da_rpc_batem_com_a_referencia():
+    for id_produto, linhas in _por_produto(_historico()).items():
+        referencia = pontuacao.calcular_pontuacao_referencia(linhas, CODIGO_POR_ID)
+        producao = pontuacao.pontuar(pontuacao.agregados_de_linhas(_como_rpc(linhas), CODIGO_POR_ID))
+        assert producao == pytest.approx(referencia, abs=1e-6), id_produto
+
+
+def test_agregados_de_linhas_brutas_batem_com_a_referencia():
+    for id_produto, linhas in _por_produto(_historico()).items():
+        referencia = pontuacao.calcular_pontuacao_referencia(linhas, CODIGO_POR_ID)
+        assert pontuacao.pontuar(pontuacao.agregados_de_linhas(linhas, CODIGO_POR_ID)) == pytest.approx(referencia, abs=1e-6)
+
+
+@pytest.mark.parametrize("itersize", [1, 7, 50000])
+def test_recalculo_vetorizado_bate_com_a_referencia(monkeypatch, itersize):
+    historico = _historico()
+    monkeypatch.setattr(pontuacao_lote, "PONTUACAO_LOTE_ITERSIZE", itersize)
+    # força várias realocações das matrizes durante a leitura
+    monkeypatch.setattr(pontuacao_lote, "CAPACIDADE_INICIAL", 1)
+
+    ids_produto, somas, quantidades = pontuacao_lote.carregar_agregados(_ConexaoFalsa(historico))
+    pontuacoes = pontuacao_lote.pontuar_matriz(somas, quantidades)
+
+    grupos = _por_produto(historico)
+    assert len(ids_produto) == len(somas) == len(quantidades)
+    for id_produto, p in zip(ids_produto, pontuacoes):
+        referencia = pontuacao.calcular_pontuacao_referencia(grupos[id_produto], CODIGO_POR_ID)
+        assert float(p) == pytest.approx(referencia, abs=1e-6), id_produto
+
+
+def test_produto_sem_valores_pontua_zero():
+    assert pontuacao.calcular_pontuacao_referencia([{"id_metrica": 2, "valor": None}], CODIGO_POR_ID) == 0
+    assert pontuacao_lote.pontuar_matriz(np.zeros((1, len(pontuacao_lote.CODIGOS))),
+                                          np.zeros((1, len(pontuacao_lote.CODIGOS)), dtype=np.int64))[0] == 0